@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql_crm.settings')
 
 application = get_asgi_application()
+
+# Optionally build the GraphQL schema now (e.g. before a preforking server forks)
+from django.conf import settings
+
+if getattr(settings, 'GRAPHQL_SCHEMA_PRELOAD', False):
+    from alx_backend_graphql_crm.schema import get_schema
+
+    get_schema()
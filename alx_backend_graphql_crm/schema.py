@@ -1,14 +1,52 @@
-import graphene
-from crm.schema import Query as CRMQuery, Mutation as CRMMutation
+"""
+Project schema.
 
-class Query(CRMQuery, graphene.ObjectType):
-    hello = graphene.String()
+The schema is built the first time `schema` is read from this module (which
+is what GRAPHENE["SCHEMA"] does), not when the module is imported. Processes
+that never execute GraphQL, such as management commands and the job worker,
+therefore skip crm.schema, django-filter and the generated filtersets.
+Set GRAPHQL_SCHEMA_PRELOAD to build it in wsgi/asgi startup instead.
+"""
+import threading
 
-    def resolve_hello(root, info):
-        return "Hello, GraphQL!"
+_schema = None
+_lock = threading.Lock()
 
-class Mutation(CRMMutation, graphene.ObjectType):
-    pass
 
+def build_schema():
+    import graphene
+    from graphql import validate_schema
+    from crm.schema import Query as CRMQuery, Mutation as CRMMutation
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+    class Query(CRMQuery, graphene.ObjectType):
+        hello = graphene.String()
+
+        def resolve_hello(root, info):
+            return "Hello, GraphQL!"
+
+    class Mutation(CRMMutation, graphene.ObjectType):
+        pass
+
+    schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    # Validate once up front; graphql-core caches the result on the schema,
+    # so the per-request validate_schema() call in GraphQLView is free.
+    errors = validate_schema(schema.graphql_schema)
+    if errors:
+        raise TypeError("Invalid GraphQL schema: " + "; ".join(str(e) for e in errors))
+    return schema
+
+
+def get_schema():
+    global _schema
+    if _schema is None:
+        with _lock:
+            if _schema is None:
+                _schema = build_schema()
+    return _schema
+
+
+def __getattr__(name):
+    if name == "schema":
+        return get_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'crm.middleware.GraphQLRateLimitMiddleware',
+    'crm.sqllog.SlowSQLMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'crm.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'alx_backend_graphql_crm.urls'
@@ -82,6 +86,49 @@ DATABASES = {
     }
 }
 
+# Optional sharding of customers and their orders (crm.sharding): the aliases
+# of the shard databases. CRM_SHARDS=N in the environment adds N local SQLite
+# shards next to db.sqlite3; migrate each with `migrate --database shardN`.
+CRM_SHARDS = []
+for _n in range(int(os.environ.get('CRM_SHARDS', '0'))):
+    DATABASES[f'shard{_n}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'shard{_n}.sqlite3',
+    }
+    CRM_SHARDS.append(f'shard{_n}')
+
+DATABASE_ROUTERS = ['crm.sharding.ShardRouter'] if CRM_SHARDS else []
+
+
+# Caches
+# "shared" is visible to every worker process on the host
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'tmp' / 'cache',
+    },
+}
+
+# Test runs get a "shared" cache of their own, see crm.test_runner
+TEST_RUNNER = 'crm.test_runner.CRMTestRunner'
+
+# Customer/Product read-through cache (crm.entity_cache): a per-process LRU
+# in front of CACHE, invalidated through per-row version counters. LOCAL_TTL
+# is opt-in: LRU entries are then served that many seconds without checking
+# their version, so other processes' writes (prices!) can be that stale.
+ENTITY_CACHE = {
+    "ENABLED": True,
+    "CACHE": "shared",
+    "MAX_ENTRIES": 10000,
+    "TIMEOUT": 300,
+    "VERSION_TIMEOUT": 86400,
+    "LOCAL_TTL": 0,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,5 +175,149 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 #     "SCHEMA": "alx-backend-graphql_crm.schema.schema"
 # }
 GRAPHENE = {
-    "SCHEMA": "alx_backend_graphql_crm.schema.schema"
+    "SCHEMA": "alx_backend_graphql_crm.schema.schema",
+    # Add "crm.sqllog.FieldPathMiddleware" to tag slow SQL with the path of
+    # every resolver; it wraps each field, so it is for debugging only
+    "MIDDLEWARE": [],
+}
+
+
+# Response encoding for /graphql: dotted path of an encoder class
+# (default: orjson if installed, else the stdlib encoder), and gzip for
+# bodies of at least GRAPHQL_GZIP_MIN_BYTES when the client accepts it
+GRAPHQL_JSON_ENCODER = None
+GRAPHQL_GZIP_MIN_BYTES = 1024
+GRAPHQL_GZIP_LEVEL = 5
+
+# Prometheus metrics at /metrics; each process writes a snapshot into
+# METRICS_DIR at most every METRICS_FLUSH_SECONDS. Operation names past the
+# first METRICS_MAX_LABEL_VALUES a process sees are labelled "other"
+METRICS_ENABLED = True
+METRICS_DIR = BASE_DIR / 'tmp' / 'metrics'
+METRICS_FLUSH_SECONDS = 5
+METRICS_MAX_LABEL_VALUES = 100
+
+# Slow SQL log: statements at or above the threshold (None disables it)
+# are written with their EXPLAIN plan to SLOW_SQL_LOG as JSON lines
+SLOW_SQL_THRESHOLD_MS = 200
+SLOW_SQL_EXPLAIN = True
+SLOW_SQL_LOG = BASE_DIR / 'tmp' / 'slow_sql.log'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_sql': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_SQL_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'formatter': 'message',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'crm.slow_sql': {
+            'handlers': ['slow_sql'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Per-client token buckets for /graphql, see crm.middleware. Buckets live
+# in the 'CACHE' cache shared by the workers; None keeps one per process
+GRAPHQL_RATE_LIMIT = {
+    'CACHE': 'shared',
+    'RATE': 100.0,
+    'BURST': 200,
+    'QUERY_COST': 1,
+    'MUTATION_COST': 5,
+    'MAX_INFLIGHT': 32,
+}
+
+# Build the GraphQL schema at wsgi/asgi startup rather than on first use
+GRAPHQL_SCHEMA_PRELOAD = False
+
+# Largest request body /graphql reads, instead of DATA_UPLOAD_MAX_MEMORY_SIZE
+# (2.5 MB): a bulk job of BULK_JOBS["MAX_ROWS"] customers is around 20 MB
+GRAPHQL_MAX_BODY_BYTES = 32 * 1024 * 1024
+
+# Maximum number of operations accepted in one batched POST to /graphql
+GRAPHQL_MAX_BATCH_SIZE = 10
+
+# Maximum number of global IDs in one nodes(ids:) lookup
+GRAPHQL_MAX_NODE_IDS = 1000
+
+# totalCount on unfiltered connections may come from table statistics
+# (pg_class / sqlite_stat1) once a table has at least MIN_ROWS rows
+GRAPHQL_APPROXIMATE_COUNTS = False
+GRAPHQL_APPROXIMATE_COUNT_MIN_ROWS = 100000
+GRAPHQL_COUNT_CACHE_SECONDS = 60
+
+# Jobs run by the resident worker: python manage.py run_jobs
+CRM_JOBS = [
+    {"name": "crm_heartbeat", "task": "crm.cron.log_crm_heartbeat", "schedule": "*/5 * * * *"},
+    {"name": "low_stock_restock", "task": "crm.cron.update_low_stock", "schedule": "*/10 * * * *"},
+    {"name": "order_reminders", "task": "crm.cron.send_order_reminders", "schedule": "0 8 * * *"},
+    {"name": "customer_cleanup", "task": "crm.cron.clean_inactive_customers", "schedule": "0 2 * * 0"},
+    {"name": "order_archive", "task": "crm.cron.archive_old_orders", "schedule": "0 3 * * *"},
+    {"name": "outbox_prune", "task": "crm.cron.prune_change_events", "schedule": "30 3 * * *"},
+    {"name": "bulk_job_recovery", "task": "crm.bulk_jobs.run_stalled_chunks", "schedule": "*/5 * * * *"},
+]
+
+# Orders older than this are moved to crm.ArchivedOrder; allOrders only reads
+# them with includeArchived: true
+ORDER_ARCHIVE_AFTER_DAYS = 365
+ORDER_ARCHIVE_BATCH_SIZE = 1000
+
+# Order reminders (crm.reminders): each order is reminded once, within this
+# many days of being placed
+REMINDER_WINDOW_DAYS = 7
+REMINDER_BATCH_SIZE = 500
+REMINDER_SETTLE_SECONDS = 60
+
+# Rows per UPDATE statement in bulkUpdateProducts
+BULK_UPDATE_CHUNK_SIZE = 500
+
+# Admin changelists (crm.admin.EstimatedCountPaginator): unfiltered lists of
+# bigger tables use the planner estimate, others count at most ADMIN_COUNT_LIMIT rows
+ADMIN_ESTIMATED_COUNT_MIN_ROWS = 100000
+ADMIN_COUNT_LIMIT = 100000
+
+# Change feed (crm.outbox): events are kept this long
+OUTBOX_RETENTION_DAYS = 30
+
+# Background bulk mutations (crm.bulk_jobs): rows are split into chunks run by
+# `manage.py run_bulk_jobs` processes, so web workers stay free; IN_PROCESS
+# also runs them on WORKERS threads of the web process (e.g. in development)
+BULK_JOBS = {
+    "IN_PROCESS": False,
+    "WORKERS": 2,
+    "CHUNK_SIZE": 1000,
+    "MAX_ROWS": 200000,
+    "LOCK_SECONDS": 300,
+    "MAX_ATTEMPTS": 3,
+}
+
+# Schema artifacts written by `manage.py export_schema`; crm.cron's client
+# loads the SDL instead of introspecting the server on every run
+GRAPHQL_SCHEMA_SDL_PATH = BASE_DIR / 'crm' / 'schema.graphql'
+GRAPHQL_SCHEMA_JSON_PATH = BASE_DIR / 'crm' / 'schema.json'
+
+# Identical read queries arriving while one is executing wait for it and share
+# its response (crm.coalesce), for at most MAX_WAIT seconds
+GRAPHQL_COALESCE_READS = True
+GRAPHQL_COALESCE_MAX_WAIT = 2.0
+
+# On-demand profiling (crm.profiling): requests sending `X-Profile: <TOKEN>`
+# (and optionally `X-Profile-Memory: 1`) run under cProfile/tracemalloc.
+# Disabled while TOKEN is empty.
+GRAPHQL_PROFILING = {
+    "TOKEN": os.environ.get("CRM_PROFILING_TOKEN", ""),
+    "DIRECTORY": "tmp/profiles",
+    "TOP": 20,
 }
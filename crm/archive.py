@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from crm import outbox, sharding
+from crm.models import ArchivedOrder, ChangeEvent, Order
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = getattr(settings, "ORDER_ARCHIVE_AFTER_DAYS", 365)
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_orders(older_than=None, batch_size=None):
+    """
+    Move orders placed before `older_than` (default: ORDER_ARCHIVE_AFTER_DAYS
+    ago) and their product links into ArchivedOrder. Each batch is copied and
+    deleted in its own transaction so locks stay short and an interrupted run
+    simply resumes. Returns the number of orders moved.
+    """
+    if older_than is None:
+        older_than = archive_cutoff()
+    if batch_size is None:
+        batch_size = getattr(settings, "ORDER_ARCHIVE_BATCH_SIZE", 1000)
+
+    order_links = Order.products.through
+    archive_links = ArchivedOrder.products.through
+    moved = 0
+    # With sharding, each shard's orders are archived in that shard
+    for alias in sharding.databases(Order):
+        while True:
+            with sharding.atomic(alias):
+                batch = Order.objects.using(alias).filter(order_date__lt=older_than).order_by("pk")
+                if connections[alias].features.has_select_for_update_skip_locked:
+                    batch = batch.select_for_update(skip_locked=True)
+                orders = list(batch.values_list("pk", "customer_id", "order_date")[:batch_size])
+                if not orders:
+                    break
+
+                ids = [pk for pk, _, _ in orders]
+                ArchivedOrder.objects.using(alias).bulk_create([
+                    ArchivedOrder(id=pk, customer_id=customer_id, order_date=order_date)
+                    for pk, customer_id, order_date in orders
+                ])
+                archive_links.objects.using(alias).bulk_create([
+                    archive_links(archivedorder_id=order_id, product_id=product_id)
+                    for order_id, product_id in order_links.objects.using(alias).filter(order_id__in=ids)
+                    .values_list("order_id", "product_id")
+                ])
+                order_links.objects.using(alias).filter(order_id__in=ids).delete()
+                Order.objects.using(alias).filter(pk__in=ids).delete()
+                outbox.record("order", ChangeEvent.ARCHIVED, ids)
+            moved += len(orders)
+            if len(orders) < batch_size:
+                break
+    return moved
@@ -0,0 +1,321 @@
+"""
+Background bulk mutations.
+
+submit() stores the rows as BulkJobChunk rows and returns at once; the
+chunks are then processed by `manage.py run_bulk_jobs` processes, and also
+in the web process's own thread pool when BULK_JOBS["IN_PROCESS"] is on
+(off by default, so web workers stay free). A chunk is claimed with a conditional UPDATE and written in one
+transaction together with its result, so any number of workers can share a
+job and a chunk interrupted by a crash is simply run again once its lock
+expires. Progress, per-row errors and throughput come from job_status().
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from crm import outbox, sharding
+from crm.models import BulkJob, BulkJobChunk, ChangeEvent, Customer
+from crm.stock import update_products
+from crm.validators import PHONE_MESSAGE, valid_phone
+
+logger = logging.getLogger(__name__)
+
+BULK_JOBS_DEFAULTS = {
+    "IN_PROCESS": False,
+    "WORKERS": 2,
+    "CHUNK_SIZE": 1000,
+    "MAX_ROWS": 200000,
+    "LOCK_SECONDS": 300,
+    "MAX_ATTEMPTS": 3,
+}
+
+
+def bulk_jobs_settings():
+    return {**BULK_JOBS_DEFAULTS, **getattr(settings, "BULK_JOBS", {})}
+
+
+def create_customers(rows, offset=0):
+    """
+    Insert bulkCreateCustomers rows (dicts with name, email and phone) with
+    one existence check and one INSERT, instead of a statement per row.
+    Returns (ids created, [(row, message)]).
+    """
+    errors = []
+    customers = {}
+    for i, row in enumerate(rows, offset):
+        name, email, phone = row.get("name"), row.get("email"), row.get("phone")
+        if not valid_phone(phone):
+            errors.append((i, PHONE_MESSAGE))
+            continue
+        customer = Customer(name=name, email=email, phone=phone)
+        try:
+            customer.full_clean(validate_unique=False, validate_constraints=False)
+        except ValidationError as e:
+            errors.append((i, f"Validation Error: {e}"))
+            continue
+        if email in customers:
+            errors.append((i, "User with this email already exists!"))
+            continue
+        customers[email] = (i, customer)
+
+    taken = set()
+    for queryset in sharding.querysets(Customer.objects.filter(email__in=list(customers))):
+        taken.update(queryset.values_list("email", flat=True))
+    for email in taken:
+        errors.append((customers.pop(email)[0], "User with this email already exists!"))
+
+    # A concurrent insert of the same email fails the whole INSERT, and the
+    # chunk is retried: the existence check then reports it as a row error
+    with transaction.atomic():
+        created = sharding.bulk_create(Customer, [customer for _, customer in customers.values()])
+        ids = [customer.pk for customer in created]
+        outbox.record("customer", ChangeEvent.CREATED, ids)
+    return ids, errors
+
+
+def _update_products(rows, offset=0):
+    _, written, errors = update_products(rows, offset)
+    return written, errors
+
+
+PROCESSORS = {
+    BulkJob.CREATE_CUSTOMERS: create_customers,
+    BulkJob.UPDATE_PRODUCTS: _update_products,
+}
+
+
+def submit(kind, rows, chunk_size=None):
+    """Store `rows` as a job of `kind` and start processing it after commit; returns the BulkJob."""
+    options = bulk_jobs_settings()
+    if kind not in PROCESSORS:
+        raise ValueError(f"Unknown bulk job kind: {kind!r}")
+    if len(rows) > options["MAX_ROWS"]:
+        raise ValueError(f"A bulk job takes at most {options['MAX_ROWS']} rows.")
+    chunk_size = max(1, chunk_size or options["CHUNK_SIZE"])
+    with transaction.atomic():
+        job = BulkJob.objects.create(kind=kind, total_rows=len(rows), chunk_size=chunk_size)
+        BulkJobChunk.objects.bulk_create([
+            BulkJobChunk(
+                job=job,
+                index=index,
+                offset=start,
+                rows=rows[start:start + chunk_size],
+                row_count=len(rows[start:start + chunk_size]),
+            )
+            for index, start in enumerate(range(0, len(rows), chunk_size))
+        ])
+        if options["IN_PROCESS"]:
+            transaction.on_commit(lambda: dispatch(-(-len(rows) // chunk_size)))
+    return job
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def dispatch(chunks=1):
+    """Start up to `chunks` drain() loops on this process's bulk job pool."""
+    global _pool
+    workers = bulk_jobs_settings()["WORKERS"]
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crm-bulk")
+    for _ in range(min(chunks, workers)):
+        _pool.submit(_drain_in_thread)
+
+
+def _drain_in_thread():
+    try:
+        drain()
+    except Exception:
+        logger.exception("Bulk job worker failed")
+    finally:
+        close_old_connections()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def drain(worker=None, limit=None):
+    """Claim and process chunks until none is left (or `limit` are done); returns how many ran."""
+    worker = worker or worker_name()
+    processed = 0
+    while limit is None or processed < limit:
+        chunk = claim_chunk(worker)
+        if chunk is None:
+            break
+        process_chunk(chunk)
+        processed += 1
+    return processed
+
+
+def claim_chunk(worker):
+    """
+    Claim the oldest pending chunk, or a running one whose lock expired.
+    The UPDATE only matches while the chunk is still claimable, so exactly
+    one worker wins each chunk.
+    """
+    options = bulk_jobs_settings()
+    now = timezone.now()
+    # Pending chunks have no lock unless they wait for a retry; running ones hold it while alive
+    claimable = Q(status__in=[BulkJobChunk.PENDING, BulkJobChunk.RUNNING]) & (
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    )
+    candidates = (
+        BulkJobChunk.objects.filter(claimable)
+        .order_by("job_id", "index")
+        .values_list("pk", "attempts")[:10]
+    )
+    for pk, attempts in candidates:
+        if attempts >= options["MAX_ATTEMPTS"]:
+            # Its worker died every time; give up on it instead of looping
+            chunk = BulkJobChunk.objects.only("offset", "row_count").get(pk=pk)
+            BulkJobChunk.objects.filter(claimable, pk=pk).update(
+                **_failed(chunk, f"abandoned after {attempts} attempts")
+            )
+            continue
+        claimed = BulkJobChunk.objects.filter(claimable, pk=pk).update(
+            status=BulkJobChunk.RUNNING,
+            worker=worker,
+            attempts=F("attempts") + 1,
+            locked_until=now + timedelta(seconds=options["LOCK_SECONDS"]),
+            started_at=Coalesce("started_at", now),
+        )
+        if claimed:
+            return BulkJobChunk.objects.select_related("job").get(pk=pk)
+    return None
+
+
+class LostClaim(Exception):
+    """The chunk's lock expired and another worker claimed it meanwhile."""
+
+
+def process_chunk(chunk):
+    """Run one claimed chunk; its writes and its result commit together."""
+    process = PROCESSORS[chunk.job.kind]
+    try:
+        with transaction.atomic():
+            ids, errors = process(chunk.rows, chunk.offset)
+            finished = BulkJobChunk.objects.filter(
+                pk=chunk.pk, status=BulkJobChunk.RUNNING, worker=chunk.worker, attempts=chunk.attempts
+            ).update(
+                status=BulkJobChunk.SUCCEEDED,
+                finished_at=timezone.now(),
+                locked_until=None,
+                rows=[],
+                succeeded=len(ids),
+                errors=sorted([i, message] for i, message in errors),
+            )
+            if not finished:
+                raise LostClaim()
+    except LostClaim:
+        logger.warning("Bulk job %s chunk %s was reclaimed, discarding this run", chunk.job_id, chunk.index)
+    except Exception as e:
+        logger.exception("Bulk job %s chunk %s failed (attempt %d)", chunk.job_id, chunk.index, chunk.attempts)
+        if chunk.attempts < bulk_jobs_settings()["MAX_ATTEMPTS"]:
+            # Back off before the retry so a transient error (a lock, a
+            # restarting database) doesn't use up every attempt at once
+            retry_at = timezone.now() + timedelta(seconds=2 ** chunk.attempts)
+            updates = {"status": BulkJobChunk.PENDING, "locked_until": retry_at}
+        else:
+            updates = _failed(chunk, f"{type(e).__name__}: {e}")
+        BulkJobChunk.objects.filter(pk=chunk.pk, worker=chunk.worker, attempts=chunk.attempts).update(**updates)
+
+
+def _failed(chunk, reason):
+    first = chunk.offset + 1
+    return {
+        "status": BulkJobChunk.FAILED,
+        "finished_at": timezone.now(),
+        "locked_until": None,
+        "rows": [],
+        # No row number: the message covers the whole chunk
+        "errors": [[None, f"Rows {first}-{first + chunk.row_count - 1} not processed: {reason}"]],
+    }
+
+
+def job_status(job):
+    """Progress of `job` from one aggregate over its chunks."""
+    totals = job.chunks.aggregate(
+        processed=Coalesce(Sum("row_count", filter=Q(status=BulkJobChunk.SUCCEEDED)), 0),
+        failed_rows=Coalesce(Sum("row_count", filter=Q(status=BulkJobChunk.FAILED)), 0),
+        succeeded=Coalesce(Sum("succeeded"), 0),
+        open=Count("pk", filter=Q(status__in=[BulkJobChunk.PENDING, BulkJobChunk.RUNNING])),
+        running=Count("pk", filter=Q(status=BulkJobChunk.RUNNING)),
+        failed=Count("pk", filter=Q(status=BulkJobChunk.FAILED)),
+        started_at=Min("started_at"),
+        finished_at=Max("finished_at"),
+    )
+    done = totals["processed"] + totals["failed_rows"]
+    if totals["open"]:
+        status = "running" if totals["running"] or done else "pending"
+        finished_at = None
+    else:
+        status = "failed" if totals["failed"] else "succeeded"
+        finished_at = totals["finished_at"]
+    started_at = totals["started_at"]
+    elapsed = ((finished_at or timezone.now()) - started_at).total_seconds() if started_at else 0
+    return {
+        "status": status,
+        "processed_rows": done,
+        "succeeded_rows": totals["succeeded"],
+        "failed_rows": done - totals["succeeded"],
+        "progress": done / job.total_rows if job.total_rows else 1.0,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "rows_per_second": done / elapsed if elapsed > 0 else None,
+    }
+
+
+def job_errors(job, limit=100):
+    """The first `limit` errors of `job` as (row, message); row is None for a whole failed chunk."""
+    errors = []
+    chunks = job.chunks.exclude(errors=[]).order_by("index").values_list("errors", flat=True)
+    for chunk_errors in chunks.iterator():
+        errors.extend(tuple(error) for error in chunk_errors)
+        if len(errors) >= limit:
+            break
+    return errors[:limit]
+
+
+def run_forever(workers=2, poll_interval=1.0, stop=None):
+    """Drain chunks with `workers` threads, polling for new jobs until `stop` is set."""
+    stop = stop or threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            try:
+                if not drain(limit=1):
+                    stop.wait(poll_interval)
+            except Exception:
+                logger.exception("Bulk job worker failed")
+                stop.wait(poll_interval)
+            finally:
+                close_old_connections()
+
+    threads = [threading.Thread(target=loop, name=f"crm-bulk-{n}") for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_stalled_chunks():
+    """Scheduled job: run chunks left behind by a web process that went away or waiting for a retry."""
+    started = time.monotonic()
+    processed = drain()
+    if processed:
+        logger.info("Ran %d stalled bulk job chunk(s) in %.1fs", processed, time.monotonic() - started)
+    return processed
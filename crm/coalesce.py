@@ -0,0 +1,120 @@
+"""
+Single-flight execution of identical concurrent read queries.
+
+When several requests send the same query operation (same normalized
+document, operation name, variables and credentials) while one of them is
+already executing, the later ones wait for that execution and reuse its
+response instead of running the query again. A waiter gives up after
+GRAPHQL_COALESCE_MAX_WAIT seconds, or when the execution it waited for
+failed, and executes the operation itself.
+
+Flights are tracked with threading primitives, which covers both WSGI
+worker threads and ASGI, where Django runs every request's sync view in a
+thread of its own.
+"""
+import hashlib
+import json
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from graphql import OperationType, get_operation_ast, parse, print_ast
+
+from crm import metrics
+
+
+@lru_cache(maxsize=256)
+def normalized_read(query, operation_name):
+    """Canonical text of the document when it runs a query operation, otherwise None."""
+    try:
+        document = parse(query, no_location=True)
+    except Exception:
+        return None
+    operation = get_operation_ast(document, operation_name)
+    if operation is None or operation.operation != OperationType.QUERY:
+        return None
+    return print_ast(document)
+
+
+def auth_scope(request):
+    """
+    Who is asking, as far as results may differ: credentials headers and the
+    session user. Anonymous requests all share one scope.
+    """
+    parts = [request.headers.get("Authorization", ""), request.headers.get("X-Api-Key", "")]
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        parts.append(f"user:{user.pk}")
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32]
+
+
+def request_key(request, query, variables, operation_name):
+    """Flight key for a read operation, or None when it must not be coalesced."""
+    document = normalized_read(query, operation_name)
+    if document is None:
+        return None
+    try:
+        variables = json.dumps(variables or {}, sort_keys=True)
+    except TypeError:
+        return None
+    return (document, operation_name or "", variables, auth_scope(request))
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, timeout):
+        """
+        Run func() unless an identical call is already in flight, in which
+        case wait up to `timeout` seconds for its result. Returns
+        (result, shared).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            if flight.done.wait(timeout) and flight.ok:
+                return flight.result, True
+            return func(), False
+
+        try:
+            flight.result = func()
+            flight.ok = True
+            return flight.result, False
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+reads = SingleFlight()
+
+
+def execute(request, query, variables, operation_name, func, label=None):
+    """
+    Run func() (which returns the response for the operation) through the
+    read single-flight when coalescing is on and the operation is a query.
+    `label` names the operation in metrics.
+    """
+    key = None
+    if getattr(settings, "GRAPHQL_COALESCE_READS", True):
+        key = request_key(request, query, variables, operation_name)
+    if key is None:
+        return func()
+
+    result, shared = reads.do(key, func, getattr(settings, "GRAPHQL_COALESCE_MAX_WAIT", 2.0))
+    if shared:
+        metrics.inc("crm_graphql_coalesced_total", operation=label or operation_name or "anonymous")
+    return result
@@ -0,0 +1,343 @@
+import heapq
+from functools import cmp_to_key
+from itertools import islice
+
+import graphene
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.db.models.query import QuerySet
+from graphene.relay.connection import page_info_adapter
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql import GraphQLError
+from graphql_relay import cursor_to_offset, get_offset_with_default, offset_to_cursor
+
+from crm import sqllog
+
+
+def estimate_table_rows(model, using="default"):
+    """
+    Row estimate for a whole table from the backend's statistics, cached for
+    GRAPHQL_COUNT_CACHE_SECONDS. Returns None when the backend has none
+    (e.g. SQLite before ANALYZE has been run).
+    """
+    table = model._meta.db_table
+    key = f"crm:table_rows:{using}:{table}"
+    estimate = cache.get(key)
+    if estimate is not None:
+        return estimate
+
+    connection = connections[using]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+                row = cursor.fetchone()
+                estimate = row[0] if row and row[0] >= 0 else None
+            elif connection.vendor == "sqlite":
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                row = cursor.fetchone()
+                estimate = int(row[0].split()[0]) if row else None
+            elif connection.vendor == "mysql":
+                cursor.execute(
+                    "SELECT table_rows FROM information_schema.tables "
+                    "WHERE table_schema = DATABASE() AND table_name = %s", [table]
+                )
+                row = cursor.fetchone()
+                estimate = row[0] if row else None
+    except DatabaseError:
+        estimate = None
+
+    if estimate is not None:
+        cache.set(key, estimate, getattr(settings, "GRAPHQL_COUNT_CACHE_SECONDS", 60))
+    return estimate
+
+
+def count_queryset(queryset):
+    """
+    COUNT(*) for a connection's totalCount. With GRAPHQL_APPROXIMATE_COUNTS
+    enabled, an unfiltered queryset over a table larger than
+    GRAPHQL_APPROXIMATE_COUNT_MIN_ROWS is answered from table statistics.
+    """
+    if not isinstance(queryset, QuerySet):
+        return len(queryset)
+    if getattr(settings, "GRAPHQL_APPROXIMATE_COUNTS", False) and not queryset.query.has_filters():
+        estimate = estimate_table_rows(queryset.model, queryset.db)
+        if estimate is not None and estimate >= getattr(settings, "GRAPHQL_APPROXIMATE_COUNT_MIN_ROWS", 100000):
+            return estimate
+    return queryset.count()
+
+
+def _ordering_value(obj, field):
+    for name in field.split("__"):
+        obj = getattr(obj, name, None)
+        if obj is None:
+            return None
+    return obj
+
+
+def _ordering_key(ordering, nulls_largest=False):
+    """
+    Sort key matching ORDER BY `ordering` on a backend that sorts NULLs as
+    the smallest values (SQLite, MySQL) or, with `nulls_largest`, as the
+    largest (PostgreSQL, Oracle).
+    """
+    fields = [(field.lstrip("-"), field.startswith("-")) for field in ordering]
+
+    def compare(a, b):
+        for field, descending in fields:
+            x, y = _ordering_value(a, field), _ordering_value(b, field)
+            if x == y:
+                continue
+            if x is None or y is None:
+                result = -1 if (x is None) != nulls_largest else 1
+            else:
+                result = -1 if x < y else 1
+            return -result if descending else result
+        return 0
+
+    return cmp_to_key(compare)
+
+
+class MergedQuerySet:
+    """
+    Read-only union of querysets over models with the same shape (e.g. Order
+    and ArchivedOrder), ordered as one sequence.
+
+    Slicing [start:stop] fetches the first `stop` rows of every part with
+    the same ORDER BY and merges them in Python, so it works across tables
+    without a SQL UNION. Once count() is known, a range nearer the end is
+    read from the end instead: `count - start` rows of every part in reverse
+    order, so last/before pages don't load whole tables. An open slice
+    [start:] stays lazy until it is sliced again or iterated. Parts are
+    ordered by their own ordering (which must be plain field names) plus pk
+    as a tie-breaker.
+    """
+
+    def __init__(self, querysets):
+        self.querysets = list(querysets)
+        self._count = None
+
+    def map(self, func):
+        """Apply `func` (e.g. a filterset) to every part."""
+        return MergedQuerySet(func(queryset) for queryset in self.querysets)
+
+    def ordering(self):
+        ordering = [field for field in self.querysets[0].query.order_by if isinstance(field, str)]
+        if len(ordering) != len(self.querysets[0].query.order_by):
+            raise ValueError("MergedQuerySet only supports ordering by field names.")
+        if not any(field.lstrip("-") in ("pk", "id") for field in ordering):
+            ordering.append("pk")
+        return ordering
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(queryset.count() for queryset in self.querysets)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self.fetch(0, None))
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            rows = self[item:item + 1]
+            if not rows:
+                raise IndexError(item)
+            return rows[0]
+        if item.step is not None or (item.start or 0) < 0 or (item.stop is not None and item.stop < 0):
+            raise ValueError("MergedQuerySet only supports non-negative slices without a step.")
+        if item.stop is None:
+            return MergedSlice(self, item.start or 0)
+        return self.fetch(item.start or 0, item.stop)
+
+    def fetch(self, start, stop):
+        """Rows [start:stop] (stop None: to the end) as a list."""
+        ordering = self.ordering()
+        if self._count is not None and start >= self._count:
+            return []
+        from_end = self._count is not None and self._count - start < (self._count if stop is None else stop)
+        if from_end:
+            # Row i counting from the end is row count - 1 - i
+            limit = self._count - start
+            stop = self._count if stop is None else min(stop, self._count)
+            reverse = [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+            parts = [list(queryset[:limit]) for queryset in self._ordered(reverse)]
+            merged = heapq.merge(*parts, key=self._key(ordering), reverse=True)
+            return list(islice(merged, max(self._count - stop, 0), limit))[::-1]
+
+        parts = [
+            list(queryset[:stop] if stop is not None else queryset) for queryset in self._ordered(ordering)
+        ]
+        merged = heapq.merge(*parts, key=self._key(ordering))
+        return list(islice(merged, start, stop))
+
+    def _key(self, ordering):
+        # NULLs go where the parts' own ORDER BY put them
+        features = connections[self.querysets[0].db].features
+        return _ordering_key(ordering, features.nulls_order_largest)
+
+    def _ordered(self, ordering):
+        related = sorted({
+            field.lstrip("-").rsplit("__", 1)[0] for field in ordering if "__" in field
+        })
+        for queryset in self.querysets:
+            queryset = queryset.order_by(*ordering)
+            if related:
+                queryset = queryset.select_related(*related)
+            yield queryset
+
+
+class MergedSlice:
+    """merged[start:], only fetched when sliced again or iterated."""
+
+    def __init__(self, merged, start):
+        self.merged = merged
+        self.start = start
+
+    def __iter__(self):
+        return iter(self.merged.fetch(self.start, None))
+
+    def __getitem__(self, item):
+        stop = None if item.stop is None else self.start + item.stop
+        return self.merged[self.start + (item.start or 0):stop]
+
+
+class CountableConnection(graphene.relay.Connection):
+    """
+    Connection with a `totalCount` field. The count is only computed when
+    totalCount is actually selected.
+    """
+    total_count = graphene.Int()
+
+    class Meta:
+        abstract = True
+
+    def resolve_total_count(self, info):
+        if self.length is None:
+            with sqllog.field_path(info.path):
+                self.length = count_queryset(self.iterable)
+        return self.length
+
+
+def selected_node_fields(info):
+    """Names of the fields selected under `edges { node { ... } }` of this connection."""
+    names = set()
+    for field_node in info.field_nodes:
+        for edges in _selections(field_node, info):
+            if edges.name.value != "edges":
+                continue
+            for node in _selections(edges, info):
+                if node.name.value == "node":
+                    names.update(field.name.value for field in _selections(node, info))
+    return names
+
+
+def selected_fields(info):
+    """Names of the fields selected directly on this field, including those in fragments."""
+    return {field.name.value for field_node in info.field_nodes for field in _selections(field_node, info)}
+
+
+def _selections(node, info):
+    # Field nodes below `node`, looking through fragments
+    if node.selection_set is None:
+        return
+    for selection in node.selection_set.selections:
+        if selection.kind == "field":
+            yield selection
+        elif selection.kind == "fragment_spread":
+            yield from _selections(info.fragments[selection.name.value], info)
+        else:
+            yield from _selections(selection, info)
+
+
+class CountFreeConnectionField(DjangoFilterConnectionField):
+    """
+    DjangoFilterConnectionField that doesn't COUNT(*) the queryset to paginate.
+
+    Forward pagination (first/after/offset) fetches `first + 1` rows and
+    derives hasNextPage from the extra row. Backward pagination (last/before)
+    needs the total to slice from the end, so it falls back to the stock
+    implementation. Negative first, last or offset are rejected.
+
+    If the node type defines a `prefetch_page(nodes, info)` classmethod it
+    is called with the rows of the page, so related data can be loaded for
+    the whole page at once instead of once per row.
+    """
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver, max_limit,
+                            enforce_first_or_last, root, info, **args):
+        for name in ("first", "last", "offset"):
+            if args.get(name) is not None and args[name] < 0:
+                raise GraphQLError(f"`{name}` on the `{info.field_name}` connection can't be negative.")
+        # The page is evaluated here, so slow statements are logged with this field's path
+        with sqllog.field_path(info.path):
+            result = super().connection_resolver(
+                resolver, connection, default_manager, queryset_resolver, max_limit,
+                enforce_first_or_last, root, info, **args
+            )
+            prefetch_page = getattr(connection._meta.node, "prefetch_page", None)
+            if prefetch_page is not None and hasattr(result, "edges"):
+                prefetch_page([edge.node for edge in result.edges], info)
+        return result
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        if isinstance(iterable, MergedQuerySet):
+            return iterable.map(
+                lambda queryset: super(CountFreeConnectionField, cls).resolve_queryset(
+                    connection, queryset, info, args, filtering_args, filterset_class
+                )
+            )
+        return super().resolve_queryset(connection, iterable, info, args, filtering_args, filterset_class)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        if args.get("last") is not None or args.get("before") is not None:
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+        offset = args.pop("offset", None)
+        after = args.get("after")
+        if offset:
+            if after:
+                offset += cursor_to_offset(after) + 1
+            # input offset starts at 1 while the graphene offset starts at 0
+            after = args["after"] = offset_to_cursor(offset - 1)
+
+        iterable = maybe_queryset(iterable)
+
+        start = get_offset_with_default(after, -1) + 1
+        first = args.get("first")
+        if first is None:
+            first = max_limit
+
+        if first is None:
+            rows = list(iterable[start:])
+            has_next_page = False
+        else:
+            rows = list(iterable[start:start + first + 1])
+            has_next_page = len(rows) > first
+            rows = rows[:first]
+
+        edges = [
+            connection.Edge(node=node, cursor=offset_to_cursor(start + i))
+            for i, node in enumerate(rows)
+        ]
+        result = connection(
+            edges=edges,
+            page_info=page_info_adapter(
+                startCursor=edges[0].cursor if edges else None,
+                endCursor=edges[-1].cursor if edges else None,
+                # relay's first/after semantics: never a previous page
+                hasPreviousPage=False,
+                hasNextPage=has_next_page,
+            ),
+        )
+        result.iterable = iterable
+        # The total is only known for free when this is the last page
+        result.length = None if has_next_page or (not rows and start) else start + len(rows)
+        return result
@@ -1,20 +1,37 @@
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from django.conf import settings
 from gql import gql, Client
 from gql.transport.requests import RequestsHTTPTransport
+from crm.metrics import track_job
 
 # file path
 base_dir = os.path.dirname(os.path.dirname(__file__))
 # file_path = os.path.join(base_dir, "tmp", "crm_heartbeat_log.txt")
 file_path = f"{base_dir}/tmp/crm_heartbeat_log.txt"
 file_path_1 = f"{base_dir}/tmp/low_stock_updates_log.txt"
+reminders_log_path = f"{base_dir}/tmp/order_reminders_log.txt"
+cleanup_log_path = f"{base_dir}/tmp/customer_cleanup_log.txt"
+archive_log_path = f"{base_dir}/tmp/order_archive_log.txt"
 
-# Define the transport
-transport = RequestsHTTPTransport(url='http://localhost:8000/graphql')
+_client = None
 
-# Create the Client
-client = Client(transport=transport, fetch_schema_from_transport=True)
 
+def get_client():
+    # Built on first use so importing this module (e.g. in the job worker) stays cheap
+    global _client
+    if _client is None:
+        transport = RequestsHTTPTransport(url='http://localhost:8000/graphql')
+        sdl_path = getattr(settings, "GRAPHQL_SCHEMA_SDL_PATH", None)
+        if sdl_path and os.path.exists(sdl_path):
+            # Exported schema (manage.py export_schema): no introspection round trip
+            with open(sdl_path) as file:
+                _client = Client(transport=transport, schema=file.read())
+        else:
+            _client = Client(transport=transport, fetch_schema_from_transport=True)
+    return _client
+
+@track_job("crm_heartbeat")
 def log_crm_heartbeat():
     # Define a query
     query = gql(
@@ -25,9 +42,9 @@ def log_crm_heartbeat():
     """
     )
 
-    # Execute query
+    # Execute query; this one goes over HTTP on purpose, it checks the web server is up
     try:
-        result = client.execute(query)
+        result = get_client().execute(query)
         print(f"GraphQL response: {result}")
     except Exception as e:
         print(f"GraphQL query failed: {e}")
@@ -37,36 +54,95 @@ def log_crm_heartbeat():
     with open(file_path, "a") as file:
         file.write(f"{timestamp} CRM is alive\n")
 
+@track_job("low_stock_restock")
 def update_low_stock():
-    # Define a mutation
-    mutation = gql(
-    """
-    mutation {
-        updateLowStockProducts {
-            success
-            message
-            productList {
-                id
-                name
-                stock
-            }
-        }
-    }
-    """
-    )
-
-    # Execute query
-    result = client.execute(mutation)
+    from crm.stock import drain_low_stock_queue
 
-    # Get all products
-    products = result['updateLowStockProducts']['productList']
+    # Restock the queued low-stock products in-process
+    products = drain_low_stock_queue()
 
     timestamp = datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
 
     with open(file_path_1, "a") as file:
         for product in products:
-            file.write(f"{timestamp} - {product['name']}: {product['stock']}\n")
+            file.write(f"{timestamp} - {product.name}: {product.stock}\n")
+
+@track_job("order_reminders")
+def send_order_reminders():
+    from crm.reminders import send_order_reminders as remind_new_orders
+
+    # Only orders not reminded yet, resuming from the last run's watermark
+    with open(reminders_log_path, 'a') as file:
+        def send(order):
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            file.write(f"{timestamp} - Order ID: {order.pk}, Customer Email: {order.customer.email}\n")
+            file.flush()
+
+        sent = remind_new_orders(send)
+
+    print(f"Order reminders processed! ({sent} sent)")
+
+@track_job("customer_cleanup")
+def clean_inactive_customers():
+    from django.utils import timezone
+    from crm import outbox, sharding
+    from crm.models import ArchivedOrder, ChangeEvent, Customer, Order
+
+    one_year_ago = timezone.now() - timedelta(days=365)
+    customers_to_delete = (
+        Customer.objects
+        .exclude(orders__order_date__gte=one_year_ago)
+        .exclude(archived_orders__order_date__gte=one_year_ago)
+    )
+    deleted_count = 0
+    # With sharding, customers and their orders are together in each shard
+    for alias in sharding.databases(Customer):
+        with sharding.atomic(alias):
+            ids = list(customers_to_delete.using(alias).values_list("pk", flat=True))
+            # Their orders, live and archived, go with them (on_delete=CASCADE);
+            # followers of the order feed are told too
+            order_ids = [
+                pk
+                for model in (Order, ArchivedOrder)
+                for pk in model.objects.using(alias).filter(customer_id__in=ids).values_list("pk", flat=True)
+            ]
+            outbox.record("order", ChangeEvent.DELETED, order_ids)
+            outbox.record("customer", ChangeEvent.DELETED, ids)
+            Customer.objects.using(alias).filter(pk__in=ids).delete()
+        deleted_count += len(ids)
+    message = f"Deleted {deleted_count} customers with no orders earlier than {one_year_ago.date()}"
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with open(cleanup_log_path, "a") as file:
+        file.write(f"{timestamp} - {message}\n")
+    print(f"{timestamp} - {message}")
+
+@track_job("order_archive")
+def archive_old_orders():
+    from crm.archive import archive_orders
+
+    # Keep the orders table to the recent, frequently queried months
+    moved = archive_orders()
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with open(archive_log_path, "a") as file:
+        file.write(f"{timestamp} - Archived {moved} orders\n")
+
+@track_job("outbox_prune")
+def prune_change_events():
+    from crm.outbox import prune_events
+
+    # Consumers are expected to keep up within OUTBOX_RETENTION_DAYS
+    deleted = prune_events()
+    print(f"Pruned {deleted} change events")
 
 if __name__ == '__main__':
+    import sys
+    import django
+
+    sys.path.insert(0, base_dir)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql_crm.settings")
+    django.setup()
+
     log_crm_heartbeat()
     update_low_stock()
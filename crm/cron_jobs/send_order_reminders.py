@@ -1,61 +1,16 @@
 import os
-from datetime import datetime, timedelta
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+import sys
 
-# Define the transport
-transport = RequestsHTTPTransport(url='http://localhost:8000/graphql')
+import django
 
-seven_days_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+# Prefer the resident job worker (python manage.py run_jobs), which runs this
+# in-process; this script remains for plain crontab setups.
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, base_dir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql_crm.settings")
+django.setup()
 
-# Create the Client
-client = Client(transport=transport, fetch_schema_from_transport=True)
+from crm.cron import send_order_reminders  # noqa: E402
 
-# Define a query
-query = gql(
-   """
-  query getRecentOrders($start: DateTime!) {
-    allOrders(filter: { orderDateGte: $start }) {
-      edges {
-        node {
-          numericId
-          id
-          customer {
-            name
-            email
-          }
-          products {
-            name
-          }
-          totalAmount
-          orderDate
-        }
-      }
-    }
-  }
-  """
-)
-
-# Define variables
-variables = {
-    "start": seven_days_ago
-}
-
-# Execute query
-result = client.execute(query, variable_values=variables)
-
-# file path
-base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-# file_path = os.path.join(base_dir, "tmp", "order_reminders_log.txt")
-file_path = f"{base_dir}/tmp/order_reminders_log.txt"
-
-with open(file_path, 'a') as file:
-  for edge in result['allOrders']['edges']:
-      node = edge['node']
-      order_id = node['numericId']
-      email = node['customer']['email']
-      timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-      line = f"{timestamp} - Order ID: {order_id}, Customer Email: {email}\n"
-      file.write(line)
-
-print("Order reminders processed!")
\ No newline at end of file
+# Each run reminds only the orders placed since the previous one
+send_order_reminders()
@@ -0,0 +1,54 @@
+"""
+JSON encoders for GraphQL responses.
+
+GRAPHQL_JSON_ENCODER names the encoder class to use. By default orjson is
+used when it is installed, otherwise a pre-built stdlib encoder. Both write
+Decimal as its exact string form (as graphene's Decimal scalar does) and
+dates/times in ISO 8601, never via float.
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibJSONEncoder:
+    # json.dumps() builds a new JSONEncoder whenever it gets non-default
+    # arguments; build the compact and pretty ones once instead.
+    compact = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=default)
+    pretty = json.JSONEncoder(sort_keys=True, indent=2, separators=(",", ": "), default=default)
+
+    def encode(self, data, pretty=False):
+        return (self.pretty if pretty else self.compact).encode(data)
+
+
+class OrjsonEncoder(StdlibJSONEncoder):
+    def encode(self, data, pretty=False):
+        if pretty:
+            return super().encode(data, pretty=True)
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def get_encoder():
+    path = getattr(settings, "GRAPHQL_JSON_ENCODER", None)
+    if path:
+        return import_string(path)()
+    return OrjsonEncoder() if orjson is not None else StdlibJSONEncoder()
@@ -0,0 +1,200 @@
+"""
+Read-through cache of Customer and Product rows by primary key.
+
+Two tiers: a bounded LRU in each process and the shared Django cache
+(ENTITY_CACHE["CACHE"]). Every row has a version counter in the shared
+cache and cached copies are stored under the version they were read at,
+so bumping the counter makes every tier miss on its next lookup. Counters
+are bumped, at once and again after commit, by the model signals below and
+explicitly, via invalidate(), after set-based writes (QuerySet.update(),
+upserts) that send no signals.
+
+By default every lookup checks the versions, so no tier ever serves a row
+older than the last committed write. LOCAL_TTL is an opt-in trade: an LRU
+entry whose version was checked less than LOCAL_TTL seconds ago is served
+without asking the shared cache, so a write made by another process can
+take that long to show up here; this process's own writes clear its LRU
+right away.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.test.signals import setting_changed
+
+from crm import metrics, sharding
+
+ENTITY_CACHE_DEFAULTS = {
+    "ENABLED": True,
+    "CACHE": "shared",
+    "MAX_ENTRIES": 10000,  # per model, per process
+    "TIMEOUT": 300,  # seconds in the shared tier
+    "VERSION_TIMEOUT": 86400,  # seconds a version counter is kept
+    "LOCAL_TTL": 0,  # seconds an LRU entry is served without checking its version (opt-in)
+}
+
+
+def entity_cache_settings():
+    return {**ENTITY_CACHE_DEFAULTS, **getattr(settings, "ENTITY_CACHE", {})}
+
+
+class EntityCache:
+    def __init__(self, model, config=None):
+        config = config or entity_cache_settings()
+        self.model = model
+        self.enabled = config["ENABLED"]
+        self.shared = caches[config["CACHE"]]
+        self.max_entries = config["MAX_ENTRIES"]
+        self.timeout = config["TIMEOUT"]
+        self.version_timeout = config["VERSION_TIMEOUT"]
+        self.local_ttl = config["LOCAL_TTL"]
+        self.prefix = f"crm:entity:{model._meta.label_lower}"
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version_key(self, pk):
+        return f"{self.prefix}:{pk}:v"
+
+    def versions(self, pks):
+        keys = {self.version_key(pk): pk for pk in pks}
+        found = self.shared.get_many(list(keys))
+        versions = {}
+        for key, pk in keys.items():
+            version = found.get(key)
+            if version is None:
+                # Seed from the clock so a counter that expired or was
+                # evicted never comes back at a version that was used before
+                self.shared.add(key, time.time_ns(), timeout=self.version_timeout)
+                version = self.shared.get(key)
+            versions[pk] = version
+        return versions
+
+    def get_many(self, pks):
+        """{pk: instance} for the given pks; missing rows are left out."""
+        pks = set(pks)
+        if not pks:
+            return {}
+        if not self.enabled:
+            return sharding.in_bulk(self.model, pks)
+
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            # Checked recently enough: no round trip to the shared tier at all
+            for pk in pks:
+                entry = self._lru.get(pk)
+                if entry is not None and now - entry[2] < self.local_ttl:
+                    self._lru.move_to_end(pk)
+                    result[pk] = entry[1]
+
+        unchecked = pks - result.keys()
+        versions = self.versions(unchecked) if unchecked else {}
+        with self._lock:
+            for pk in unchecked:
+                entry = self._lru.get(pk)
+                if entry is not None and entry[0] == versions[pk]:
+                    self._lru[pk] = (entry[0], entry[1], now)
+                    self._lru.move_to_end(pk)
+                    result[pk] = entry[1]
+        self._record("lru", len(result), len(pks) - len(result))
+
+        missing = pks - result.keys()
+        if missing:
+            keys = {f"{self.prefix}:{pk}:{versions[pk]}": pk for pk in missing}
+            shared = {keys[key]: obj for key, obj in self.shared.get_many(list(keys)).items()}
+            self._record("shared", len(shared), len(missing) - len(shared))
+            result.update(shared)
+
+            fetched = sharding.in_bulk(self.model, missing - shared.keys())
+            if fetched:
+                self.shared.set_many(
+                    {f"{self.prefix}:{pk}:{versions[pk]}": obj for pk, obj in fetched.items()},
+                    timeout=self.timeout,
+                )
+            result.update(fetched)
+            self._remember({pk: (versions[pk], result[pk], now) for pk in missing if pk in result})
+
+        # Callers get their own copy; the cached instances are shared between threads
+        return {pk: copy.copy(obj) for pk, obj in result.items()}
+
+    def _remember(self, entries):
+        with self._lock:
+            self._lru.update(entries)
+            for pk in entries:
+                self._lru.move_to_end(pk)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _record(self, tier, hits, misses):
+        cache = f"entity_{self.model._meta.model_name}_{tier}"
+        if hits:
+            metrics.inc("crm_cache_requests_total", hits, cache=cache, result="hit")
+        if misses:
+            metrics.inc("crm_cache_requests_total", misses, cache=cache, result="miss")
+
+    def bump(self, pks):
+        for pk in pks:
+            key = self.version_key(pk)
+            try:
+                self.shared.incr(key)
+            except ValueError:
+                self.shared.set(key, time.time_ns(), timeout=self.version_timeout)
+        with self._lock:
+            for pk in pks:
+                self._lru.pop(pk, None)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def entity_cache(model):
+    with _caches_lock:
+        if model not in _caches:
+            _caches[model] = EntityCache(model)
+        return _caches[model]
+
+
+def invalidate(model, pks):
+    """
+    Bump the versions of the given rows (and refresh their copies in the
+    shards) once the current transaction commits. Call after writes that
+    bypass Model.save()/delete().
+    """
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        # Now, so reads later in this transaction see the write, and again
+        # after commit, since another process may have cached the old row
+        # in between
+        entity_cache(model).bump(pks)
+        transaction.on_commit(lambda: entity_cache(model).bump(pks))
+        if sharding.enabled() and sharding.is_replicated(model):
+            transaction.on_commit(lambda: sharding.replicate(model, pks))
+
+
+def _invalidate_instance(sender, instance, using=None, **kwargs):
+    # Shard copies of products are written by sharding.replicate() itself
+    if using in sharding.shards() and sharding.is_replicated(sender):
+        return
+    invalidate(sender, [instance.pk])
+
+
+def _reset_caches(setting, **kwargs):
+    # e.g. override_settings(ENTITY_CACHE={"ENABLED": False}) in tests
+    if setting in ("ENTITY_CACHE", "CACHES"):
+        with _caches_lock:
+            _caches.clear()
+
+
+def connect_signals():
+    from crm.models import Customer, Product
+
+    setting_changed.connect(_reset_caches, dispatch_uid="entity_cache_settings")
+    for model in (Customer, Product):
+        post_save.connect(_invalidate_instance, sender=model, dispatch_uid=f"entity_cache_save_{model.__name__}")
+        post_delete.connect(_invalidate_instance, sender=model, dispatch_uid=f"entity_cache_delete_{model.__name__}")
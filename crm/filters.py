@@ -1,8 +1,75 @@
 import django_filters
-from django.db.models import Sum
+from django.db.models import DecimalField, Exists, F, OuterRef, Subquery, Sum
 from .models import Customer, Product, Order
 
 
+def order_products_through(model):
+    # (through model, name of its FK to the order) for Order or ArchivedOrder
+    field = model._meta.get_field("products")
+    return field.remote_field.through, field.m2m_field_name()
+
+
+def order_total_subquery(model=Order):
+    """
+    Correlated scalar subquery computing an order's total from its products.
+    Unlike annotating Sum("products__price") it needs no GROUP BY on the outer
+    query and is not inflated by other joins against the products table.
+    """
+    through, order_field = order_products_through(model)
+    totals = (
+        through.objects
+        .filter(**{f"{order_field}_id": OuterRef("pk")})
+        .values(f"{order_field}_id")
+        .annotate(total=Sum("product__price"))
+        .values("total")
+    )
+    return Subquery(totals[:1], output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def order_has_product(model=Order, **lookups):
+    """
+    Correlated EXISTS over the order/product through table, e.g.
+    order_has_product(name__icontains="lap"). Never multiplies order rows.
+    """
+    through, order_field = order_products_through(model)
+    lookups = {f"product__{key}": value for key, value in lookups.items()}
+    return Exists(
+        through.objects.filter(**{f"{order_field}_id": OuterRef("pk")}, **lookups)
+    )
+
+
+def with_order_total(queryset):
+    if "total_amount_db" in queryset.query.annotations:
+        return queryset
+    return queryset.annotate(total_amount_db=order_total_subquery(queryset.model))
+
+
+def filter_orders(queryset, filter):
+    """
+    Apply the `allOrders(filter: ...)` input to an Order or ArchivedOrder queryset.
+    Product predicates compile to EXISTS and totals to a scalar subquery,
+    the latter only when a total bound is actually given.
+    """
+    if filter.get("orderDateGte"):
+        queryset = queryset.filter(order_date__gte=filter["orderDateGte"])
+    if filter.get("orderDateLte"):
+        queryset = queryset.filter(order_date__lte=filter["orderDateLte"])
+    if filter.get("customerName"):
+        queryset = queryset.filter(customer__name__icontains=filter["customerName"])
+    if filter.get("productName"):
+        queryset = queryset.filter(order_has_product(queryset.model, name__icontains=filter["productName"]))
+    if filter.get("productId"):
+        try:
+            queryset = queryset.filter(order_has_product(queryset.model, id=int(filter["productId"])))
+        except (TypeError, ValueError):
+            return queryset.none()
+    if filter.get("totalAmountGte") is not None:
+        queryset = with_order_total(queryset).filter(total_amount_db__gte=filter["totalAmountGte"])
+    if filter.get("totalAmountLte") is not None:
+        queryset = with_order_total(queryset).filter(total_amount_db__lte=filter["totalAmountLte"])
+    return queryset
+
+
 class CustomerFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(field_name="name", lookup_expr="icontains")
     email = django_filters.CharFilter(field_name="email", lookup_expr='icontains')
@@ -35,6 +102,7 @@ class ProductFilter(django_filters.FilterSet):
     stock_gte = django_filters.NumberFilter(field_name="stock", lookup_expr='gte')
     stock_lte = django_filters.NumberFilter(field_name="stock", lookup_expr='lte')
     stock_less_than_10 = django_filters.BooleanFilter(method='filter_stock_less_than_10')
+    low_stock = django_filters.BooleanFilter(method='filter_low_stock')
 
     order_by = django_filters.OrderingFilter(
         fields=(
@@ -56,6 +124,14 @@ class ProductFilter(django_filters.FilterSet):
             return queryset.filter(stock__lt=10)
         return queryset
 
+    def filter_low_stock(self, queryset, name, value):
+        """
+        Custom filter: stock below the product's own low_stock_threshold
+        """
+        if value:
+            return queryset.filter(stock__lt=F('low_stock_threshold'))
+        return queryset
+
 
 class OrderFilter(django_filters.FilterSet):
     # Total amount range
@@ -70,15 +146,17 @@ class OrderFilter(django_filters.FilterSet):
     customer_name = django_filters.CharFilter(field_name="customer__name", lookup_expr='icontains')
 
     # Product name
-    product_name = django_filters.CharFilter(field_name="products__name", lookup_expr='icontains')
+    product_name = django_filters.CharFilter(method='filter_product_name')
 
     # Product ID
-    product_id = django_filters.NumberFilter(field_name="products__id", lookup_expr='exact')
+    product_id = django_filters.NumberFilter(method='filter_product_id')
 
     order_by = django_filters.OrderingFilter(
         fields=(
             ('order_date', 'order_date'),
             ('customer__name', 'customer_name'),
+            # annotated by resolve_all_orders before the filterset runs
+            ('total_amount_db', 'total_amount_db'),
         )
     )
 
@@ -87,7 +165,13 @@ class OrderFilter(django_filters.FilterSet):
         fields = ["customer", "products", "order_date"]
 
     def filter_total_gte(self, queryset, name, value):
-        return queryset.annotate(total_price=Sum('products__price')).filter(total_price__gte=value)
+        return with_order_total(queryset).filter(total_amount_db__gte=value)
 
     def filter_total_lte(self, queryset, name, value):
-        return queryset.annotate(total_price=Sum('products__price')).filter(total_price__lte=value)
+        return with_order_total(queryset).filter(total_amount_db__lte=value)
+
+    def filter_product_name(self, queryset, name, value):
+        return queryset.filter(order_has_product(queryset.model, name__icontains=value))
+
+    def filter_product_id(self, queryset, name, value):
+        return queryset.filter(order_has_product(queryset.model, id=value))
@@ -0,0 +1,91 @@
+"""
+Precomputed introspection.
+
+Operations that only read the schema (nothing but __schema, __type and
+__typename at the root) give the same result for as long as the schema is
+the same, so the GraphQL view executes each distinct introspection document
+once per schema version and serves the encoded body from memory afterwards,
+with an ETag clients can revalidate with If-None-Match.
+
+`manage.py export_schema` writes the schema as SDL and introspection JSON,
+so clients such as crm.cron's gql client load it from disk instead of
+introspecting at all.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from graphql import FieldNode, get_operation_ast, introspection_from_schema, parse, print_schema
+
+from crm import metrics
+
+INTROSPECTION_FIELDS = {"__schema", "__type", "__typename"}
+MAX_ENTRIES = 32
+
+_responses = OrderedDict()
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=256)
+def is_introspection(query, operation_name):
+    try:
+        operation = get_operation_ast(parse(query, no_location=True), operation_name)
+    except Exception:
+        return False
+    if operation is None or operation.operation.value != "query":
+        return False
+    return all(
+        isinstance(selection, FieldNode) and selection.name.value in INTROSPECTION_FIELDS
+        for selection in operation.selection_set.selections
+    )
+
+
+@lru_cache(maxsize=4)
+def schema_version(graphql_schema):
+    """Short hash of the schema's SDL; changes whenever the schema does."""
+    return hashlib.sha256(print_schema(graphql_schema).encode()).hexdigest()[:16]
+
+
+def cached_response(graphql_schema, query, variables, operation_name, pretty, render):
+    """
+    (body, status, etag) for an introspection operation. `render` produces
+    (body, status) on a miss; only successful responses are kept.
+    """
+    key = (
+        schema_version(graphql_schema), query, operation_name,
+        json.dumps(variables, sort_keys=True) if variables else "", pretty,
+    )
+    with _lock:
+        entry = _responses.get(key)
+        if entry is not None:
+            _responses.move_to_end(key)
+    if entry is not None:
+        metrics.inc("crm_cache_requests_total", cache="introspection", result="hit")
+        return entry
+
+    metrics.inc("crm_cache_requests_total", cache="introspection", result="miss")
+    body, status = render()
+    etag = '"%s"' % hashlib.sha256(body.encode()).hexdigest()[:32]
+    entry = (body, status, etag)
+    if status == 200:
+        with _lock:
+            _responses[key] = entry
+            while len(_responses) > MAX_ENTRIES:
+                _responses.popitem(last=False)
+    return entry
+
+
+def clear():
+    with _lock:
+        _responses.clear()
+
+
+def export_sdl(graphql_schema):
+    return print_schema(graphql_schema) + "\n"
+
+
+def export_json(graphql_schema):
+    # Same shape as an introspection response (and graphene's graphql_schema command)
+    return json.dumps({"data": introspection_from_schema(graphql_schema)}, indent=2, sort_keys=True) + "\n"
@@ -0,0 +1,237 @@
+"""
+Resident job scheduler and worker.
+
+`python manage.py run_jobs` keeps one warm Django process alive and runs the
+jobs listed in settings.CRM_JOBS from a thread pool, instead of spawning a new
+interpreter for every crontab line. Job state lives in the ScheduledJob and
+JobRun tables so several worker processes can share the same schedule.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Least
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from crm.models import JobRun, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+# (name, minimum, maximum) for the five crontab fields
+CRON_FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),  # 7 is read as 0, Sunday
+]
+
+
+class CronSchedule:
+    """
+    Standard five-field crontab expression: `*`, `*/n`, `a-b`, `a-b/n` and
+    comma separated lists. Weekday 0 (or 7) is Sunday.
+    """
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+        self.expression = expression
+        self.fields = {}
+        for part, (name, low, high) in zip(parts, CRON_FIELDS):
+            self.fields[name] = self._parse(part, low, high)
+        # Map the value, not the text: "1-7" is Monday to Sunday
+        weekdays = self.fields["weekday"]
+        if 7 in weekdays:
+            weekdays.discard(7)
+            weekdays.add(0)
+        # Like cron, day and weekday are OR-ed when both are restricted
+        self.day_any = parts[2] == "*"
+        self.weekday_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse(part, low, high):
+        values = set()
+        for item in part.split(","):
+            step = 1
+            if "/" in item:
+                item, step = item.split("/")
+                step = int(step)
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start, end = map(int, item.split("-"))
+            else:
+                start = end = int(item)
+                if step != 1:
+                    end = high
+            if start < low or end > high or step < 1:
+                raise ValueError(f"Cron field {part!r} out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day = dt.day in self.fields["day"]
+        weekday = (dt.weekday() + 1) % 7 in self.fields["weekday"]
+        if self.day_any:
+            return weekday
+        if self.weekday_any:
+            return day
+        return day or weekday
+
+    def next_after(self, dt):
+        """First matching minute strictly after `dt`."""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Five years covers every valid expression (e.g. 29 February)
+        limit = dt + timedelta(days=5 * 366)
+        while dt < limit:
+            if dt.month not in self.fields["month"]:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.fields["hour"]:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.fields["minute"]:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+def sync_jobs(definitions=None):
+    """
+    Create or update ScheduledJob rows from settings.CRM_JOBS. Runtime state
+    (next run, attempts) is kept unless the schedule itself changed.
+    """
+    if definitions is None:
+        definitions = getattr(settings, "CRM_JOBS", [])
+    now = timezone.now()
+    for definition in definitions:
+        definition = dict(definition)
+        name = definition.pop("name")
+        schedule = definition["schedule"]
+        CronSchedule(schedule)  # fail fast on typos
+        job, created = ScheduledJob.objects.get_or_create(name=name, defaults=definition)
+        if created or job.schedule != schedule or job.next_run_at is None:
+            for field, value in definition.items():
+                setattr(job, field, value)
+            job.next_run_at = CronSchedule(schedule).next_after(timezone.localtime(now))
+            job.save()
+        elif any(getattr(job, field) != value for field, value in definition.items()):
+            ScheduledJob.objects.filter(pk=job.pk).update(**definition)
+
+
+class Worker:
+    """
+    Polls for due jobs and runs them on a thread pool.
+
+    A due job is claimed by moving its next_run_at forward with a conditional
+    UPDATE; only the process whose UPDATE matched runs it. A JobRun row then
+    holds one of the job's `max_concurrency` slots until it finishes or its
+    lock expires, which keeps long runs from overlapping with the next tick.
+    """
+
+    def __init__(self, max_workers=4, poll_interval=1.0, tasks=None):
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crm-job")
+        self._tasks = tasks or {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        logger.info("Job worker %s started with %d threads", self.name, self.max_workers)
+        try:
+            while not self._stop.is_set():
+                self.run_pending()
+                self._stop.wait(self.poll_interval)
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def run_pending(self, wait=False):
+        """Claim every due job and submit it; return the submitted futures."""
+        close_old_connections()
+        now = timezone.now()
+        futures = []
+        due = ScheduledJob.objects.filter(enabled=True, next_run_at__lte=now).order_by("next_run_at")
+        for job in due:
+            run = self.claim(job, now)
+            if run is not None:
+                futures.append(self.pool.submit(self.execute, job, run))
+        if wait:
+            for future in futures:
+                future.result()
+        return futures
+
+    def claim(self, job, now):
+        with transaction.atomic():
+            next_run_at = CronSchedule(job.schedule).next_after(timezone.localtime(now))
+            claimed = ScheduledJob.objects.filter(
+                pk=job.pk, next_run_at=job.next_run_at
+            ).update(next_run_at=next_run_at)
+            if not claimed:
+                return None  # another worker got this tick
+
+            running = JobRun.objects.filter(
+                job=job, status=JobRun.RUNNING, locked_until__gt=now
+            ).count()
+            if running >= job.max_concurrency:
+                logger.info("Skipping %s: %d run(s) still in progress", job.name, running)
+                return None
+
+            return JobRun.objects.create(
+                job=job,
+                attempt=job.attempt + 1,
+                worker=self.name,
+                locked_until=now + timedelta(seconds=job.timeout),
+            )
+
+    def get_task(self, path):
+        # Imported once per process and reused by every later run
+        if path not in self._tasks:
+            self._tasks[path] = import_string(path)
+        return self._tasks[path]
+
+    def execute(self, job, run):
+        started = time.monotonic()
+        try:
+            self.get_task(job.task)()
+        except Exception:
+            error = traceback.format_exc()
+            logger.exception("Job %s failed (attempt %d)", job.name, run.attempt)
+            self.finish(job, run, JobRun.FAILED, started, error)
+        else:
+            self.finish(job, run, JobRun.SUCCEEDED, started)
+        finally:
+            close_old_connections()
+
+    def finish(self, job, run, status, started, error=""):
+        now = timezone.now()
+        JobRun.objects.filter(pk=run.pk).update(
+            status=status,
+            finished_at=now,
+            duration=time.monotonic() - started,
+            error=error,
+        )
+        updates = {"last_run_at": now, "last_status": status, "last_error": error}
+        if status == JobRun.FAILED and run.attempt <= job.max_retries:
+            # Retry with exponential backoff instead of waiting for the next tick
+            retry_at = now + timedelta(seconds=job.retry_backoff * 2 ** (run.attempt - 1))
+            updates["attempt"] = run.attempt
+            updates["next_run_at"] = Least(F("next_run_at"), retry_at)
+        else:
+            updates["attempt"] = 0
+        ScheduledJob.objects.filter(pk=job.pk).update(**updates)
@@ -0,0 +1,63 @@
+from crm import metrics
+from crm.entity_cache import entity_cache
+from crm.models import Customer, Product
+
+
+class EntityLoader:
+    """
+    Per-request identity map for one model, keyed by primary key.
+    Misses are read together through the shared entity cache, which falls
+    back to a single `IN` query.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._cache = {}
+
+    def load(self, pk):
+        return self.load_many([pk])[0]
+
+    def load_many(self, pks):
+        missing = {pk for pk in pks if pk not in self._cache}
+        cache = f"loader_{self.model._meta.model_name}"
+        if len(pks) > len(missing):
+            metrics.inc("crm_cache_requests_total", len(pks) - len(missing), cache=cache, result="hit")
+        if missing:
+            metrics.inc("crm_cache_requests_total", len(missing), cache=cache, result="miss")
+            found = entity_cache(self.model).get_many(missing)
+            for pk in missing:
+                self._cache[pk] = found.get(pk)
+        return [self._cache[pk] for pk in pks]
+
+    def prime(self, obj):
+        self._cache[obj.pk] = obj
+        return obj
+
+    def clear(self, pk=None):
+        if pk is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(pk, None)
+
+
+class RequestLoaders:
+    def __init__(self):
+        self.customers = EntityLoader(Customer)
+        self.products = EntityLoader(Product)
+
+
+def get_loaders(context):
+    """
+    Return the loaders attached to the GraphQL context (the Django request).
+    Every operation of a batched request shares the same request object,
+    so lookups cached by one operation are reused by the next.
+    """
+    loaders = getattr(context, "_crm_loaders", None)
+    if loaders is None:
+        loaders = RequestLoaders()
+        try:
+            context._crm_loaders = loaders
+        except AttributeError:
+            # e.g. schema.execute() without a context value
+            pass
+    return loaders
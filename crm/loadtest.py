@@ -0,0 +1,392 @@
+"""
+Concurrent load generator for /graphql (`manage.py load_test`).
+
+Worker threads pick operations from a weighted mix and send them through a
+transport: HTTP against a running server, or in-process through the
+project's WSGI or ASGI application (the full middleware stack included).
+The number of active workers follows a ramp profile of stages, each
+ramping linearly to its target over its duration, k6 style.
+"""
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+LIST_ORDERS = """
+query LoadListOrders($first: Int, $filter: OrderFilterInput) {
+  allOrders(first: $first, filter: $filter) {
+    edges { node { numericId orderDate totalAmount customer { name email } products { name price } } }
+  }
+}
+"""
+
+LIST_PRODUCTS = """
+query LoadListProducts($first: Int, $filter: ProductFilterInput) {
+  allProducts(first: $first, filter: $filter, orderBy: "name") {
+    edges { node { numericId name price stock } }
+  }
+}
+"""
+
+LIST_CUSTOMERS = """
+query LoadListCustomers($first: Int, $filter: CustomerFilterInput) {
+  allCustomers(first: $first, filter: $filter) {
+    totalCount
+    edges { node { numericId name email } }
+  }
+}
+"""
+
+CREATE_ORDER = """
+mutation LoadCreateOrder($input: OrderInput!) {
+  createOrder(input: $input) { success message order { numericId totalAmount } }
+}
+"""
+
+BULK_CREATE_CUSTOMERS = """
+mutation LoadBulkCreateCustomers($input: [CustomerInput!]!) {
+  bulkCreateCustomers(input: $input) { customers { numericId } errors }
+}
+"""
+
+FIXTURE_IDS = """
+query LoadFixtureIds {
+  allCustomers(first: 100) { edges { node { numericId } } }
+  allProducts(first: 100) { edges { node { numericId } } }
+}
+"""
+
+
+@dataclass
+class Operation:
+    name: str
+    weight: float
+    query: str
+    # Called with the fixture ids ({"customers": [...], "products": [...]}) per request;
+    # returning None drops the operation from the run
+    variables: object = None
+
+    def payload(self, ids):
+        variables = self.variables(ids) if callable(self.variables) else (self.variables or {})
+        return {"query": self.query, "variables": variables, "operationName": None}
+
+
+def _order_input(ids):
+    if not ids["customers"] or not ids["products"]:
+        return None
+    return {"input": {
+        "customerId": str(random.choice(ids["customers"])),
+        "productIds": [str(pk) for pk in random.sample(ids["products"], min(3, len(ids["products"])))],
+    }}
+
+
+def _new_customers(ids):
+    batch = uuid.uuid4().hex[:12]
+    return {"input": [
+        {"name": f"Load {batch} {i}", "email": f"load-{batch}-{i}@example.com"} for i in range(5)
+    ]}
+
+
+DEFAULT_MIX = [
+    Operation("listOrders", 35, LIST_ORDERS, {"first": 20}),
+    Operation("listOrdersFiltered", 15, LIST_ORDERS, {"first": 20, "filter": {"totalAmountGte": 50}}),
+    Operation("listProductsLowStock", 15, LIST_PRODUCTS, {"first": 50, "filter": {"stockLte": 10}}),
+    Operation("listCustomers", 15, LIST_CUSTOMERS, {"first": 20, "filter": {"nameIcontains": "a"}}),
+    Operation("createOrder", 15, CREATE_ORDER, _order_input),
+    Operation("bulkCreateCustomers", 5, BULK_CREATE_CUSTOMERS, _new_customers),
+]
+
+
+def load_mix(path):
+    """
+    Read a recorded mix: a JSON list of {"name", "weight", "query",
+    "variables"} objects, e.g. captured from the server's access logs.
+    """
+    with open(path) as file:
+        return [
+            Operation(entry["name"], float(entry.get("weight", 1)), entry["query"], entry.get("variables"))
+            for entry in json.load(file)
+        ]
+
+
+def parse_stages(spec):
+    """'10:5,30:20,10:0' -> [(10.0, 5), (30.0, 20), (10.0, 0)] as (seconds, workers)."""
+    stages = []
+    for part in spec.split(","):
+        seconds, workers = part.split(":")
+        stages.append((float(seconds.rstrip("s")), int(workers)))
+    return stages
+
+
+class Profile:
+    """Active worker count over time, ramping linearly within each stage."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.duration = sum(seconds for seconds, _ in stages)
+        self.max_workers = max([workers for _, workers in stages] + [1])
+
+    def workers_at(self, elapsed):
+        previous = 0
+        for seconds, target in self.stages:
+            if elapsed < seconds:
+                return round(previous + (target - previous) * elapsed / seconds) if seconds else target
+            elapsed -= seconds
+            previous = target
+        return 0
+
+
+# Transports return (status, body bytes)
+
+class HTTPTransport:
+    def __init__(self, url, headers=None):
+        self.url = url
+        self.headers = {"Content-Type": "application/json", "Accept": "application/json", **(headers or {})}
+
+    def __call__(self, body, headers):
+        request = urllib.request.Request(self.url, data=body, headers={**self.headers, **headers}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def _header_name(name):
+    return "HTTP_" + name.upper().replace("-", "_")
+
+
+class WSGITransport:
+    def __init__(self, application, path="/graphql", headers=None):
+        self.application = application
+        self.path = path
+        self.headers = headers or {}
+
+    def __call__(self, body, headers):
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "PATH_INFO": self.path,
+            "QUERY_STRING": "",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "HTTP_ACCEPT": "application/json",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.url_scheme": "http",
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in {**self.headers, **headers}.items():
+            environ[_header_name(name)] = value
+        status = []
+
+        def start_response(status_line, response_headers, exc_info=None):
+            status.append(int(status_line.split()[0]))
+
+        chunks = self.application(environ, start_response)
+        try:
+            content = b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        return status[0], content
+
+
+class ASGITransport:
+    def __init__(self, application, path="/graphql", headers=None):
+        self.application = application
+        self.path = path
+        self.headers = headers or {}
+
+    async def request(self, body, headers):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 0),
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"accept", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *((name.lower().encode(), value.encode()) for name, value in {**self.headers, **headers}.items()),
+            ],
+        }
+        sent = False
+        done = asyncio.Event()
+        status = []
+        content = []
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                # Like a client that stays connected until the response is complete
+                await done.wait()
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            elif message["type"] == "http.response.body":
+                content.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        await self.application(scope, receive, send)
+        return status[0], b"".join(content)
+
+    def __call__(self, body, headers):
+        from asgiref.sync import async_to_sync
+
+        return async_to_sync(self.request)(body, headers)
+
+
+@dataclass
+class Results:
+    latencies: dict = field(default_factory=lambda: defaultdict(list))
+    statuses: dict = field(default_factory=lambda: defaultdict(Counter))
+    errors: Counter = field(default_factory=Counter)
+    # Operations no request could be built for, see Operation.variables
+    skipped: set = field(default_factory=set)
+    elapsed: float = 0.0
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+
+    def record(self, name, latency, status, graphql_errors):
+        with self.lock:
+            self.latencies[name].append(latency)
+            self.statuses[name][status] += 1
+            if status != 200 or graphql_errors:
+                self.errors[name] += 1
+
+    def skip(self, name):
+        with self.lock:
+            self.skipped.add(name)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def fixture_ids(transport):
+    status, content = transport(json.dumps({"query": FIXTURE_IDS}).encode(), {})
+    ids = {"customers": [], "products": []}
+    if status == 200:
+        data = json.loads(content).get("data") or {}
+        ids["customers"] = [e["node"]["numericId"] for e in data.get("allCustomers", {}).get("edges", [])]
+        ids["products"] = [e["node"]["numericId"] for e in data.get("allProducts", {}).get("edges", [])]
+    return ids
+
+
+def run(transport, mix, profile, api_keys=True, seed=None):
+    """
+    Drive `transport` with `mix` following `profile`. With api_keys, every
+    worker sends its own X-Api-Key so per-client rate limits apply per
+    worker rather than to the whole run. Returns Results.
+    """
+    rng = random.Random(seed)
+    ids = fixture_ids(transport)
+    weights = [operation.weight for operation in mix]
+    results = Results()
+    active = [0]
+    stop = threading.Event()
+
+    def worker(number):
+        headers = {"X-Api-Key": f"load-test-{number}"} if api_keys else {}
+        worker_rng = random.Random(rng.random())
+        operations, operation_weights = list(mix), list(weights)
+        while not stop.is_set() and operations:
+            if number >= active[0]:
+                time.sleep(0.01)
+                continue
+            index = worker_rng.choices(range(len(operations)), operation_weights)[0]
+            operation = operations[index]
+            payload = operation.payload(ids)
+            if payload["variables"] is None:
+                # e.g. createOrder without customers or products to order;
+                # the fixture ids don't change during a run, so drop it
+                del operations[index], operation_weights[index]
+                results.skip(operation.name)
+                continue
+            body = json.dumps(payload).encode()
+            start = time.perf_counter()
+            try:
+                status, content = transport(body, headers)
+            except Exception:
+                status, content = 0, b""
+            latency = time.perf_counter() - start
+            graphql_errors = False
+            if status == 200:
+                try:
+                    graphql_errors = bool(json.loads(content).get("errors"))
+                except ValueError:
+                    graphql_errors = True
+            results.record(operation.name, latency, status, graphql_errors)
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(profile.max_workers)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    try:
+        while (elapsed := time.perf_counter() - start) < profile.duration:
+            active[0] = profile.workers_at(elapsed)
+            time.sleep(0.05)
+    finally:
+        active[0] = 0
+        stop.set()
+        for thread in threads:
+            thread.join()
+        results.elapsed = time.perf_counter() - start
+    return results
+
+
+def report(results):
+    lines = [f"{'operation':<24} {'requests':>9} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses"]
+    everything = []
+    for name in sorted(results.latencies):
+        latencies = sorted(results.latencies[name])
+        everything.extend(latencies)
+        lines.append(_row(name, latencies, results.elapsed, results.errors[name], results.statuses[name]))
+    total_statuses = Counter()
+    for statuses in results.statuses.values():
+        total_statuses.update(statuses)
+    lines.append(_row("TOTAL", sorted(everything), results.elapsed, sum(results.errors.values()), total_statuses))
+    if results.skipped:
+        lines.append(f"skipped (no fixture ids to build them from): {', '.join(sorted(results.skipped))}")
+    return "\n".join(lines)
+
+
+def _row(name, latencies, elapsed, errors, statuses):
+    count = len(latencies)
+    error_rate = errors / count * 100 if count else 0.0
+    return (
+        f"{name:<24} {count:>9} {count / elapsed if elapsed else 0:>8.1f} "
+        f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+        f"{percentile(latencies, 99) * 1000:>8.1f} {error_rate:>6.1f}%  "
+        + " ".join(f"{status}={n}" for status, n in sorted(statuses.items()))
+    )
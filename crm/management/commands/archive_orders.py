@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from crm.archive import archive_cutoff, archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move orders older than ORDER_ARCHIVE_AFTER_DAYS into the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Archive orders older than this many days.")
+        parser.add_argument("--batch-size", type=int, default=None, help="Orders moved per transaction.")
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options["days"])
+        moved = archive_orders(older_than=cutoff, batch_size=options["batch_size"])
+        self.stdout.write(f"Archived {moved} order(s) placed before {cutoff:%Y-%m-%d %H:%M}.")
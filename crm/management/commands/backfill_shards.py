@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import sharding
+
+
+class Command(BaseCommand):
+    help = "Move customers and their orders written before CRM_SHARDS was set from the default database into the shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Customers moved per transaction.")
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError("CRM_SHARDS is not set.")
+        moved = sharding.backfill(batch_size=options["batch_size"])
+        self.stdout.write(f"Moved {moved} customer(s) into {len(sharding.shards())} shard(s).")
@@ -0,0 +1,102 @@
+import json
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from crm.encoders import OrjsonEncoder, StdlibJSONEncoder, orjson
+from crm.models import Customer, Order, Product
+from crm.views import CRMGraphQLView
+
+QUERY = """
+query($first: Int) {
+  allOrders(first: $first) {
+    edges { node { numericId orderDate totalAmount customer { name email } products { name price stock } } }
+  }
+}
+"""
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark /graphql response encoding and gzip on a large allOrders page (data is rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1000)
+        parser.add_argument("--products-per-order", type=int, default=5)
+        parser.add_argument("--first", type=int, default=100, help="Page size, up to RELAY_CONNECTION_MAX_LIMIT.")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options["orders"], options["products_per_order"])
+                self.run(options["first"], options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, orders, per_order):
+        now = timezone.now()
+        products = Product.objects.bulk_create(
+            Product(name=f"Bench product {i}", price=Decimal("19.99") + i, stock=100) for i in range(50)
+        )
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"Bench customer {i}", email=f"bench{i}@example.com", created_at=now) for i in range(100)
+        )
+        created = Order.objects.bulk_create(
+            Order(customer=customers[i % len(customers)], order_date=now) for i in range(orders)
+        )
+        Order.products.through.objects.bulk_create(
+            Order.products.through(order_id=order.pk, product_id=products[(i + j) % len(products)].pk)
+            for i, order in enumerate(created) for j in range(per_order)
+        )
+
+    def run(self, first, repeat):
+        factory = RequestFactory()
+        body = json.dumps({"query": QUERY, "variables": {"first": first}})
+        encoders = [("stdlib", StdlibJSONEncoder())]
+        if orjson is not None:
+            encoders.append(("orjson", OrjsonEncoder()))
+
+        # Encoding alone, on the same execution result
+        from alx_backend_graphql_crm.schema import schema
+        result = schema.execute(QUERY, variable_values={"first": first})
+        if result.errors:
+            raise CommandError(result.errors[0])
+        data = {"data": result.data}
+        self.stdout.write(f"allOrders(first: {first}) page\n")
+        self.stdout.write(f"{'encoder':<8} {'encode ms':>10}")
+        for name, encoder in encoders:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                encoder.encode(data)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f"{name:<8} {statistics.median(timings) * 1000:>10.2f}")
+
+        # Full request through the view
+        self.stdout.write(f"\n{'encoder':<8} {'gzip':<5} {'request ms':>11} {'bytes':>10}")
+        for name, encoder in encoders:
+            for accept in ("identity", "gzip"):
+                view = CRMGraphQLView.as_view(encoder=encoder)
+                timings = []
+                with override_settings(GRAPHQL_GZIP_MIN_BYTES=1024):
+                    for _ in range(repeat):
+                        request = factory.post(
+                            "/graphql", body, content_type="application/json",
+                            HTTP_ACCEPT="application/json", HTTP_ACCEPT_ENCODING=accept,
+                        )
+                        start = time.perf_counter()
+                        response = view(request)
+                        timings.append(time.perf_counter() - start)
+                self.stdout.write(
+                    f"{name:<8} {accept == 'gzip'!s:<5} {statistics.median(timings) * 1000:>11.1f} {len(response.content):>10}"
+                )
@@ -0,0 +1,26 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from crm.introspection import export_json, export_sdl
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the GraphQL schema as SDL and introspection JSON, for clients that "
+        "load it from disk instead of introspecting the server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sdl", default=str(settings.GRAPHQL_SCHEMA_SDL_PATH), help="Where to write the SDL.")
+        parser.add_argument("--json", default=str(settings.GRAPHQL_SCHEMA_JSON_PATH), help="Where to write the JSON.")
+
+    def handle(self, *args, **options):
+        from alx_backend_graphql_crm.schema import schema
+
+        for path, export in ((options["sdl"], export_sdl), (options["json"], export_json)):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as file:
+                file.write(export(schema.graphql_schema))
+            self.stdout.write(f"Wrote {path}")
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from crm.loadtest import (
+    DEFAULT_MIX, ASGITransport, HTTPTransport, Profile, WSGITransport, load_mix, parse_stages, report, run,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive /graphql with concurrent workers and a weighted operation mix; "
+        "reports throughput, p50/p95/p99 latency and error rates per operation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target", default="http://localhost:8000/graphql",
+            help="URL of a running server, or 'wsgi' / 'asgi' to run in-process through the project's app.",
+        )
+        parser.add_argument("--workers", type=int, default=10, help="Concurrent workers (without --stages).")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run (without --stages).")
+        parser.add_argument("--ramp-up", type=float, default=0, help="Seconds to ramp up to --workers.")
+        parser.add_argument(
+            "--stages", default=None,
+            help="Ramp profile as seconds:workers pairs, e.g. '10:5,30:20,10:0'. Overrides the options above.",
+        )
+        parser.add_argument("--mix", default=None, help="JSON file with a recorded operation mix.")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument(
+            "--shared-client", action="store_true",
+            help="Send every request as the same client instead of one X-Api-Key per worker.",
+        )
+        parser.add_argument(
+            "--no-rate-limit", action="store_true",
+            help="In-process targets only: disable GraphQLRateLimitMiddleware for the run.",
+        )
+
+    def handle(self, *args, **options):
+        if options["stages"]:
+            try:
+                stages = parse_stages(options["stages"])
+            except ValueError:
+                raise CommandError("--stages must look like '10:5,30:20,10:0'.")
+        else:
+            ramp = options["ramp_up"]
+            stages = ([(ramp, options["workers"])] if ramp else []) + [
+                (max(options["duration"] - ramp, 0), options["workers"])
+            ]
+        profile = Profile(stages)
+        mix = load_mix(options["mix"]) if options["mix"] else DEFAULT_MIX
+
+        target = options["target"]
+        in_process = target in ("wsgi", "asgi")
+        overrides = {"GRAPHQL_RATE_LIMIT": {"ENABLED": False}} if in_process and options["no_rate_limit"] else {}
+        with override_settings(**overrides):
+            if target == "wsgi":
+                from alx_backend_graphql_crm.wsgi import application
+
+                transport = WSGITransport(application)
+            elif target == "asgi":
+                from alx_backend_graphql_crm.asgi import application
+
+                transport = ASGITransport(application)
+            else:
+                transport = HTTPTransport(target)
+
+            self.stdout.write(
+                f"Load testing {target} for {profile.duration:g}s, up to {profile.max_workers} workers..."
+            )
+            results = run(transport, mix, profile, api_keys=not options["shared_client"], seed=options["seed"])
+        self.stdout.write(report(results))
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What the child interpreter does for each target, after django.setup()
+TARGETS = {
+    "setup": "",
+    "urls": "import importlib; importlib.import_module(settings.ROOT_URLCONF)",
+    "schema": "from alx_backend_graphql_crm.schema import get_schema; get_schema()",
+}
+
+CHILD = """
+import os, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+{body}
+print("wall_seconds=%f" % (time.perf_counter() - start))
+"""
+
+
+def profile_startup(target="schema"):
+    """
+    Start a fresh interpreter with `-X importtime`, run `target` and return
+    (wall_seconds, rows) where rows are (module, self_us, cumulative_us).
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+        "DJANGO_SETTINGS_MODULE", "alx_backend_graphql_crm.settings"
+    ))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(body=TARGETS[target])],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+
+    wall = float(result.stdout.strip().splitlines()[-1].split("=")[1])
+    return wall, rows
+
+
+class Command(BaseCommand):
+    help = "Report per-module import cost of a cold start (python -X importtime)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=sorted(TARGETS), default="schema",
+                            help="What to load after django.setup() (default: schema).")
+        parser.add_argument("--top", type=int, default=25, help="Number of modules to list.")
+        parser.add_argument("--by-package", action="store_true",
+                            help="Aggregate self time per top-level package.")
+
+    def handle(self, *args, **options):
+        try:
+            wall, rows = profile_startup(options["target"])
+        except RuntimeError as e:
+            raise CommandError(f"Child interpreter failed:\n{e}")
+
+        self.stdout.write(f"Cold start ({options['target']}): {wall * 1000:.1f} ms wall, {len(rows)} modules imported\n")
+
+        if options["by_package"]:
+            totals = defaultdict(int)
+            for module, self_us, _ in rows:
+                totals[module.split(".")[0]] += self_us
+            ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+            self.stdout.write(f"{'self ms':>10}  package")
+            for package, self_us in ranked[:options["top"]]:
+                self.stdout.write(f"{self_us / 1000:>10.1f}  {package}")
+            return
+
+        ranked = sorted(rows, key=lambda row: row[2], reverse=True)
+        self.stdout.write(f"{'cumul ms':>10} {'self ms':>9}  module")
+        for module, self_us, cumulative_us in ranked[:options["top"]]:
+            self.stdout.write(f"{cumulative_us / 1000:>10.1f} {self_us / 1000:>9.1f}  {module}")
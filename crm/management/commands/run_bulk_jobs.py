@@ -0,0 +1,27 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from crm.bulk_jobs import drain, run_forever
+
+
+class Command(BaseCommand):
+    help = "Process background bulk mutation jobs; run several to spread large imports over processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Chunks processed concurrently.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks for new jobs.")
+        parser.add_argument("--once", action="store_true", help="Process the chunks waiting now, then exit.")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            self.stdout.write(f"Processed {drain()} chunk(s).")
+            return
+
+        # Finish in-flight chunks on Ctrl+C / SIGTERM
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        self.stdout.write(f"Bulk job worker running with {options['workers']} thread(s), Ctrl+C to stop.")
+        run_forever(workers=options["workers"], poll_interval=options["poll_interval"], stop=stop)
@@ -0,0 +1,30 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from crm.jobs import Worker, sync_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the resident CRM job scheduler/worker (replaces the crontab entries)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Size of the job thread pool.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between schedule checks.")
+        parser.add_argument("--once", action="store_true", help="Run the jobs that are due now, then exit.")
+
+    def handle(self, *args, **options):
+        sync_jobs()
+        worker = Worker(max_workers=options["workers"], poll_interval=options["poll_interval"])
+
+        if options["once"]:
+            futures = worker.run_pending(wait=True)
+            worker.pool.shutdown()
+            self.stdout.write(f"Ran {len(futures)} due job(s).")
+            return
+
+        # Finish in-flight jobs on Ctrl+C / SIGTERM
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+        self.stdout.write(f"Job worker {worker.name} running, Ctrl+C to stop.")
+        worker.run_forever()
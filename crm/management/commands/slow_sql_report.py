@@ -0,0 +1,61 @@
+import glob
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow SQL log by statement fingerprint, worst total time first."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log", default=str(getattr(settings, "SLOW_SQL_LOG", "")),
+                            help="Log file; rotated siblings (.1, .2, ...) are read too.")
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--sort", choices=["total", "max", "count"], default="total")
+
+    def handle(self, *args, **options):
+        groups = defaultdict(lambda: {
+            "count": 0, "total_ms": 0.0, "max_ms": 0.0, "full_scan": False,
+            "operations": defaultdict(int), "paths": defaultdict(int), "normalized": "", "plan": None,
+        })
+        for path in sorted(glob.glob(options["log"] + "*")):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    group = groups[entry["fingerprint"]]
+                    group["count"] += 1
+                    group["total_ms"] += entry["duration_ms"]
+                    if entry["duration_ms"] >= group["max_ms"]:
+                        group["max_ms"] = entry["duration_ms"]
+                        group["plan"] = entry.get("plan")
+                    group["full_scan"] |= bool(entry.get("full_scan"))
+                    group["operations"][entry.get("operation") or "-"] += 1
+                    group["paths"][entry.get("path") or "-"] += 1
+                    group["normalized"] = entry["normalized"]
+
+        if not groups:
+            self.stdout.write("No slow statements logged.")
+            return
+
+        key = {"total": "total_ms", "max": "max_ms", "count": "count"}[options["sort"]]
+        ranked = sorted(groups.items(), key=lambda item: item[1][key], reverse=True)
+        for fp, group in ranked[:options["top"]]:
+            avg = group["total_ms"] / group["count"]
+            flag = "  FULL SCAN" if group["full_scan"] else ""
+            self.stdout.write(
+                f"{fp}  count={group['count']} total={group['total_ms']:.1f}ms "
+                f"avg={avg:.1f}ms max={group['max_ms']:.1f}ms{flag}"
+            )
+            self.stdout.write(f"    {group['normalized'][:300]}")
+            top_ops = sorted(group["operations"].items(), key=lambda item: item[1], reverse=True)[:3]
+            top_paths = sorted(group["paths"].items(), key=lambda item: item[1], reverse=True)[:3]
+            self.stdout.write("    operations: " + ", ".join(f"{op} ({n})" for op, n in top_ops))
+            self.stdout.write("    paths: " + ", ".join(f"{p} ({n})" for p, n in top_paths))
+            for plan_line in group["plan"] or []:
+                self.stdout.write(f"    plan: {plan_line}")
+            self.stdout.write("")
@@ -0,0 +1,289 @@
+"""
+Process-local metrics, aggregated across processes through small files.
+
+Every process counts into in-memory dicts (one lock, no I/O on the hot path)
+and at most every METRICS_FLUSH_SECONDS writes a snapshot to
+METRICS_DIR/<pid>.json. The /metrics view merges all snapshots into the
+Prometheus text format. Snapshots of processes that have exited (e.g. a
+django-crontab run) are folded into a single archive file so the directory
+does not grow without bound.
+"""
+import atexit
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: dead-process snapshots are simply kept
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+HELP = {
+    "crm_graphql_requests_total": ("counter", "GraphQL operations executed."),
+    "crm_graphql_request_duration_seconds": ("histogram", "GraphQL operation latency."),
+    "crm_graphql_errors_total": ("counter", "GraphQL errors by root field."),
+    "crm_graphql_sql_queries_total": ("counter", "SQL queries issued while executing operations."),
+    "crm_graphql_sql_seconds_total": ("counter", "Time spent in SQL while executing operations."),
+    "crm_graphql_coalesced_total": ("counter", "Read operations answered by an identical in-flight execution."),
+    "crm_cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "crm_job_runs_total": ("counter", "Scheduled job runs by outcome."),
+    "crm_job_duration_seconds": ("histogram", "Scheduled job run duration."),
+}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_last_flush = 0.0
+# Distinct values seen per label name, see bounded_label()
+_label_values = defaultdict(set)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def bounded_label(label, value):
+    """
+    `value` as a value of `label`, or "other" once this process has seen
+    METRICS_MAX_LABEL_VALUES distinct values of it. For values the client
+    picks (operation names), which would otherwise add series without bound.
+    """
+    limit = getattr(settings, "METRICS_MAX_LABEL_VALUES", 100)
+    with _lock:
+        seen = _label_values[label]
+        if value not in seen:
+            if len(seen) >= limit:
+                return "other"
+            seen.add(value)
+    return value
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+    maybe_flush()
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+    maybe_flush()
+
+
+def track_job(name):
+    """Record the duration and outcome of every call of a job function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "failed"
+            try:
+                result = func(*args, **kwargs)
+                outcome = "succeeded"
+                return result
+            finally:
+                observe("crm_job_duration_seconds", time.perf_counter() - start, job=name)
+                inc("crm_job_runs_total", job=name, outcome=outcome)
+                # cron runs are often short-lived processes
+                try:
+                    flush()
+                except OSError:
+                    pass
+        return wrapper
+    return decorator
+
+
+def metrics_dir():
+    return str(getattr(settings, "METRICS_DIR", settings.BASE_DIR / "tmp" / "metrics"))
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [
+                [name, list(labels), buckets[:], total, count]
+                for (name, labels), (buckets, total, count) in _histograms.items()
+            ],
+        }
+
+
+def _write(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp, path)
+
+
+def flush():
+    global _last_flush
+    _last_flush = time.monotonic()
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    _write(os.path.join(directory, f"{os.getpid()}.json"), snapshot())
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= getattr(settings, "METRICS_FLUSH_SECONDS", 5):
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _flush_at_exit():
+    if _counters or _histograms:
+        try:
+            flush()
+        except Exception:
+            pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def _merge(into, data):
+    for name, labels, value in data["counters"]:
+        into["counters"][(name, tuple(map(tuple, labels)))] += value
+    for name, labels, buckets, total, count in data["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        merged = into["histograms"].setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+        merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+        merged[1] += total
+        merged[2] += count
+
+
+def _empty():
+    return {"counters": defaultdict(float), "histograms": {}}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _as_snapshot(merged):
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in merged["counters"].items()],
+        "histograms": [[name, list(labels), *hist] for (name, labels), hist in merged["histograms"].items()],
+    }
+
+
+def compact(directory):
+    """Fold snapshots of exited processes into archive.json."""
+    if fcntl is None:
+        return
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, "archive.json")
+        archive = _empty()
+        existing = _read(archive_path)
+        if existing:
+            _merge(archive, existing)
+        dead = []
+        for entry in os.listdir(directory):
+            stem, ext = os.path.splitext(entry)
+            if ext == ".json" and stem.isdigit() and not _pid_alive(int(stem)):
+                data = _read(os.path.join(directory, entry))
+                if data:
+                    _merge(archive, data)
+                dead.append(entry)
+        if dead:
+            _write(archive_path, _as_snapshot(archive))
+            for entry in dead:
+                os.remove(os.path.join(directory, entry))
+
+
+def collect():
+    """Merge the snapshots of every process on this host."""
+    flush()
+    directory = metrics_dir()
+    compact(directory)
+    merged = _empty()
+    for entry in os.listdir(directory):
+        if entry.endswith(".json"):
+            data = _read(os.path.join(directory, entry))
+            if data:
+                _merge(merged, data)
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _value(value):
+    # Exact: "{:g}" keeps 6 significant digits, so big counters would stop moving
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+def render(merged):
+    """Prometheus text exposition format 0.0.4."""
+    lines = []
+    by_name = defaultdict(list)
+    for (name, labels), value in merged["counters"].items():
+        by_name[name].append(("counter", labels, value))
+    for (name, labels), hist in merged["histograms"].items():
+        by_name[name].append(("histogram", labels, hist))
+
+    for name in sorted(by_name):
+        kind, text = HELP.get(name, (by_name[name][0][0], name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for kind, labels, value in sorted(by_name[name], key=lambda item: item[1]):
+            if kind == "counter":
+                lines.append(f"{name}{_labels(labels)} {_value(value)}")
+                continue
+            buckets, total, count = value
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_value(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
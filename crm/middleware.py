@@ -0,0 +1,196 @@
+import hashlib
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from crm.views import graphql_body, json_body, operation_labels
+
+RATE_LIMIT_DEFAULTS = {
+    "ENABLED": True,
+    "PATHS": ["/graphql"],
+    "CACHE": "shared",  # cache alias shared by the processes; None: a bucket per process
+    "RATE": 100.0,  # tokens refilled per second
+    "BURST": 200,  # bucket size
+    "QUERY_COST": 1,
+    "MUTATION_COST": 5,
+    "MAX_INFLIGHT": 32,  # concurrent GraphQL requests per process before shedding
+}
+
+
+def rate_limit_settings():
+    return {**RATE_LIMIT_DEFAULTS, **getattr(settings, "GRAPHQL_RATE_LIMIT", {})}
+
+
+def too_many_requests(message, retry_after):
+    response = JsonResponse({"errors": [{"message": message}]}, status=429)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class TokenBucket:
+    """
+    Token bucket in this process's memory, stored GCRA style as a single
+    "theoretical arrival time" per client and updated under one lock, so
+    checks are atomic and cost no I/O. Each worker process limits on its
+    own: with N processes a client can get up to N times RATE.
+    """
+    max_clients = 10000
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost=1):
+        """Return 0 if allowed, otherwise the seconds to wait."""
+        cost = min(cost, self.burst)
+        now = time.time()
+        with self._lock:
+            tat = max(self._tats.get(key, now), now)
+            new_tat = tat + cost * self.interval
+            allow_at = new_tat - self.burst * self.interval
+            # Tolerates the rounding of the summed intervals
+            if allow_at - now > 1e-9:
+                return allow_at - now
+            if len(self._tats) >= self.max_clients and key not in self._tats:
+                # A client whose bucket has refilled is the same as an unknown one
+                self._tats = {k: v for k, v in self._tats.items() if v > now}
+            self._tats[key] = new_tat
+        return 0
+
+
+class CacheTokenBucket:
+    """
+    The same GCRA bucket, kept in a cache shared by every process (by
+    default "shared"), so a client gets RATE across all of them. Each check
+    is a read-modify-write of the client's arrival time under a short lock
+    taken with cache.add(): atomic in the locmem, database, redis and
+    memcached backends. The file-based cache checks before it writes, so
+    under contention two processes may both take the lock now and then, and
+    a client gets a request more than its rate. A request that can't get its
+    client's lock within lock_wait is turned away like one over the limit.
+    """
+    lock_timeout = 1  # seconds a lock left by a dead process is kept
+    lock_wait = 0.05  # seconds to wait for the lock before turning the request away
+
+    def __init__(self, cache, rate, burst):
+        self.cache = cache
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost=1):
+        """Return 0 if allowed, otherwise the seconds to wait."""
+        cost = min(cost, self.burst)
+        with self._lock, self.locked(key) as acquired:
+            if not acquired:
+                # The client's own requests are queueing on its bucket
+                return self.lock_wait
+            now = time.time()
+            tat = self.cache.get(key) or now
+            # A time left far ahead by a lower RATE holds the bucket empty
+            # no longer than refilling it takes now
+            tat = min(max(tat, now), now + self.burst * self.interval)
+            new_tat = tat + cost * self.interval
+            allow_at = new_tat - self.burst * self.interval
+            if allow_at - now > 1e-9:
+                return allow_at - now
+            self.cache.set(key, new_tat, timeout=math.ceil(new_tat - now) + 1)
+        return 0
+
+    @contextmanager
+    def locked(self, key):
+        lock_key = f"{key}:lock"
+        deadline = time.monotonic() + self.lock_wait
+        acquired = self.cache.add(lock_key, 1, timeout=self.lock_timeout)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.001)
+            acquired = self.cache.add(lock_key, 1, timeout=self.lock_timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.cache.delete(lock_key)
+
+
+class GraphQLRateLimitMiddleware:
+    """
+    Per-client rate limiting and load shedding for the GraphQL endpoint.
+
+    Clients are identified by their X-API-Key header, falling back to the
+    remote address. Each operation costs QUERY_COST or MUTATION_COST tokens
+    (summed over a batch). Independently, once MAX_INFLIGHT GraphQL requests
+    are already running in this process, and so waiting on database
+    connections, new ones are shed with 429 instead of queueing.
+
+    Buckets live in the GRAPHQL_RATE_LIMIT["CACHE"] cache, shared by the
+    worker processes (CacheTokenBucket), or per process (TokenBucket) when
+    it is None. The request body and query are decoded and
+    parsed through crm.views, which reuses them when executing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = rate_limit_settings()
+        if self.config["CACHE"]:
+            self.bucket = CacheTokenBucket(caches[self.config["CACHE"]], self.config["RATE"], self.config["BURST"])
+        else:
+            self.bucket = TokenBucket(self.config["RATE"], self.config["BURST"])
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if not self.config["ENABLED"] or not any(request.path.startswith(p) for p in self.config["PATHS"]):
+            return self.get_response(request)
+
+        wait = self.bucket.consume(f"crm:ratelimit:{self.client_key(request)}", self.request_cost(request))
+        if wait:
+            return too_many_requests("Rate limit exceeded.", wait)
+
+        with self._lock:
+            if self._inflight >= self.config["MAX_INFLIGHT"]:
+                return too_many_requests("Server is busy, retry shortly.", 1)
+            self._inflight += 1
+        try:
+            return self.get_response(request)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    @staticmethod
+    def client_key(request):
+        api_key = request.headers.get("X-Api-Key")
+        if api_key:
+            return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+        return "ip:" + request.META.get("REMOTE_ADDR", "unknown")
+
+    def request_cost(self, request):
+        if request.method == "GET":
+            operations = [{"query": request.GET.get("query"), "operationName": request.GET.get("operationName")}]
+        else:
+            try:
+                body = json_body(request)
+            except ValueError:
+                # application/graphql or form bodies, or invalid JSON the view will reject
+                return self.operation_cost(graphql_body(request).decode(errors="ignore"), None)
+            operations = body if isinstance(body, list) else [body]
+
+        return sum(
+            self.operation_cost(op.get("query"), op.get("operationName"))
+            for op in operations if isinstance(op, dict)
+        ) or self.config["QUERY_COST"]
+
+    def operation_cost(self, query, operation_name):
+        if not isinstance(query, str) or not query:
+            return self.config["QUERY_COST"]
+        # Parsed once: the view labels its metrics with the same cached result
+        _, operation_type = operation_labels(query, operation_name if isinstance(operation_name, str) else None)
+        if operation_type == "mutation":
+            return self.config["MUTATION_COST"]
+        return self.config["QUERY_COST"]
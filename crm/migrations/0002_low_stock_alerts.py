@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def queue_existing_low_stock(apps, schema_editor):
+    # Products that were already low before alerts existed
+    db = schema_editor.connection.alias
+    Product = apps.get_model('crm', 'Product')
+    LowStockAlert = apps.get_model('crm', 'LowStockAlert')
+    LowStockAlert.objects.using(db).bulk_create([
+        LowStockAlert(product_id=pk, stock=stock)
+        for pk, stock in Product.objects.using(db).filter(stock__lt=models.F('low_stock_threshold')).values_list('pk', 'stock')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.CreateModel(
+            name='LowStockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_alerts', to='crm.product')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['created_at'], name='crm_lowstock_pending_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('processed_at__isnull', True)), fields=('product',), name='crm_lowstock_one_pending')],
+            },
+        ),
+        migrations.RunPython(queue_existing_low_stock, migrations.RunPython.noop),
+    ]
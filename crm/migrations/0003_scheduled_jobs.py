@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_low_stock_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('task', models.CharField(max_length=255)),
+                ('schedule', models.CharField(max_length=100)),
+                ('enabled', models.BooleanField(default=True)),
+                ('max_concurrency', models.PositiveIntegerField(default=1)),
+                ('max_retries', models.PositiveIntegerField(default=3)),
+                ('retry_backoff', models.PositiveIntegerField(default=30)),
+                ('timeout', models.PositiveIntegerField(default=600)),
+                ('attempt', models.PositiveIntegerField(default=0)),
+                ('next_run_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status', models.CharField(blank=True, max_length=20)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('attempt', models.PositiveIntegerField(default=1)),
+                ('worker', models.CharField(max_length=100)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('locked_until', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='crm.scheduledjob')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'running')), fields=['job', 'locked_until'], name='crm_jobrun_running_idx')],
+            },
+        ),
+    ]
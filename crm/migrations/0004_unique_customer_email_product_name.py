@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:00
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    # Keep the oldest row per email / name and move the others' orders onto it
+    db = schema_editor.connection.alias
+    Customer = apps.get_model('crm', 'Customer')
+    Product = apps.get_model('crm', 'Product')
+    Order = apps.get_model('crm', 'Order')
+    Through = Order.products.through
+
+    duplicated = Customer.objects.using(db).values('email').annotate(keep=Min('id'), n=Count('id')).filter(n__gt=1)
+    for row in duplicated:
+        extra = Customer.objects.using(db).filter(email=row['email']).exclude(id=row['keep'])
+        Order.objects.using(db).filter(customer__in=extra).update(customer_id=row['keep'])
+        extra.delete()
+
+    duplicated = Product.objects.using(db).values('name').annotate(keep=Min('id'), n=Count('id')).filter(n__gt=1)
+    for row in duplicated:
+        extra = list(Product.objects.using(db).filter(name=row['name']).exclude(id=row['keep']).values_list('id', flat=True))
+        order_ids = Through.objects.using(db).filter(product_id__in=extra).values_list('order_id', flat=True)
+        Through.objects.using(db).bulk_create(
+            [Through(order_id=order_id, product_id=row['keep']) for order_id in set(order_ids)],
+            ignore_conflicts=True,
+        )
+        Product.objects.using(db).filter(id__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_scheduled_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customer',
+            name='email',
+            field=models.EmailField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:05
+
+import datetime
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_reminders_now(apps, schema_editor):
+    # The previous job already reminded everything up to now
+    Watermark = apps.get_model('crm', 'Watermark')
+    Watermark.objects.using(schema_editor.connection.alias).get_or_create(name='order_reminders', defaults={'order_date': timezone.now()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField(unique=True)),
+                ('email', models.EmailField(max_length=255)),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('order_date', models.DateTimeField(blank=True, null=True)),
+                ('order_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_date',
+            field=models.DateTimeField(default=datetime.datetime.now),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_date', 'id'], name='crm_order_date_id_idx'),
+        ),
+        migrations.RunPython(start_reminders_now, migrations.RunPython.noop),
+    ]
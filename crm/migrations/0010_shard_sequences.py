@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:25
+
+import copy
+
+from django.db import migrations, models
+
+
+def drop_product_constraints_in_shards(apps, schema_editor):
+    # In a shard, order links are written before the shard's copy of their
+    # products (refreshed after commit), so the links can't reference it
+    from crm import sharding
+
+    if schema_editor.connection.alias not in sharding.shards():
+        return
+    for model_name in ("order", "archivedorder"):
+        through = apps.get_model("crm", model_name)._meta.get_field("products").remote_field.through
+        old = through._meta.get_field("product")
+        new = copy.copy(old)
+        new.db_constraint = False
+        schema_editor.alter_field(through, old, new)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_bulk_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(drop_product_constraints_in_shards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:41
+
+from django.db import migrations, models
+
+
+def position_existing_events(apps, schema_editor):
+    # Events from before positions existed keep their id as their place in
+    # the feed, so consumers' stored cursors stay valid
+    db = schema_editor.connection.alias
+    ChangeEvent = apps.get_model('crm', 'ChangeEvent')
+    ShardSequence = apps.get_model('crm', 'ShardSequence')
+    ChangeEvent.objects.using(db).update(position=models.F('id'))
+    last = ChangeEvent.objects.using(db).aggregate(last=models.Max('id'))['last'] or 0
+    ShardSequence.objects.using(db).update_or_create(name='outbox', defaults={'next_value': last + 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_shard_sequences'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='changeevent',
+            name='crm_changeevent_entity_idx',
+        ),
+        migrations.AddField(
+            model_name='changeevent',
+            name='position',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['entity', 'position'], name='crm_changeevent_entity_idx'),
+        ),
+        migrations.RunPython(position_existing_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def stamp_existing_orders(apps, schema_editor):
+    # Best guess for rows inserted before the column existed; it also keeps
+    # the reminders watermark, which held an order_date, meaningful
+    Order = apps.get_model('crm', 'Order')
+    Order.objects.using(schema_editor.connection.alias).update(created_at=models.F('order_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_change_feed_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(stamp_existing_orders, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='crm_order_created_id_idx'),
+        ),
+        migrations.RenameField(
+            model_name='watermark',
+            old_name='order_date',
+            new_name='order_created_at',
+        ),
+    ]
@@ -3,26 +3,286 @@ from django.core.validators import MinValueValidator
 from datetime import datetime
 
 class Customer(models.Model):
-    name = models.CharField(max_length=100)
-    email = models.EmailField(max_length=255)
+    name = models.CharField(max_length=100, db_index=True)
+    email = models.EmailField(max_length=255, unique=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(default=datetime.now)
 
+    def save(self, *args, **kwargs):
+        from crm import sharding
+
+        if sharding.enabled():
+            kwargs = sharding.prepare_save(self, kwargs)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} {self.email}"
     
 class Product(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0.01)])
     stock = models.PositiveBigIntegerField(default=0, validators=[MinValueValidator(0)])
+    low_stock_threshold = models.PositiveIntegerField(default=10)
 
     def __str__(self):
         return self.name
 
 class Order(models.Model):
     customer = models.ForeignKey('Customer', on_delete=models.CASCADE, related_name='orders')
+    # With sharding the links live in the order's shard, where migration 0010
+    # drops their constraint on the product copies
     products = models.ManyToManyField('Product', related_name='orders')
     order_date = models.DateTimeField(default=datetime.now)
+    # Set by the server on insert; order_date is whatever the client sent
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Date range filters
+            models.Index(fields=['order_date', 'id'], name='crm_order_date_id_idx'),
+            # The (created_at, id) keyset scans of incremental jobs
+            models.Index(fields=['created_at', 'id'], name='crm_order_created_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from crm import sharding
+
+        if sharding.enabled():
+            kwargs = sharding.prepare_save(self, kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Order #{self.id} for {self.customer.name}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    Cold store for orders older than ORDER_ARCHIVE_AFTER_DAYS, moved here by
+    crm.archive.archive_orders. Rows keep the id they had as an Order.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey('Customer', on_delete=models.CASCADE, related_name='archived_orders')
+    products = models.ManyToManyField('Product', related_name='archived_orders')
+    order_date = models.DateTimeField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        from crm import sharding
+
+        if sharding.enabled():
+            kwargs = sharding.prepare_save(self, kwargs)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Archived order #{self.id} for {self.customer.name}"
+
+
+class LowStockAlert(models.Model):
+    """
+    Work queue of products whose stock crossed below their threshold.
+    Rows are written when the crossing happens and drained by the restock job.
+    """
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='low_stock_alerts')
+    stock = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Only pending rows are ever scanned, so keep the index that small
+            models.Index(
+                fields=['created_at'],
+                name='crm_lowstock_pending_idx',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+        constraints = [
+            # At most one pending alert per product
+            models.UniqueConstraint(
+                fields=['product'],
+                name='crm_lowstock_one_pending',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Low stock: {self.product_id} ({self.stock})"
+
+
+class ScheduledJob(models.Model):
+    """
+    A recurring job run by the resident worker (`manage.py run_jobs`).
+    `next_run_at` doubles as the claim token: a worker only runs a job after
+    atomically moving it forward, so two workers never start the same tick.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    task = models.CharField(max_length=255)
+    schedule = models.CharField(max_length=100)
+    enabled = models.BooleanField(default=True)
+    max_concurrency = models.PositiveIntegerField(default=1)
+    max_retries = models.PositiveIntegerField(default=3)
+    retry_backoff = models.PositiveIntegerField(default=30)  # seconds, doubled per attempt
+    timeout = models.PositiveIntegerField(default=600)  # seconds before a run's lock expires
+    attempt = models.PositiveIntegerField(default=0)
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.CharField(max_length=20, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.schedule})"
+
+
+class JobRun(models.Model):
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    job = models.ForeignKey('ScheduledJob', on_delete=models.CASCADE, related_name='runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=RUNNING)
+    attempt = models.PositiveIntegerField(default=1)
+    worker = models.CharField(max_length=100)
+    started_at = models.DateTimeField(auto_now_add=True)
+    # Overlap lock: a running row holds one of the job's concurrency slots until it finishes or expires
+    locked_until = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['job', 'locked_until'],
+                name='crm_jobrun_running_idx',
+                condition=models.Q(status='running'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.job.name} #{self.pk} {self.status}"
+
+
+class Watermark(models.Model):
+    """
+    How far an incremental job has got through orders, as the last
+    processed (created_at, id). The next run resumes strictly after it.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    order_created_at = models.DateTimeField(null=True, blank=True)
+    order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.order_created_at} #{self.order_id}"
+
+
+class OrderReminder(models.Model):
+    """One row per order a reminder was sent for; unique so recording is idempotent."""
+    order_id = models.BigIntegerField(unique=True)
+    email = models.EmailField(max_length=255)
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Reminder for order #{self.order_id} to {self.email}"
+
+
+class ChangeEvent(models.Model):
+    """
+    Outbox of CRM writes. Rows are appended in the same transaction as the
+    change they describe; `position` is their place in the feed, given once
+    that transaction has committed (crm.outbox), and is the consumers' cursor.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ARCHIVED = 'archived'
+    ACTION_CHOICES = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted'), (ARCHIVED, 'Archived')]
+
+    entity = models.CharField(max_length=30)
+    entity_id = models.BigIntegerField()
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    position = models.BigIntegerField(null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            # Consumers following a single entity type
+            models.Index(fields=['entity', 'position'], name='crm_changeevent_entity_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.entity} {self.entity_id} {self.action}"
+
+
+class BulkJob(models.Model):
+    """
+    A bulk mutation submitted to run in the background. The rows are split
+    into BulkJobChunk rows that workers claim one at a time, so progress is
+    the sum over the chunks.
+    """
+    CREATE_CUSTOMERS = 'create_customers'
+    UPDATE_PRODUCTS = 'update_products'
+    KIND_CHOICES = [(CREATE_CUSTOMERS, 'Create customers'), (UPDATE_PRODUCTS, 'Update products')]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    total_rows = models.PositiveIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} job #{self.pk} ({self.total_rows} rows)"
+
+
+class BulkJobChunk(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    job = models.ForeignKey('BulkJob', on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField()  # row number of rows[0] in the job
+    rows = models.JSONField(default=list)  # emptied once the chunk is done
+    row_count = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    # Claim lock: a running chunk whose lock expired is picked up again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    succeeded = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)  # [[row, message], ...]
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='crm_bulkjobchunk_job_index_uniq'),
+        ]
+        indexes = [
+            # Workers only ever look for chunks that still need running
+            models.Index(
+                fields=['job', 'index'],
+                name='crm_bulkjobchunk_open_idx',
+                condition=models.Q(status__in=['pending', 'running']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.job_id} chunk {self.index} {self.status}"
+
+
+class ShardSequence(models.Model):
+    """
+    Named counter kept in the default database: global ids for sharded rows
+    (crm.sharding) and change feed positions (crm.outbox). `next_value` is
+    the first value not handed out yet; callers reserve values by moving it
+    forward.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} @ {self.next_value}"
@@ -0,0 +1,108 @@
+"""
+Transactional outbox of CRM changes.
+
+Write paths call record() inside the transaction that makes the change, so
+an event exists if and only if the change committed. Consumers read the
+feed in position order from a cursor, with events_after() / iter_events()
+or the `changes` GraphQL field, and store the last position they processed.
+
+Ids are allocated before commit, so a slow transaction can commit an id
+lower than one already visible; ids can't be the cursor. Instead events
+get their feed position after commit, from assign_positions(): it holds
+the lock on the "outbox" ShardSequence row until its own commit, so
+positions become visible in increasing order and a consumer's cursor
+never moves past an event that shows up later.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from crm.models import ChangeEvent, ShardSequence
+
+logger = logging.getLogger(__name__)
+
+FEED_SEQUENCE = "outbox"
+
+
+def record(entity, action, ids, **data):
+    """Append one `action` event per id of `entity`, all sharing `data`."""
+    events = [ChangeEvent(entity=entity, entity_id=pk, action=action, data=data) for pk in ids if pk is not None]
+    if events:
+        ChangeEvent.objects.bulk_create(events)
+        transaction.on_commit(assign_positions, robust=True)
+    return len(events)
+
+
+def record_each(entity, action, data_by_id):
+    """Like record(), with each id's own data, e.g. {pk: {"fields": [...]}}."""
+    events = [
+        ChangeEvent(entity=entity, entity_id=pk, action=action, data=data)
+        for pk, data in data_by_id.items() if pk is not None
+    ]
+    if events:
+        ChangeEvent.objects.bulk_create(events)
+        transaction.on_commit(assign_positions, robust=True)
+    return len(events)
+
+
+def assign_positions(limit=10000):
+    """Give committed events without a feed position the next positions, in id order; returns how many."""
+    if not ChangeEvent.objects.filter(position__isnull=True).exists():
+        return 0
+    with transaction.atomic():
+        ShardSequence.objects.get_or_create(name=FEED_SEQUENCE)
+        # Take the counter's lock before looking for events, and keep it
+        # until commit: assigners run one at a time, in position order
+        ShardSequence.objects.filter(name=FEED_SEQUENCE).update(next_value=F("next_value"))
+        pending = list(ChangeEvent.objects.filter(position__isnull=True).order_by("pk").only("pk")[:limit])
+        if not pending:
+            return 0
+        start = ShardSequence.objects.values_list("next_value", flat=True).get(name=FEED_SEQUENCE)
+        for position, event in enumerate(pending, start):
+            event.position = position
+        ChangeEvent.objects.bulk_update(pending, ["position"], batch_size=500)
+        ShardSequence.objects.filter(name=FEED_SEQUENCE).update(next_value=start + len(pending))
+    return len(pending)
+
+
+def events_after(cursor=0, limit=100, entities=None):
+    """Up to `limit` events with a position greater than `cursor`, in position order."""
+    # Normally done right after commit; this catches events whose
+    # assignment failed or whose process died in between
+    try:
+        assign_positions()
+    except Exception:
+        logger.exception("Could not assign change feed positions")
+    events = ChangeEvent.objects.filter(position__gt=cursor or 0)
+    if entities:
+        events = events.filter(entity__in=entities)
+    return list(events.order_by("position")[:limit])
+
+
+def iter_events(cursor=0, batch_size=500, entities=None, follow=False, poll_interval=1.0):
+    """
+    Yield events after `cursor` in order. With follow=True keep polling for
+    new events instead of stopping at the end of the feed.
+    """
+    while True:
+        events = events_after(cursor, batch_size, entities)
+        yield from events
+        if events:
+            cursor = events[-1].position
+        if len(events) < batch_size:
+            if not follow:
+                return
+            time.sleep(poll_interval)
+
+
+def prune_events(days=None):
+    """Delete events older than OUTBOX_RETENTION_DAYS; returns how many."""
+    if days is None:
+        days = getattr(settings, "OUTBOX_RETENTION_DAYS", 30)
+    deleted, _ = ChangeEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
@@ -0,0 +1,171 @@
+"""
+On-demand profiling of single GraphQL requests.
+
+A request to /graphql carrying `X-Profile: <GRAPHQL_PROFILING["TOKEN"]>`
+runs the view under cProfile, plus tracemalloc when it also sends
+`X-Profile-Memory: 1`. The .pstats file (and an allocation report) are
+saved to GRAPHQL_PROFILING["DIRECTORY"] under the operation name, and a
+summary of the top functions is added to the response's `extensions`.
+
+Requests without the header pass straight through: the only cost is one
+dict lookup. Profiling is off while the token is empty, and one request is
+profiled at a time; a concurrent one is served normally with a note.
+"""
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.conf import settings
+
+PROFILING_DEFAULTS = {
+    "TOKEN": "",
+    "PATHS": ["/graphql"],
+    "DIRECTORY": "tmp/profiles",
+    "TOP": 20,
+    "TRACEMALLOC_FRAMES": 10,
+}
+
+re_unsafe = re.compile(r"[^A-Za-z0-9_.-]+")
+
+_lock = threading.Lock()
+
+
+def profiling_settings():
+    return {**PROFILING_DEFAULTS, **getattr(settings, "GRAPHQL_PROFILING", {})}
+
+
+def operation_name(request):
+    """Name of the (first) operation in the request, for file names."""
+    from crm.views import json_body, operation_labels
+
+    if request.method == "GET":
+        operations = [{"query": request.GET.get("query"), "operationName": request.GET.get("operationName")}]
+    else:
+        try:
+            body = json_body(request)
+        except ValueError:
+            return "unknown"
+        operations = body if isinstance(body, list) else [body]
+    for operation in operations:
+        if isinstance(operation, dict) and operation.get("query"):
+            return operation_labels(operation["query"], operation.get("operationName"))[0]
+    return "unknown"
+
+
+def top_functions(profiler, limit):
+    # By own time: sorted by cumulative time the top is just the view's wrappers
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "totalSeconds": round(total, 6),
+            "cumulativeSeconds": round(cumulative, 6),
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in rows
+    ]
+
+
+def top_allocations(before, after, limit):
+    return [
+        {
+            "location": str(stat.traceback[0]),
+            "sizeBytes": stat.size_diff,
+            "count": stat.count_diff,
+        }
+        for stat in after.compare_to(before, "lineno")[:limit]
+    ]
+
+
+class ProfilingMiddleware:
+    """Put it last in MIDDLEWARE so the profile covers the view only."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = request.META.get("HTTP_X_PROFILE")
+        if token is None:
+            return self.get_response(request)
+
+        config = profiling_settings()
+        if (
+            not config["TOKEN"]
+            or not hmac.compare_digest(token.encode(), config["TOKEN"].encode())
+            or not any(request.path.startswith(path) for path in config["PATHS"])
+        ):
+            return self.get_response(request)
+
+        if not _lock.acquire(blocking=False):
+            return self.add_extensions(self.get_response(request), {"skipped": "Another request is being profiled."})
+        try:
+            return self.profile(request, config)
+        finally:
+            _lock.release()
+
+    def profile(self, request, config):
+        memory = request.META.get("HTTP_X_PROFILE_MEMORY") == "1" and not tracemalloc.is_tracing()
+        # Leave the body uncompressed so the summary can be added to it
+        request.META.pop("HTTP_ACCEPT_ENCODING", None)
+
+        if memory:
+            tracemalloc.start(config["TRACEMALLOC_FRAMES"])
+            before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            wall = time.perf_counter() - start
+            if memory:
+                after = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        name = operation_name(request)
+        directory = os.path.join(settings.BASE_DIR, config["DIRECTORY"])
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(
+            directory, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{re_unsafe.sub('_', name)}-{os.getpid()}"
+        )
+        profiler.dump_stats(base + ".pstats")
+        summary = {
+            "operation": name,
+            "wallSeconds": round(wall, 6),
+            "pstats": base + ".pstats",
+            "topFunctions": top_functions(profiler, config["TOP"]),
+        }
+        if memory:
+            allocations = top_allocations(before, after, config["TOP"])
+            with open(base + ".alloc.txt", "w") as file:
+                file.write(f"peak traced memory: {peak} bytes\n")
+                for stat in after.compare_to(before, "traceback")[:config["TOP"]]:
+                    file.write(f"\n{stat}\n")
+                    file.writelines(f"    {line}\n" for line in stat.traceback.format())
+            summary.update({"peakBytes": peak, "allocations": base + ".alloc.txt", "topAllocations": allocations})
+        return self.add_extensions(response, summary)
+
+    @staticmethod
+    def add_extensions(response, profile):
+        if response.get("Content-Type") != "application/json" or response.has_header("Content-Encoding"):
+            return response
+        try:
+            data = json.loads(response.content)
+        except ValueError:
+            return response
+        for result in data if isinstance(data, list) else [data]:
+            if isinstance(result, dict):
+                result.setdefault("extensions", {})["profile"] = profile
+        response.content = json.dumps(data)
+        response["Content-Length"] = str(len(response.content))
+        return response
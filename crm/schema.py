@@ -1,13 +1,27 @@
 import graphene
+from django.conf import settings
+from graphql import GraphQLError
+from graphql_relay import from_global_id
 from graphene_django import DjangoObjectType
-from crm.models import Product, Customer, Order
-import re
+from crm.models import Product, Customer, Order, ArchivedOrder, ChangeEvent, BulkJob
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from datetime import datetime
 from decimal import Decimal
-from graphene_django.filter import DjangoFilterConnectionField
-from .filters import CustomerFilter, ProductFilter, OrderFilter
-from django.db.models import Sum
+from .filters import (
+    CustomerFilter, ProductFilter, OrderFilter, filter_orders, order_products_through, with_order_total,
+)
+from .connections import (
+    CountableConnection, CountFreeConnectionField, MergedQuerySet, selected_fields, selected_node_fields,
+)
+from .loaders import get_loaders
+from .entity_cache import invalidate
+from . import bulk_jobs, outbox, sharding
+from .stock import OutOfStock, consume_stock, drain_low_stock_queue, queue_low_stock, update_products
+from .validators import PHONE_MESSAGE, valid_phone
+
+# Largest id a BigAutoField can hold
+MAX_PK = 2 ** 63 - 1
 
 class CustomerType(DjangoObjectType):
     numeric_id = graphene.Int()
@@ -15,6 +29,7 @@ class CustomerType(DjangoObjectType):
     class Meta:
         model = Customer
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = CustomerFilter
         fields = ['name', 'email', 'phone', 'created_at']
 
@@ -36,39 +51,73 @@ class CreateCustomer(graphene.Mutation):
 
     class Arguments:
         input = CustomerInput(required=True)
+        upsert = graphene.Boolean(default_value=False)
 
-    def mutate(self, info, input):
+    def mutate(self, info, input, upsert=False):
         name = input.name
         email = input.email
         phone = input.phone
-
-        # Check for duplicate email
-        if Customer.objects.filter(email=email).exists():
-            return CreateCustomer(success=False, message="User with this email already exists!")
         
         # Validates Phone Number
-        phone_pattern = r"^(?:\+\d{10,15}|\d{3}-\d{3}-\d{4})$"
-        if phone and not re.match(phone_pattern, phone):
+        if not valid_phone(phone):
             return CreateCustomer(
                 success = False,
-                message = "Invalid phone number format, Examples: +1234567890 or 123-456-7890"
+                message = PHONE_MESSAGE
             )
         
-        # Create a new Customer
+        # Create a new Customer; uniqueness is left to the database constraint
+        # so the write is a single statement and safe under concurrency
         customer = Customer(name=name, email=email, phone=phone)
         try:
-            customer.full_clean()
-            customer.save()
+            customer.full_clean(validate_unique=False, validate_constraints=False)
         except ValidationError as e:
             return CreateCustomer(
                 success = False,
                 message = f"Validation Error: {e}"
             )
+
+        # With sharding the unique index only covers the shard the email
+        # hashes to; a customer created before shards were added may be elsewhere.
+        # An upsert also needs to know whether it creates the customer.
+        existing = sharding.find_customer(email) if upsert or sharding.enabled() else None
+
+        if upsert:
+            # Fields not given keep their stored value
+            update_fields = ["name"] if phone is None else ["name", "phone"]
+            with sharding.atomic(sharding.db_for(existing) if existing else sharding.db_for_email(email)):
+                if existing is None:
+                    # INSERT ... ON CONFLICT (email) DO UPDATE, for a concurrent insert
+                    sharding.bulk_create(
+                        Customer, [customer],
+                        update_conflicts=True, unique_fields=["email"], update_fields=update_fields,
+                    )
+                    # The stored row: on a conflict it keeps its created_at
+                    customer = sharding.find_customer(email)
+                    outbox.record("customer", ChangeEvent.CREATED, [customer.pk])
+                else:
+                    customer.pk, customer.created_at = existing.pk, existing.created_at
+                    if phone is None:
+                        customer.phone = existing.phone
+                    customer.save(update_fields=update_fields)
+                    outbox.record("customer", ChangeEvent.UPDATED, [customer.pk], fields=update_fields)
+            invalidate(Customer, [customer.pk])
+            message = "Customer saved successfully!"
+        else:
+            if existing is not None:
+                return CreateCustomer(success=False, message="User with this email already exists!")
+            try:
+                with sharding.atomic(sharding.db_for_email(email)):
+                    customer.save(force_insert=True)
+                    outbox.record("customer", ChangeEvent.CREATED, [customer.pk])
+            except IntegrityError:
+                return CreateCustomer(success=False, message="User with this email already exists!")
+            message = "Customer created successfully!"
+        get_loaders(info.context).customers.prime(customer)
         
         return CreateCustomer(
             customer = customer,
             success = True,
-            message = "Customer created successfully!"
+            message = message
         )
 
 class BulkCreateCustomers(graphene.Mutation):
@@ -100,8 +149,9 @@ class ProductType(DjangoObjectType):
     class Meta:
         model = Product
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = ProductFilter
-        fields = ['name', 'price', 'stock']
+        fields = ['name', 'price', 'stock', 'low_stock_threshold']
     
     def resolve_numeric_id(self, info):
         return self.pk
@@ -110,6 +160,7 @@ class ProductInput(graphene.InputObjectType):
     name = graphene.String(required=True)
     price = graphene.Float(required=True)
     stock = graphene.Int(required=False)
+    low_stock_threshold = graphene.Int(required=False)
 
 class CreateProduct(graphene.Mutation):
     product = graphene.Field(ProductType)
@@ -118,8 +169,9 @@ class CreateProduct(graphene.Mutation):
 
     class Arguments:
         input = ProductInput(required=True)
+        upsert = graphene.Boolean(default_value=False)
 
-    def mutate(self, info, input):
+    def mutate(self, info, input, upsert=False):
         name = input.name
         price = Decimal(str(input.price))
         stock = input.stock if input.stock is not None else 0
@@ -140,13 +192,44 @@ class CreateProduct(graphene.Mutation):
 
         # Create a new Product
         product = Product(name=name, price=price, stock=stock)
+        # On upsert, fields not given keep their stored value
+        update_fields = ["price"] if input.stock is None else ["price", "stock"]
+        if input.low_stock_threshold is not None:
+            product.low_stock_threshold = input.low_stock_threshold
+            update_fields.append("low_stock_threshold")
         try:
-            product.full_clean()
-            product.save()
-            return CreateProduct(product=product, success=True, message="Product created successfully.")
+            product.full_clean(validate_unique=False, validate_constraints=False)
         except ValidationError as e:
             return CreateProduct(product=None, success=False, message=f"Validation error: {e}")
 
+        if upsert:
+            # INSERT ... ON CONFLICT (name) DO UPDATE; an update may lower the stock
+            with transaction.atomic():
+                existed = Product.objects.filter(name=name).exists()
+                Product.objects.bulk_create(
+                    [product], update_conflicts=True, unique_fields=["name"], update_fields=update_fields
+                )
+                # The stored row: on a conflict it keeps the fields not given
+                product = Product.objects.get(name=name)
+                if existed:
+                    outbox.record("product", ChangeEvent.UPDATED, [product.pk], fields=update_fields)
+                else:
+                    outbox.record("product", ChangeEvent.CREATED, [product.pk])
+                queue_low_stock([product.pk])
+            invalidate(Product, [product.pk])
+            get_loaders(info.context).products.prime(product)
+            return CreateProduct(product=product, success=True, message="Product saved successfully.")
+
+        try:
+            with transaction.atomic():
+                product.save(force_insert=True)
+                outbox.record("product", ChangeEvent.CREATED, [product.pk])
+        except IntegrityError:
+            return CreateProduct(product=None, success=False, message="Product with this name already exists.")
+        if product.stock < product.low_stock_threshold:
+            queue_low_stock([product.pk])
+        return CreateProduct(product=product, success=True, message="Product created successfully.")
+
 class UpdateProductStockInput(graphene.InputObjectType):
     stock_increment = graphene.Int(default_value=10)
 
@@ -159,14 +242,10 @@ class UpdateLowStockProducts(graphene.Mutation):
         input = UpdateProductStockInput(required=False)
 
     def mutate(self, info, input=None):
-        # fetch the product less than 10
-        products = Product.objects.filter(stock__lt=10)
+        # restock only the products queued when they crossed their threshold
         increment = input.stock_increment if input else 10
-        updated_products = []
-        for product in products:
-            product.stock += increment
-            product.save()
-            updated_products.append(product)
+        updated_products = drain_low_stock_queue(increment=increment)
+        get_loaders(info.context).products.clear()
         
         return UpdateLowStockProducts(
             product_list = updated_products,
@@ -174,6 +253,113 @@ class UpdateLowStockProducts(graphene.Mutation):
             message="Products added to the list."
         )
 
+class ProductUpdateInput(graphene.InputObjectType):
+    id = graphene.ID(required=True)
+    price = graphene.Float()
+    stock = graphene.Int()
+    stock_delta = graphene.Int()
+
+class BulkUpdateProducts(graphene.Mutation):
+    products = graphene.List(ProductType)
+    updated_count = graphene.Int()
+    errors = graphene.List(graphene.String)
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(ProductUpdateInput), required=True)
+
+    def mutate(root, info, input):
+        ids, written, errors = update_products(input)
+
+        loaders = get_loaders(info.context)
+        for pk in written:
+            loaders.products.clear(pk)
+        updated = Product.objects.in_bulk(list(written))
+        return BulkUpdateProducts(
+            products=[updated[pk] for pk in ids if pk in updated],
+            updated_count=len(written),
+            errors=[f"Row {i + 1}: {message}" for i, message in sorted(errors)],
+        )
+
+def job_progress(job):
+    # One aggregate query for all the progress fields of a job
+    if not hasattr(job, "_progress"):
+        job._progress = bulk_jobs.job_status(job)
+    return job._progress
+
+class BulkJobType(DjangoObjectType):
+    status = graphene.String()
+    processed_rows = graphene.Int()
+    succeeded_rows = graphene.Int()
+    failed_rows = graphene.Int()
+    progress = graphene.Float()
+    rows_per_second = graphene.Float()
+    started_at = graphene.DateTime()
+    finished_at = graphene.DateTime()
+    errors = graphene.List(graphene.String, first=graphene.Int(default_value=100))
+
+    class Meta:
+        model = BulkJob
+        fields = ['id', 'kind', 'total_rows', 'chunk_size', 'created_at']
+        convert_choices_to_enum = False
+
+    def resolve_status(self, info):
+        return job_progress(self)["status"]
+
+    def resolve_processed_rows(self, info):
+        return job_progress(self)["processed_rows"]
+
+    def resolve_succeeded_rows(self, info):
+        return job_progress(self)["succeeded_rows"]
+
+    def resolve_failed_rows(self, info):
+        return job_progress(self)["failed_rows"]
+
+    def resolve_progress(self, info):
+        return job_progress(self)["progress"]
+
+    def resolve_rows_per_second(self, info):
+        return job_progress(self)["rows_per_second"]
+
+    def resolve_started_at(self, info):
+        return job_progress(self)["started_at"]
+
+    def resolve_finished_at(self, info):
+        return job_progress(self)["finished_at"]
+
+    def resolve_errors(self, info, first=100):
+        return [
+            message if i is None else f"Row {i + 1}: {message}"
+            for i, message in bulk_jobs.job_errors(self, max(0, min(first, 1000)))
+        ]
+
+def submit_bulk_job(kind, input, chunk_size):
+    try:
+        return bulk_jobs.submit(kind, [dict(row) for row in input], chunk_size)
+    except ValueError as e:
+        raise GraphQLError(str(e))
+
+# Background variants of the bulk mutations: they return a job right away,
+# poll bulkJob(id:) for its progress and errors
+class BulkCreateCustomersAsync(graphene.Mutation):
+    job = graphene.Field(BulkJobType)
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(CustomerInput), required=True)
+        chunk_size = graphene.Int()
+
+    def mutate(root, info, input, chunk_size=None):
+        return BulkCreateCustomersAsync(job=submit_bulk_job(BulkJob.CREATE_CUSTOMERS, input, chunk_size))
+
+class BulkUpdateProductsAsync(graphene.Mutation):
+    job = graphene.Field(BulkJobType)
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(ProductUpdateInput), required=True)
+        chunk_size = graphene.Int()
+
+    def mutate(root, info, input, chunk_size=None):
+        return BulkUpdateProductsAsync(job=submit_bulk_job(BulkJob.UPDATE_PRODUCTS, input, chunk_size))
+
 class OrderType(DjangoObjectType):
     total_amount = graphene.Float()
     products = graphene.List(lambda: ProductType)  # override connection field
@@ -182,14 +368,60 @@ class OrderType(DjangoObjectType):
     class Meta:
         model = Order
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = OrderFilter
         fields = ['customer', 'order_date', 'total_amount']  # remove 'products' from Meta
 
+    @classmethod
+    def is_type_of(cls, root, info):
+        # allOrders(includeArchived: true) also yields archived orders
+        if isinstance(root, ArchivedOrder):
+            return True
+        return super().is_type_of(root, info)
+
+    @classmethod
+    def prefetch_page(cls, orders, info, selected=None):
+        # One query for the product ids of the whole page and one batch per
+        # loader, instead of a query per order for each of them
+        if selected is None:
+            selected = selected_node_fields(info)
+        loaders = get_loaders(info.context)
+        if selected & {"products", "totalAmount"}:
+            product_ids = set()
+            # One query per table, and per shard when orders are sharded
+            for model, db in {(type(order), order._state.db) for order in orders}:
+                group = {order.pk: order for order in orders if type(order) is model and order._state.db == db}
+                through, order_field = order_products_through(model)
+                for order in group.values():
+                    order._product_ids = []
+                rows = through.objects.using(db).filter(**{f"{order_field}_id__in": list(group)})
+                for order_id, product_id in rows.values_list(f"{order_field}_id", "product_id"):
+                    group[order_id]._product_ids.append(product_id)
+                    product_ids.add(product_id)
+            if "products" in selected or any(getattr(order, "total_amount_db", None) is None for order in orders):
+                loaders.products.load_many(list(product_ids))
+        if "customer" in selected:
+            loaders.customers.load_many(list({order.customer_id for order in orders}))
+
+    def resolve_customer(self, info):
+        return get_loaders(info.context).customers.load(self.customer_id)
+
+    @staticmethod
+    def load_products(order, info):
+        # Only the ids come from the join table; the rows come from the entity cache
+        if not hasattr(order, "_product_ids"):
+            order._product_ids = list(order.products.values_list("pk", flat=True))
+        products = get_loaders(info.context).products.load_many(order._product_ids)
+        return [product for product in products if product is not None]
+
     def resolve_total_amount(self, info):
-        return sum(product.price for product in self.products.all())
+        # Reuse the subquery total when the queryset already computed it
+        if getattr(self, "total_amount_db", None) is not None:
+            return self.total_amount_db
+        return sum(product.price for product in OrderType.load_products(self, info))
 
     def resolve_products(self, info):
-        return self.products.all()
+        return OrderType.load_products(self, info)
     
     def resolve_numeric_id(self, info):
         return self.pk
@@ -217,32 +449,58 @@ class CreateOrder(graphene.Mutation):
 
         order_date = input.order_date
 
+        loaders = get_loaders(info.context)
+
         # Validate customer
-        try:
-            customer = Customer.objects.get(id=customer_id)
-        except Customer.DoesNotExist:
+        customer = loaders.customers.load(customer_id)
+        if customer is None:
             return CreateOrder(success=False, message="Customer not found.")
 
         # Validate products
-        products = Product.objects.filter(id__in=product_ids)
-        if not products.exists():
+        products = [p for p in loaders.products.load_many(product_ids) if p is not None]
+        if not products:
             return CreateOrder(success=False, message="No valid products found.")
 
-        if len(product_ids) != products.count():
+        if len(product_ids) != len({p.pk for p in products}):
             return CreateOrder(success=False, message="Some product IDs are invalid.")
 
         if not product_ids:
             return CreateOrder(success=False, message="At least one product must be selected.")
 
-        # Create order
-        order = Order.objects.create(
-            customer=customer,
-            order_date=order_date or datetime.now()
-        )
-        order.products.set(products)
+        # Create order; each ordered product consumes one unit of stock.
+        # With sharding the order goes to its customer's shard and the
+        # outbox and stock writes to default, in one atomic() over both
+        try:
+            with sharding.atomic(sharding.db_for(customer)):
+                order = Order.objects.create(
+                    customer=customer,
+                    order_date=order_date or datetime.now()
+                )
+                order.products.set(products)
+                outbox.record(
+                    "order", ChangeEvent.CREATED, [order.pk],
+                    customer_id=customer.pk, product_ids=[p.pk for p in products],
+                )
+                consume_stock([p.pk for p in products])
+        except OutOfStock as e:
+            names = ", ".join(p.name for p in products if p.pk in e.product_ids)
+            return CreateOrder(success=False, message=f"Out of stock: {names}.")
+        for product in products:
+            loaders.products.clear(product.pk)
 
         return CreateOrder(order=order, success=True, message="Order created successfully.")
 
+class ChangeEventType(DjangoObjectType):
+    class Meta:
+        model = ChangeEvent
+        fields = ['id', 'position', 'entity', 'entity_id', 'action', 'data', 'created_at']
+        convert_choices_to_enum = False
+
+class ChangeFeed(graphene.ObjectType):
+    events = graphene.List(ChangeEventType)
+    cursor = graphene.String()  # pass back as `after` to continue
+    has_more = graphene.Boolean()
+
 class CustomerFilterInput(graphene.InputObjectType):
     nameIcontains = graphene.String()
     emailIcontains = graphene.String()
@@ -268,23 +526,105 @@ class OrderFilterInput(graphene.InputObjectType):
 
 class Query(graphene.ObjectType):
     # Add custom `filter` and `orderBy` args; return queryset -> Relay edges
-    all_customers = DjangoFilterConnectionField(
+    all_customers = CountFreeConnectionField(
         CustomerType,
         filter=graphene.Argument(CustomerFilterInput),
         order_by=graphene.List(graphene.String)
     )
-    all_products = DjangoFilterConnectionField(
+    all_products = CountFreeConnectionField(
         ProductType,
         filter=graphene.Argument(ProductFilterInput),
         order_by=graphene.List(graphene.String)
     )
-    all_orders = DjangoFilterConnectionField(
+    all_orders = CountFreeConnectionField(
         OrderType,
         filter=graphene.Argument(OrderFilterInput),
-        order_by=graphene.List(graphene.String)
+        order_by=graphene.List(graphene.String),
+        include_archived=graphene.Boolean(default_value=False)
+    )
+
+    changes = graphene.Field(
+        ChangeFeed,
+        after=graphene.String(),
+        first=graphene.Int(default_value=100),
+        entities=graphene.List(graphene.String)
     )
 
+    # Refetch any Customer/Product/Order by its global ID
+    node = graphene.Field(graphene.relay.Node, id=graphene.ID(required=True))
+    nodes = graphene.List(graphene.relay.Node, ids=graphene.List(graphene.NonNull(graphene.ID), required=True))
+
+    def resolve_node(self, info, id):
+        return Query.load_nodes(info, [id])[0]
+
+    def resolve_nodes(self, info, ids):
+        max_ids = getattr(settings, "GRAPHQL_MAX_NODE_IDS", 1000)
+        if len(ids) > max_ids:
+            raise GraphQLError(f"nodes accepts at most {max_ids} ids.")
+        return Query.load_nodes(info, ids)
+
+    @staticmethod
+    def load_nodes(info, ids):
+        # Decode and group the ids by type, then one batch per type: customers
+        # and products through the loaders, orders with one IN query (plus one
+        # for the archive) and OrderType.prefetch_page for their fields
+        pks = []
+        for global_id in ids:
+            try:
+                type_name, pk = from_global_id(global_id)
+                pk = int(pk)
+            except Exception:
+                pk = None
+            # Anything a BIGINT primary key can't hold is malformed too, not a database error
+            if pk is None or not 0 < pk <= MAX_PK:
+                type_name = pk = None
+            pks.append((type_name, pk))
+        wanted = {}
+        for type_name, pk in pks:
+            wanted.setdefault(type_name, set()).add(pk)
+
+        found = {}
+        loaders = get_loaders(info.context)
+        for type_name, loader in (("CustomerType", loaders.customers), ("ProductType", loaders.products)):
+            if type_name in wanted:
+                type_pks = list(wanted[type_name])
+                found[type_name] = dict(zip(type_pks, loader.load_many(type_pks)))
+        if "OrderType" in wanted:
+            orders = sharding.in_bulk(Order, list(wanted["OrderType"]))
+            archived = wanted["OrderType"] - set(orders)
+            if archived:
+                orders.update(sharding.in_bulk(ArchivedOrder, list(archived)))
+            if orders:
+                OrderType.prefetch_page(list(orders.values()), info, selected=selected_fields(info))
+            found["OrderType"] = orders
+        return [found.get(type_name, {}).get(pk) for type_name, pk in pks]
+
+    bulk_job = graphene.Field(BulkJobType, id=graphene.ID(required=True))
+
+    def resolve_bulk_job(self, info, id):
+        try:
+            return BulkJob.objects.get(pk=int(id))
+        except (ValueError, BulkJob.DoesNotExist):
+            return None
+
+    def resolve_changes(self, info, after=None, first=100, entities=None):
+        try:
+            cursor = int(after or 0)
+        except ValueError:
+            raise GraphQLError("Invalid cursor.")
+        first = max(1, min(first, 1000))
+        events = outbox.events_after(cursor, first + 1, entities)
+        has_more = len(events) > first
+        events = events[:first]
+        return ChangeFeed(
+            events=events,
+            cursor=str(events[-1].position if events else cursor),
+            has_more=has_more,
+        )
+
     def resolve_all_customers(self, info, filter=None, order_by=None, **kwargs):
+        if isinstance(order_by, str):
+            order_by = [field.strip() for field in order_by.split(",") if field.strip()]
         qs = Customer.objects.all()
         if filter:
             if filter.get("nameIcontains"):
@@ -299,7 +639,9 @@ class Query(graphene.ObjectType):
                 qs = qs.filter(phone__startswith=filter["phonePattern"])
         if order_by:
             qs = qs.order_by(*order_by)
-        return qs
+        # With sharding, every shard's page is fetched and merged in order
+        parts = sharding.querysets(qs)
+        return MergedQuerySet(parts) if len(parts) > 1 else qs
 
     def resolve_all_products(self, info, filter=None, order_by=None, **kwargs):
         qs = Product.objects.all()
@@ -322,30 +664,26 @@ class Query(graphene.ObjectType):
 
         return qs
 
-    def resolve_all_orders(self, info, filter=None, order_by=None, **kwargs):
-        # annotate total_amount for DB-level filtering
-        qs = Order.objects.all().annotate(total_amount_db=Sum("products__price"))
-        if filter:
-            if filter.get("orderDateGte"):
-                qs = qs.filter(order_date__gte=filter["orderDateGte"])
-            if filter.get("orderDateLte"):
-                qs = qs.filter(order_date__lte=filter["orderDateLte"])
-            if filter.get("customerName"):
-                qs = qs.filter(customer__name__icontains=filter["customerName"])
-            if filter.get("productName"):
-                qs = qs.filter(products__name__icontains=filter["productName"])
-            if filter.get("productId"):
-                try:
-                    qs = qs.filter(products__id=int(filter["productId"]))
-                except (TypeError, ValueError):
-                    qs = qs.none()
-            if filter.get("totalAmountGte") is not None:
-                qs = qs.filter(total_amount_db__gte=filter["totalAmountGte"])
-            if filter.get("totalAmountLte") is not None:
-                qs = qs.filter(total_amount_db__lte=filter["totalAmountLte"])
-        if order_by:
-            qs = qs.order_by(*order_by)
-        return qs
+    def resolve_all_orders(self, info, filter=None, order_by=None, include_archived=False, **kwargs):
+        if isinstance(order_by, str):
+            order_by = [field.strip() for field in order_by.split(",") if field.strip()]
+
+        def orders(qs):
+            if filter:
+                qs = filter_orders(qs, filter)
+            if order_by:
+                # total_amount_db is only computed when something needs it
+                if any(field.lstrip("-") == "total_amount_db" for field in order_by):
+                    qs = with_order_total(qs)
+                qs = qs.order_by(*order_by)
+            return qs
+
+        # The archive is only touched when asked for; with sharding every
+        # shard is a part of its own
+        parts = sharding.querysets(orders(Order.objects.all()))
+        if include_archived:
+            parts += sharding.querysets(orders(ArchivedOrder.objects.all()))
+        return MergedQuerySet(parts) if len(parts) > 1 else parts[0]
     
 class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
@@ -353,3 +691,6 @@ class Mutation(graphene.ObjectType):
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
+    bulk_update_products = BulkUpdateProducts.Field()
+    bulk_create_customers_async = BulkCreateCustomersAsync.Field()
+    bulk_update_products_async = BulkUpdateProductsAsync.Field()
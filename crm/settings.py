@@ -13,5 +13,6 @@ INSTALLED_APPS = [
 
 CRONJOBS = [
     ('*/5 * * * *', 'crm.cron.log_crm_heartbeat'),
-    ('0 */12 * * *', 'crm.cron.update_low_stock'),
+    # Drains the low-stock queue, which is cheap when empty
+    ('*/10 * * * *', 'crm.cron.update_low_stock'),
 ]
\ No newline at end of file
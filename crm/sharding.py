@@ -0,0 +1,360 @@
+"""
+Optional hash sharding of customers and their orders.
+
+With CRM_SHARDS set to a list of database aliases, every customer lives in
+one shard picked by a hash of its id, and its orders and archived orders
+(with their product links) live next to it. All other models stay global in
+the default database; products are also copied into every shard by
+replicate(), so order filters and totals still join them locally. Shards
+are migrated with the whole crm app (`migrate --database shard0`).
+
+Ids of sharded rows come from global sequences (ShardSequence, reserved in
+blocks) with the shard number in the low SHARD_BITS bits, so any customer
+or order id routes without a lookup, and existing rows stay where they are
+when shards are added. ShardRouter sends instance-bound reads and writes
+(save(), delete(), related managers) to the right shard. Code that reads by
+id uses in_bulk(), and lists are fanned out with querysets() and
+merged in orderBy order by crm.connections.MergedQuerySet (allCustomers,
+allOrders).
+
+A new customer goes to the shard its email hashes to, so the per-shard
+unique index also keeps emails unique across shards; find_customer() looks
+in every shard for rows created before shards were added. Rows written to
+the default database before CRM_SHARDS was set are moved into the shards,
+under new ids, by backfill() (`manage.py backfill_shards`). Writes use
+atomic(), which spans the default database and the shard written to: an
+error rolls back both, but the two commits are not one (no two-phase
+commit). The scheduled jobs (archiving, reminders, cleanup) run over
+databases(). Not shard-aware yet: the admin.
+"""
+import threading
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+SHARD_BITS = 8
+SHARD_MASK = (1 << SHARD_BITS) - 1
+# Models stored in the shards, by model_name of the crm app
+SHARDED_MODELS = {"customer", "order", "archivedorder"}
+# Global models copied into every shard, so order filters and totals can join them
+REPLICATED_MODELS = {"product"}
+ID_BLOCK_SIZE = 100
+
+_blocks = {}
+_lock = threading.Lock()
+
+
+def shards():
+    return getattr(settings, "CRM_SHARDS", [])
+
+
+def enabled():
+    return bool(shards())
+
+
+def is_sharded(model):
+    opts = model._meta
+    if opts.app_label != "crm":
+        return False
+    if opts.auto_created:
+        # Many-to-many link tables live with the model that declares them
+        return opts.auto_created._meta.model_name in SHARDED_MODELS
+    return opts.model_name in SHARDED_MODELS
+
+
+def is_replicated(model):
+    return model._meta.app_label == "crm" and model._meta.model_name in REPLICATED_MODELS
+
+
+def replicate(model, pks):
+    """
+    Copy the current rows `pks` of a replicated model from the default
+    database into every shard, deleting the copies of rows that are gone.
+    entity_cache.invalidate() calls it after each write; to fill a new
+    shard, pass every pk.
+    """
+    pks = set(pks)
+    rows = list(model.objects.using("default").filter(pk__in=pks))
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    for alias in shards():
+        with transaction.atomic(using=alias):
+            model.objects.using(alias).filter(pk__in=pks - {row.pk for row in rows}).delete()
+            if rows:
+                model.objects.using(alias).bulk_create(
+                    rows, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=fields
+                )
+
+
+def db_for_pk(pk):
+    """Alias of the shard holding the customer or order `pk`, None if it can't be one of ours."""
+    aliases = shards()
+    index = pk & SHARD_MASK
+    return aliases[index] if index < len(aliases) else None
+
+
+def reserve_ids(name, count):
+    """Reserve `count` consecutive values of sequence `name`; returns the first."""
+    from crm.models import ShardSequence
+
+    with transaction.atomic(using="default"):
+        ShardSequence.objects.get_or_create(name=name)
+        # The UPDATE locks the row until commit, so the value read back is ours
+        ShardSequence.objects.filter(name=name).update(next_value=F("next_value") + count)
+        end = ShardSequence.objects.values_list("next_value", flat=True).get(name=name)
+    return end - count
+
+
+def next_ids(name, count=1):
+    """`count` unique values of sequence `name`, taken from this process's reserved block."""
+    values = []
+    with _lock:
+        while len(values) < count:
+            block = _blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                size = max(ID_BLOCK_SIZE, count - len(values))
+                start = reserve_ids(name, size)
+                block = _blocks[name] = [start, start + size]
+            take = min(count - len(values), block[1] - block[0])
+            values.extend(range(block[0], block[0] + take))
+            block[0] += take
+    return values
+
+
+def shard_index(email):
+    return zlib.crc32(email.encode()) % len(shards())
+
+
+def db_for_email(email):
+    """Database a new customer with `email` is stored in."""
+    return shards()[shard_index(email)] if enabled() else "default"
+
+
+def db_for(obj):
+    """Database holding the saved instance `obj`."""
+    if enabled() and is_sharded(type(obj)):
+        return db_for_pk(obj.pk)
+    return "default"
+
+
+def databases(model):
+    """Aliases of the databases holding rows of `model`."""
+    if enabled() and is_sharded(model):
+        return list(shards())
+    return ["default"]
+
+
+@contextmanager
+def atomic(using="default"):
+    """transaction.atomic() on the default database and, if another, on `using`."""
+    with transaction.atomic(using="default"):
+        if using == "default":
+            yield
+        else:
+            with transaction.atomic(using=using):
+                yield
+
+
+def find_customer(email):
+    """The customer with `email` in whichever database holds it, or None."""
+    from crm.models import Customer
+
+    for queryset in querysets(Customer.objects.filter(email=email)):
+        customer = queryset.first()
+        if customer is not None:
+            return customer
+    return None
+
+
+def new_customer_ids(emails):
+    """One new customer id per email; the shard, picked by a hash of the email, is carried in the id."""
+    return [
+        (value << SHARD_BITS) | shard_index(email)
+        for value, email in zip(next_ids("customer", len(emails)), emails)
+    ]
+
+
+def new_order_ids(customer_ids):
+    """One new order id per customer id, in the same shard as that customer."""
+    return [
+        (value << SHARD_BITS) | (customer_id & SHARD_MASK)
+        for value, customer_id in zip(next_ids("order", len(customer_ids)), customer_ids)
+    ]
+
+
+def assign_ids(objs):
+    """Give unsaved Customer / Order instances a shard-aware id."""
+    from crm.models import Customer, Order
+
+    customers = [obj for obj in objs if isinstance(obj, Customer) and obj.pk is None]
+    for obj, pk in zip(customers, new_customer_ids([customer.email for customer in customers])):
+        obj.pk = pk
+    orders = [obj for obj in objs if isinstance(obj, Order) and obj.pk is None]
+    for obj, pk in zip(orders, new_order_ids([order.customer_id for order in orders])):
+        obj.pk = pk
+
+
+def prepare_save(obj, kwargs):
+    """save() arguments for a sharded instance: an id if it has none, and its shard."""
+    if obj.pk is None:
+        assign_ids([obj])
+        kwargs.setdefault("force_insert", True)
+    # Also overrides the default alias QuerySet.create() passes
+    kwargs["using"] = db_for_pk(obj.pk)
+    return kwargs
+
+
+def bulk_create(model, objs, **kwargs):
+    """bulk_create() for sharded models: assigns ids and inserts each shard's rows there."""
+    if not enabled() or not is_sharded(model):
+        return model.objects.bulk_create(objs, **kwargs)
+    assign_ids(objs)
+    by_db = defaultdict(list)
+    for obj in objs:
+        by_db[db_for_pk(obj.pk)].append(obj)
+    created = []
+    for alias, group in by_db.items():
+        created.extend(model.objects.using(alias).bulk_create(group, **kwargs))
+    return created
+
+
+def in_bulk(model, pks):
+    """model.objects.in_bulk(pks), with one query per shard involved for sharded models."""
+    if not enabled() or not is_sharded(model):
+        return model.objects.in_bulk(pks)
+    by_db = defaultdict(list)
+    for pk in pks:
+        alias = db_for_pk(pk)
+        if alias is not None:
+            by_db[alias].append(pk)
+    found = {}
+    for alias, group in by_db.items():
+        found.update(model.objects.using(alias).in_bulk(group))
+    return found
+
+
+def backfill(batch_size=1000):
+    """
+    Move the customers left in the default database from before CRM_SHARDS
+    was set, with their orders, archived orders and product links, into
+    their shards. Their ids carry no shard, so they get new ones like new
+    rows do; OrderReminder rows follow the new order ids, and the feed gets
+    a DELETED event for each old id and a CREATED one for its new id (with
+    moved_to / moved_from). Each batch is moved in one transaction per
+    shard, so an interrupted run simply resumes. Returns the number of
+    customers moved.
+    """
+    from crm.models import Customer
+
+    if not enabled():
+        return 0
+    moved = 0
+    while True:
+        customers = list(Customer.objects.using("default").order_by("pk")[:batch_size])
+        if not customers:
+            break
+        emails = [customer.email for customer in customers]
+        new_ids = dict(zip([customer.pk for customer in customers], new_customer_ids(emails)))
+        by_db = defaultdict(list)
+        for customer in customers:
+            by_db[db_for_pk(new_ids[customer.pk])].append(customer)
+        for alias, group in by_db.items():
+            with atomic(alias):
+                _move_customers(alias, group, new_ids)
+        moved += len(customers)
+    return moved
+
+
+def _move_customers(alias, customers, new_ids):
+    from crm import outbox
+    from crm.models import ArchivedOrder, ChangeEvent, Customer, Order, OrderReminder, Product
+
+    old_customer_ids = [customer.pk for customer in customers]
+    orders = {
+        model: list(model.objects.using("default").filter(customer_id__in=old_customer_ids).order_by("pk"))
+        for model in (Order, ArchivedOrder)
+    }
+    order_ids = {}
+    for rows in orders.values():
+        new = new_order_ids([new_ids[order.customer_id] for order in rows])
+        order_ids.update(zip([order.pk for order in rows], new))
+    links = {
+        model: list(
+            model.products.through.objects.using("default")
+            .filter(**{f"{model._meta.model_name}_id__in": [order.pk for order in rows]})
+            .values_list(f"{model._meta.model_name}_id", "product_id")
+        )
+        for model, rows in orders.items()
+    }
+    # Order filters and totals join the shard's copies of the products
+    replicate(Product, {product_id for rows in links.values() for _, product_id in rows})
+
+    for customer in customers:
+        customer.pk = new_ids[customer.pk]
+    Customer.objects.using(alias).bulk_create(customers)
+    for model, rows in orders.items():
+        auto_now = [field.attname for field in model._meta.concrete_fields if getattr(field, "auto_now_add", False)]
+        stamps = [[getattr(order, name) for name in auto_now] for order in rows]
+        for order in rows:
+            order.pk, order.customer_id = order_ids[order.pk], new_ids[order.customer_id]
+        model.objects.using(alias).bulk_create(rows)
+        # bulk_create() stamps auto_now_add fields with the time of the move
+        for order, values in zip(rows, stamps):
+            for name, value in zip(auto_now, values):
+                setattr(order, name, value)
+        if rows and auto_now:
+            model.objects.using(alias).bulk_update(rows, auto_now)
+        through = model.products.through
+        through.objects.using(alias).bulk_create([
+            through(**{f"{model._meta.model_name}_id": order_ids[order_id], "product_id": product_id})
+            for order_id, product_id in links[model]
+        ])
+
+    for old, new in order_ids.items():
+        OrderReminder.objects.filter(order_id=old).update(order_id=new)
+    customer_ids = dict(zip(old_customer_ids, [customer.pk for customer in customers]))
+    for entity, ids in (("customer", customer_ids), ("order", order_ids)):
+        outbox.record_each(entity, ChangeEvent.DELETED, {old: {"moved_to": new} for old, new in ids.items()})
+        outbox.record_each(entity, ChangeEvent.CREATED, {new: {"moved_from": old} for old, new in ids.items()})
+    # Their orders and links go too (on_delete=CASCADE)
+    Customer.objects.using("default").filter(pk__in=old_customer_ids).delete()
+
+
+def querysets(queryset):
+    """`queryset` on every database holding its rows: one per shard for sharded models."""
+    if not enabled() or not is_sharded(queryset.model):
+        return [queryset]
+    return [queryset.using(alias) for alias in shards()]
+
+
+class ShardRouter:
+    """Routes sharded models by the id of the instance involved; everything else to default."""
+
+    def _db(self, model, **hints):
+        if not is_sharded(model):
+            return None
+        instance = hints.get("instance")
+        if instance is None:
+            return None
+        if is_sharded(type(instance)) and instance.pk is not None:
+            return db_for_pk(instance.pk)
+        if instance._state.db in shards():
+            return instance._state.db
+        return None
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Orders in a shard link to products in the default database
+        if obj1._meta.app_label == "crm" and obj2._meta.app_label == "crm":
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in shards():
+            return app_label == "crm"
+        return None
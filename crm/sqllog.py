@@ -0,0 +1,166 @@
+"""
+Slow SQL log.
+
+SlowSQLMiddleware installs a connection.execute_wrapper() for each request.
+Statements slower than SLOW_SQL_THRESHOLD_MS are written to the
+"crm.slow_sql" logger as one JSON object per line. Each entry carries the
+GraphQL operation, the path of the connection field being evaluated when
+the statement ran (see field_path()), its parameters, and (for SELECTs) the
+backend's EXPLAIN output with a flag for full table scans.
+`manage.py slow_sql_report` summarizes the log.
+"""
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger("crm.slow_sql")
+
+# Set by CRMGraphQLView and field_path() while a request executes
+current_operation = contextvars.ContextVar("crm_sql_operation", default=None)
+current_path = contextvars.ContextVar("crm_sql_path", default=None)
+
+_explaining = threading.local()
+
+re_strings = re.compile(r"'(?:[^']|'')*'")
+re_numbers = re.compile(r"\b\d+(?:\.\d+)?\b")
+re_in_lists = re.compile(r"\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)", re.IGNORECASE)
+re_spaces = re.compile(r"\s+")
+
+FULL_SCAN_MARKERS = {
+    "sqlite": re.compile(r"^SCAN (?!.*USING (?:COVERING )?INDEX)", re.MULTILINE),
+    "postgresql": re.compile(r"Seq Scan"),
+    "mysql": re.compile(r"\bALL\b"),
+}
+
+
+def fingerprint(sql):
+    """Normalize literals and IN lists so equivalent statements group together."""
+    normalized = re_strings.sub("?", sql)
+    normalized = re_numbers.sub("?", normalized)
+    normalized = re_in_lists.sub("IN (...)", normalized)
+    normalized = re_spaces.sub(" ", normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16], normalized
+
+
+def explain(connection, sql, params):
+    """Run the backend's EXPLAIN for a SELECT; returns (lines, full_scan)."""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None, None
+    prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+    _explaining.active = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"], None
+    finally:
+        _explaining.active = False
+
+    if connection.vendor == "sqlite":
+        # (id, parent, notused, detail)
+        lines = [row[-1] for row in rows]
+    else:
+        lines = [" | ".join(str(col) for col in row) for row in rows]
+    marker = FULL_SCAN_MARKERS.get(connection.vendor)
+    full_scan = bool(marker and marker.search("\n".join(lines)))
+    return lines, full_scan
+
+
+def _json_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: repr(value)[:200] for key, value in params.items()}
+    return [repr(value)[:200] for value in params]
+
+
+class SlowQueryLogger:
+    def __init__(self, connection, threshold_ms, explain_plans=True):
+        self.connection = connection
+        self.threshold = threshold_ms / 1000
+        self.explain_plans = explain_plans
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_explaining, "active", False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            if duration >= self.threshold:
+                self.log(sql, params, many, duration)
+
+    def log(self, sql, params, many, duration):
+        fp, normalized = fingerprint(sql)
+        plan, full_scan = (None, None)
+        if self.explain_plans and not many:
+            plan, full_scan = explain(self.connection, sql, params)
+        path = current_path.get()
+        logger.warning(json.dumps({
+            "time": timezone.now().isoformat(),
+            "database": self.connection.alias,
+            "duration_ms": round(duration * 1000, 3),
+            "operation": current_operation.get(),
+            "path": ".".join(str(p) for p in path.as_list()) if path else None,
+            "fingerprint": fp,
+            "normalized": normalized,
+            "sql": sql,
+            "params": None if many else _json_params(params),
+            "plan": plan,
+            "full_scan": full_scan,
+        }))
+
+
+class SlowSQLMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = getattr(settings, "SLOW_SQL_THRESHOLD_MS", None)
+        if threshold is None:
+            return self.get_response(request)
+
+        explain_plans = getattr(settings, "SLOW_SQL_EXPLAIN", True)
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                connection = connections[alias]
+                stack.enter_context(
+                    connection.execute_wrapper(SlowQueryLogger(connection, threshold, explain_plans))
+                )
+            return self.get_response(request)
+
+
+@contextlib.contextmanager
+def field_path(path):
+    """Attribute the statements run inside the block to the resolver path `path`."""
+    # Store the Path object; it is only turned into a list when a statement is logged
+    token = current_path.set(path)
+    try:
+        yield
+    finally:
+        current_path.reset(token)
+
+
+class FieldPathMiddleware:
+    """
+    Opt-in graphene middleware recording the path of every resolver (e.g.
+    allOrders.edges.0.node.products) while it runs. It wraps each field of
+    each response, and querysets a resolver returns unevaluated still run
+    under the parent's path, so it is only meant for debugging a slow
+    query; by default paths come from the connection fields (field_path()).
+    """
+
+    def resolve(self, next, root, info, **args):
+        with field_path(info.path):
+            return next(root, info, **args)
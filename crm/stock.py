@@ -0,0 +1,211 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from crm import outbox
+from crm.entity_cache import invalidate
+from crm.models import ChangeEvent, LowStockAlert, Product
+
+
+def queue_low_stock(product_ids):
+    """
+    Queue an alert for each of the given products that is now below its
+    threshold. Call this right after any write that lowered stock; products
+    that already have a pending alert are skipped by the partial unique
+    constraint.
+    """
+    low = (
+        Product.objects
+        .filter(pk__in=product_ids, stock__lt=F("low_stock_threshold"))
+        .values_list("pk", "stock")
+    )
+    alerts = [LowStockAlert(product_id=pk, stock=stock) for pk, stock in low]
+    if alerts:
+        LowStockAlert.objects.bulk_create(alerts, ignore_conflicts=True)
+    return len(alerts)
+
+
+class OutOfStock(Exception):
+    """Some products have fewer units than asked for; nothing was taken."""
+
+    def __init__(self, product_ids):
+        super().__init__(f"Out of stock: {list(product_ids)}")
+        self.product_ids = product_ids
+
+
+def consume_stock(product_ids, quantity=1):
+    """
+    Take `quantity` units of each product and queue alerts for the ones
+    that crossed their threshold. If any product has fewer units, nothing is
+    taken and OutOfStock is raised with their ids: orders never oversell.
+    """
+    product_ids = set(product_ids)
+    try:
+        with transaction.atomic():
+            # Checked by the UPDATE itself, so concurrent orders can't both take the last unit
+            taken = Product.objects.filter(pk__in=product_ids, stock__gte=quantity).update(
+                stock=F("stock") - quantity
+            )
+            if taken < len(product_ids):
+                raise OutOfStock([])
+            outbox.record("product", ChangeEvent.UPDATED, product_ids, fields=["stock"])
+            invalidate(Product, product_ids)
+            queue_low_stock(product_ids)
+    except OutOfStock:
+        # Rolled back: the products still short are the ones to report
+        short = Product.objects.filter(pk__in=product_ids, stock__lt=quantity).order_by("pk")
+        raise OutOfStock(list(short.values_list("pk", flat=True))) from None
+
+
+def drain_low_stock_queue(increment=10, limit=500):
+    """
+    Restock the products waiting in the low-stock queue and mark their
+    alerts processed. Only pending alerts are read, through the partial
+    index, so the cost follows the queue length rather than the catalog.
+    Returns the restocked products.
+    """
+    with transaction.atomic():
+        pending = LowStockAlert.objects.filter(processed_at__isnull=True).order_by("created_at")
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        alerts = list(pending.values_list("pk", "product_id")[:limit])
+        if not alerts:
+            return []
+
+        product_ids = [product_id for _, product_id in alerts]
+        Product.objects.filter(pk__in=product_ids).update(stock=F("stock") + increment)
+        outbox.record("product", ChangeEvent.UPDATED, product_ids, fields=["stock"])
+        invalidate(Product, product_ids)
+        LowStockAlert.objects.filter(pk__in=[pk for pk, _ in alerts]).update(
+            processed_at=timezone.now()
+        )
+        # Still short after one increment: queue it again for the next run
+        queue_low_stock(product_ids)
+
+    return list(Product.objects.filter(pk__in=product_ids).order_by("pk"))
+
+
+def apply_product_updates(products, deltas, chunk_size=None):
+    """
+    Write a batch of catalog changes in one transaction:
+    `products` maps the fields set in memory on some instances, e.g.
+    ("price",), to those instances (one bulk_update per set of fields, so a
+    row's other fields are left alone), and `deltas` maps product id ->
+    stock change, applied as one CASE/WHEN F-expression UPDATE per chunk.
+    Callers check that deltas don't take stock below zero. Returns the ids
+    of the rows written.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, "BULK_UPDATE_CHUNK_SIZE", 500)
+    changed = defaultdict(set)
+    for fields, instances in products.items():
+        for product in instances:
+            changed[product.pk].update(fields)
+    for pk in deltas:
+        changed[pk].add("stock")
+    with transaction.atomic():
+        for fields, instances in products.items():
+            if instances:
+                Product.objects.bulk_update(instances, list(fields), batch_size=chunk_size)
+        stock = Product._meta.get_field("stock")
+        items = list(deltas.items())
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                stock=Case(
+                    *(When(pk=pk, then=F("stock") + Value(delta, stock)) for pk, delta in chunk),
+                    default=F("stock"),
+                    output_field=stock,
+                )
+            )
+        outbox.record_each(
+            "product", ChangeEvent.UPDATED, {pk: {"fields": sorted(changed[pk])} for pk in sorted(changed)}
+        )
+        invalidate(Product, changed)
+        queue_low_stock(changed)
+    return set(changed)
+
+
+def field_error(name, value):
+    """Why `value` can't be stored in Product.<name>, or None if it can (or is None)."""
+    if value is None:
+        return None
+    field = Product._meta.get_field(name)
+    try:
+        field.clean(Decimal(str(value)) if isinstance(field, DecimalField) else value, None)
+    except ValidationError as e:
+        return f"{field.verbose_name.capitalize()}: {' '.join(e.messages)}"
+    return None
+
+
+def update_products(rows, offset=0):
+    """
+    Validate and apply bulkUpdateProducts rows: dicts with an `id` and any
+    of `price`, `stock` and `stock_delta`. Prices and stocks are checked
+    against the model fields, a stock_delta that would take the stock below
+    zero is refused, and a stock_delta of 0 is a valid row that writes
+    nothing. Row numbers in errors start at `offset`. Returns (ids in
+    input order, ids of the rows applied, [(row, message)]).
+    """
+    errors = []
+    valid = {}
+    for i, row in enumerate(rows, offset):
+        price, stock, stock_delta = row.get("price"), row.get("stock"), row.get("stock_delta")
+        try:
+            pk = int(row.get("id"))
+        except (TypeError, ValueError):
+            errors.append((i, "ID must be a valid integer."))
+            continue
+        if pk in valid:
+            errors.append((i, f"Product {pk} is already updated by row {valid[pk][0] + 1}."))
+        elif price is None and stock is None and stock_delta is None:
+            errors.append((i, "Nothing to update, give price, stock or stockDelta."))
+        elif stock is not None and stock_delta is not None:
+            errors.append((i, "Give either stock or stockDelta, not both."))
+        elif price is not None and price <= 0:
+            errors.append((i, "Price should be greater than 0."))
+        elif stock is not None and stock < 0:
+            errors.append((i, "Stock should be 0 or more."))
+        else:
+            message = field_error("price", price) or field_error("stock", stock)
+            if message:
+                errors.append((i, message))
+            else:
+                valid[pk] = (i, row)
+
+    with transaction.atomic():
+        # One query for every target; locked so absolute writes don't undo concurrent changes
+        found = Product.objects.select_for_update().in_bulk(list(valid))
+        products = defaultdict(list)
+        deltas = {}
+        unchanged = set()
+        for pk, (i, row) in valid.items():
+            product = found.get(pk)
+            if product is None:
+                errors.append((i, f"Product {pk} not found."))
+                continue
+            if row.get("stock_delta") and product.stock + row["stock_delta"] < 0:
+                # Like consume_stock: never clamped, the row is refused
+                errors.append((i, f"Stock delta {row['stock_delta']} exceeds the {product.stock} in stock."))
+                continue
+            fields = []
+            if row.get("price") is not None:
+                product.price = Decimal(str(row["price"]))
+                fields.append("price")
+            if row.get("stock") is not None:
+                product.stock = row["stock"]
+                fields.append("stock")
+            if fields:
+                products[tuple(fields)].append(product)
+            if row.get("stock_delta"):
+                deltas[pk] = row["stock_delta"]
+            elif row.get("price") is None and row.get("stock") is None:
+                # stockDelta: 0 alone
+                unchanged.add(pk)
+        written = apply_product_updates(products, deltas)
+    return list(valid), written | unchanged, errors
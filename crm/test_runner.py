@@ -0,0 +1,27 @@
+"""Test runner for the project (settings.TEST_RUNNER)."""
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class CRMTestRunner(DiscoverRunner):
+    """
+    DiscoverRunner giving the run a "shared" cache of its own, instead of
+    sharing tmp/cache (and its entity versions, keyed by reused pks) with
+    the dev server.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES={
+            **settings.CACHES,
+            "shared": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "crm-shared-test",
+            },
+        })
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1862 @@
-from django.test import TestCase
+import difflib
+import gzip
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import ExitStack, contextmanager, redirect_stdout
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connection, connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_relay import to_global_id
+
+from crm import encoders, sharding
+from crm.connections import MergedQuerySet
+from crm.management.commands.profile_imports import profile_startup
+from crm.models import ArchivedOrder, Customer, Order, Product
+from crm.sqllog import fingerprint
+
+# Cold start budget for django.setup() + building the GraphQL schema.
+# Measured around 0.6s on a dev laptop; the slack absorbs slow CI machines.
+STARTUP_BUDGET_SECONDS = 3.0
+
+
+class StartupTests(SimpleTestCase):
+    def test_urlconf_import_does_not_build_schema(self):
+        code = (
+            "import django, importlib, sys; django.setup(); "
+            "from django.conf import settings; importlib.import_module(settings.ROOT_URLCONF); "
+            "print('crm.schema' in sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_schema_cold_start_within_budget(self):
+        wall, rows = profile_startup("schema")
+        self.assertIn("crm.schema", {module for module, _, _ in rows})
+        self.assertLess(wall, STARTUP_BUDGET_SECONDS)
+
+    def test_schema_is_built_once(self):
+        from alx_backend_graphql_crm import schema as schema_module
+
+        self.assertIs(schema_module.schema, schema_module.get_schema())
+
+
+def graphql(client, query, variables=None, **headers):
+    """POST one operation to /graphql and return the decoded response."""
+    response = client.post(
+        "/graphql", json.dumps({"query": query, "variables": variables or {}}),
+        content_type="application/json", **headers,
+    )
+    return response.json()
+
+
+# The suite also runs with CRM_SHARDS=2 (ShardedRunTests); these helpers read
+# sharded models wherever they are stored.
+
+def everywhere(queryset):
+    """The rows of `queryset` from every database holding them."""
+    return [row for part in sharding.querysets(queryset) for row in part]
+
+
+def archived_order_id(customer):
+    """An id for an ArchivedOrder made by hand: like a real order's, it routes to `customer`'s shard."""
+    return sharding.new_order_ids([customer.pk])[0]
+
+
+@contextmanager
+def capture_queries():
+    """CaptureQueriesContext over the default database and every shard; the list is filled on exit."""
+    queries = []
+    with ExitStack() as stack:
+        contexts = [
+            stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in ["default", *sharding.shards()]
+        ]
+        yield queries
+    for context in contexts:
+        queries.extend(context.captured_queries)
+
+
+# --- Batching ----------------------------------------------------------------
+
+@override_settings(GRAPHQL_MAX_BATCH_SIZE=3)
+class BatchTests(TestCase):
+    databases = "__all__"
+
+    def post(self, body, **headers):
+        return self.client.post("/graphql", json.dumps(body), content_type="application/json", **headers)
+
+    @override_settings(ENTITY_CACHE={"ENABLED": False})
+    def test_operations_share_the_request_loaders(self):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        Order.objects.create(customer=customer)
+        operation = {"query": "{ allOrders(first: 5) { edges { node { customer { name } } } } }"}
+
+        with capture_queries() as queries:
+            response = self.post([operation, operation])
+        results = response.json()
+        self.assertEqual([result["status"] for result in results], [200, 200])
+        self.assertEqual(results[0]["data"], results[1]["data"])
+        customers = [query for query in queries if 'FROM "crm_customer"' in query["sql"]]
+        self.assertEqual(len(customers), 1)
+
+    def test_batch_limits(self):
+        operation = {"query": "{ __typename }"}
+        self.assertEqual(self.post([operation] * 3).status_code, 200)
+        response = self.post([operation] * 4)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["errors"][0]["message"], "Batch contains 4 operations, the maximum is 3."
+        )
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([operation, "{ __typename }"]).status_code, 400)
+
+    def test_batches_are_executed_even_for_graphiql_clients(self):
+        self.assertContains(self.client.get("/graphql", HTTP_ACCEPT="text/html"), "graphiql")
+        response = self.post([{"query": "{ __typename }"}], HTTP_ACCEPT="text/html")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.json()[0]["data"], {"__typename": "Query"})
+
+
+# --- Order filters -----------------------------------------------------------
+
+class OrderFilterTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        # Committed, so sharded runs copy the products into the shards
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp = Product.objects.create(name="Lamp", price=Decimal("10.00"))
+            self.laptop = Product.objects.create(name="Laptop", price=Decimal("1000.00"))
+            mouse = Product.objects.create(name="Mouse", price=Decimal("25.00"))
+        self.both = Order.objects.create(customer=customer)
+        self.both.products.set([lamp, self.laptop])
+        self.mouse = Order.objects.create(customer=customer)
+        self.mouse.products.set([mouse])
+        self.empty = Order.objects.create(customer=customer)
+        self.archived = ArchivedOrder.objects.create(
+            id=archived_order_id(customer), customer=customer, order_date=timezone.now()
+        )
+        self.archived.products.set([self.laptop])
+
+    def filtered(self, filter, queryset=None):
+        from crm.filters import filter_orders
+
+        queryset = filter_orders(Order.objects.all() if queryset is None else queryset, filter)
+        return queryset, sorted(order.pk for order in everywhere(queryset))
+
+    def test_product_filters_are_exists_subqueries(self):
+        queryset, pks = self.filtered({"productName": "la"})
+        # Both products match, the order is still returned once
+        self.assertEqual(pks, [self.both.pk])
+        sql = str(queryset.query)
+        self.assertIn("EXISTS", sql)
+        self.assertNotIn("GROUP BY", sql)
+
+        self.assertEqual(self.filtered({"productId": str(self.laptop.pk)})[1], [self.both.pk])
+        self.assertEqual(self.filtered({"productId": "abc"})[1], [])
+        self.assertEqual(
+            self.filtered({"productId": str(self.laptop.pk)}, ArchivedOrder.objects.all())[1], [self.archived.pk]
+        )
+
+    def test_totals_are_only_computed_for_total_bounds(self):
+        queryset, _ = self.filtered({"productName": "la"})
+        self.assertNotIn("total_amount_db", queryset.query.annotations)
+
+        self.assertEqual(self.filtered({"totalAmountGte": 100})[1], [self.both.pk])
+        # Orders without products have no total and match no bound
+        self.assertEqual(self.filtered({"totalAmountLte": 30})[1], [self.mouse.pk])
+        # The product EXISTS doesn't multiply the rows the total sums
+        bounds = {"productName": "la", "totalAmountGte": 1010, "totalAmountLte": 1010}
+        self.assertEqual(self.filtered(bounds)[1], [self.both.pk])
+
+    def test_filter_applies_to_the_archive(self):
+        query = """{ allOrders(includeArchived: true, orderBy: "order_date", filter: {productName: "laptop"}) {
+                         edges { node { numericId totalAmount } } } }"""
+        edges = graphql(self.client, query)["data"]["allOrders"]["edges"]
+        self.assertEqual(
+            [(edge["node"]["numericId"], edge["node"]["totalAmount"]) for edge in edges],
+            [(self.both.pk, 1010.0), (self.archived.pk, 1000.0)],
+        )
+
+
+# --- Stock -------------------------------------------------------------------
+
+class StockTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.lamp = Product.objects.create(name="Lamp", price=Decimal("5.00"), stock=11, low_stock_threshold=10)
+        self.desk = Product.objects.create(name="Desk", price=Decimal("90.00"), stock=1, low_stock_threshold=0)
+
+    def pending_alerts(self):
+        from crm.models import LowStockAlert
+
+        return set(LowStockAlert.objects.filter(processed_at__isnull=True).values_list("product_id", flat=True))
+
+    def test_consume_stock_queues_products_crossing_their_threshold(self):
+        from crm.models import ChangeEvent
+        from crm.stock import consume_stock
+
+        consume_stock([self.lamp.pk, self.desk.pk])
+        self.lamp.refresh_from_db()
+        self.desk.refresh_from_db()
+        self.assertEqual((self.lamp.stock, self.desk.stock), (10, 0))
+        self.assertEqual(self.pending_alerts(), set())
+
+        consume_stock([self.lamp.pk])
+        self.assertEqual(self.pending_alerts(), {self.lamp.pk})
+        self.assertEqual(ChangeEvent.objects.filter(entity="product").count(), 3)
+
+    def test_short_stock_takes_nothing(self):
+        from crm.stock import OutOfStock, consume_stock
+
+        with self.assertRaises(OutOfStock) as raised:
+            consume_stock([self.lamp.pk, self.desk.pk], quantity=2)
+        self.assertEqual(raised.exception.product_ids, [self.desk.pk])
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 11)
+
+    def test_create_order_is_rejected_when_out_of_stock(self):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        mutation = """mutation($input: OrderInput!) { createOrder(input: $input) { success message } }"""
+        variables = {"input": {"customerId": customer.pk, "productIds": [self.lamp.pk, self.desk.pk]}}
+
+        self.assertEqual(graphql(self.client, mutation, variables)["data"]["createOrder"]["success"], True)
+        result = graphql(self.client, mutation, variables)["data"]["createOrder"]
+        self.assertEqual(result, {"success": False, "message": "Out of stock: Desk."})
+        self.assertEqual(len(everywhere(Order.objects.all())), 1)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 10)
+
+    def test_drain_restocks_queued_products(self):
+        from crm.models import LowStockAlert
+        from crm.stock import drain_low_stock_queue, queue_low_stock
+
+        Product.objects.filter(pk=self.lamp.pk).update(stock=0)
+        Product.objects.filter(pk=self.desk.pk).update(stock=0, low_stock_threshold=5)
+        queue_low_stock([self.lamp.pk, self.desk.pk])
+
+        restocked = drain_low_stock_queue(increment=8)
+        self.assertEqual([(p.pk, p.stock) for p in restocked], [(self.lamp.pk, 8), (self.desk.pk, 8)])
+        self.assertEqual(LowStockAlert.objects.filter(processed_at__isnull=False).count(), 2)
+        # 8 is still under the lamp's threshold of 10
+        self.assertEqual(self.pending_alerts(), {self.lamp.pk})
+        self.assertEqual(drain_low_stock_queue(increment=8), [Product.objects.get(pk=self.lamp.pk)])
+        self.assertEqual(drain_low_stock_queue(), [])
+
+
+# --- Job scheduler -----------------------------------------------------------
+
+class CronScheduleTests(SimpleTestCase):
+    def test_ranges_steps_and_lists(self):
+        from crm.jobs import CronSchedule
+
+        fields = CronSchedule("*/15 9-17/4 1,15 * 1-5").fields
+        self.assertEqual(fields["minute"], {0, 15, 30, 45})
+        self.assertEqual(fields["hour"], {9, 13, 17})
+        self.assertEqual(fields["day"], {1, 15})
+        self.assertEqual(fields["month"], set(range(1, 13)))
+        self.assertEqual(fields["weekday"], {1, 2, 3, 4, 5})
+        self.assertEqual(CronSchedule("5/20 0,12 * 1-3,12 *").fields["minute"], {5, 25, 45})
+
+    def test_sunday_is_0_or_7(self):
+        from crm.jobs import CronSchedule
+
+        self.assertEqual(CronSchedule("0 9 * * 1-7").fields["weekday"], set(range(7)))
+        self.assertEqual(CronSchedule("0 9 * * 5-7").fields["weekday"], {5, 6, 0})
+        self.assertEqual(CronSchedule("0 9 * * 7").fields["weekday"], {0})
+        self.assertEqual(CronSchedule("0 9 * * 0").fields["weekday"], {0})
+        self.assertEqual(CronSchedule("0 9 * * *").fields["weekday"], set(range(7)))
+
+        monday = timezone.datetime(2026, 10, 19, 10, 0)
+        self.assertEqual(CronSchedule("0 9 * * 5-7").next_after(monday), timezone.datetime(2026, 10, 23, 9, 0))
+        self.assertEqual(CronSchedule("0 9 * * 7").next_after(monday), timezone.datetime(2026, 10, 25, 9, 0))
+        self.assertEqual(CronSchedule("0 9 * * 1-7").next_after(monday), timezone.datetime(2026, 10, 20, 9, 0))
+
+    def test_day_and_weekday_are_ored(self):
+        from crm.jobs import CronSchedule
+
+        # The 1st of the month or any Sunday, whichever comes first
+        schedule = CronSchedule("0 0 1 * 0")
+        self.assertEqual(schedule.next_after(timezone.datetime(2026, 10, 19)), timezone.datetime(2026, 10, 25))
+        self.assertEqual(schedule.next_after(timezone.datetime(2026, 10, 26)), timezone.datetime(2026, 11, 1))
+
+    def test_invalid_expressions(self):
+        from crm.jobs import CronSchedule
+
+        for expression in ("* * * *", "60 * * * *", "0 24 * * *", "0 0 0 * *", "0 0 * * 8", "*/0 * * * *"):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                CronSchedule(expression)
+
+
+def failing_task():
+    raise RuntimeError("boom")
+
+
+class JobWorkerTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        from crm.jobs import Worker
+        from crm.models import ScheduledJob
+
+        self.worker = Worker(tasks={"tests.fail": failing_task, "tests.ok": lambda: None})
+        self.addCleanup(self.worker.pool.shutdown)
+        # Once a year, so retries are the only reason to run again soon
+        self.job = ScheduledJob.objects.create(
+            name="flaky", task="tests.fail", schedule="0 0 1 1 *", max_retries=2, retry_backoff=30,
+            next_run_at=timezone.now() - timedelta(minutes=1),
+        )
+
+    def run_once(self):
+        from crm.models import JobRun
+
+        self.job.refresh_from_db()
+        run = self.worker.claim(self.job, max(timezone.now(), self.job.next_run_at))
+        self.assertIsNotNone(run)
+        self.worker.execute(self.job, run)
+        self.job.refresh_from_db()
+        return JobRun.objects.get(pk=run.pk)
+
+    def test_failed_runs_retry_with_exponential_backoff(self):
+        from crm.models import JobRun
+
+        for attempt, backoff in ((1, 30), (2, 60)):
+            with self.assertLogs("crm.jobs", "ERROR"):
+                run = self.run_once()
+            self.assertEqual((run.attempt, run.status), (attempt, JobRun.FAILED))
+            self.assertIn("boom", run.error)
+            self.assertEqual(self.job.attempt, attempt)
+            self.assertAlmostEqual(
+                (self.job.next_run_at - run.finished_at).total_seconds(), backoff, delta=1
+            )
+
+        # Out of retries: back to the schedule, attempts reset
+        with self.assertLogs("crm.jobs", "ERROR"):
+            run = self.run_once()
+        self.assertEqual(run.attempt, 3)
+        self.assertEqual(self.job.attempt, 0)
+        self.assertEqual((self.job.next_run_at.month, self.job.next_run_at.day), (1, 1))
+        self.assertEqual(self.job.last_status, JobRun.FAILED)
+
+    def test_success_resets_attempts(self):
+        from crm.models import JobRun
+
+        with self.assertLogs("crm.jobs", "ERROR"):
+            self.run_once()
+        self.job.task = "tests.ok"
+        self.job.save()
+        run = self.run_once()
+        self.assertEqual((run.attempt, run.status), (2, JobRun.SUCCEEDED))
+        self.assertEqual((self.job.attempt, self.job.last_error), (0, ""))
+
+    def test_claim_skips_a_tick_taken_by_another_worker(self):
+        from crm.models import ScheduledJob
+
+        now = timezone.now()
+        stale = ScheduledJob.objects.get(pk=self.job.pk)
+        self.assertIsNotNone(self.worker.claim(self.job, now))
+        self.assertIsNone(self.worker.claim(stale, now))
+
+
+# --- Pagination --------------------------------------------------------------
+
+class PaginationTests(TestCase):
+    databases = "__all__"
+
+    query = """query($first: Int, $last: Int, $after: String, $before: String, $offset: Int, $count: Boolean!) {
+                   allCustomers(first: $first, last: $last, after: $after, before: $before, offset: $offset,
+                                orderBy: "name") {
+                       totalCount @include(if: $count)
+                       pageInfo { hasNextPage hasPreviousPage endCursor }
+                       edges { cursor node { name } } } }"""
+
+    @classmethod
+    def setUpTestData(cls):
+        sharding.bulk_create(Customer, [Customer(name=f"Page {i}", email=f"page{i}@example.com") for i in range(5)])
+
+    def page(self, count=False, **variables):
+        result = graphql(self.client, self.query, {"count": count, **variables})
+        self.assertNotIn("errors", result)
+        page = result["data"]["allCustomers"]
+        return [edge["node"]["name"] for edge in page["edges"]], page
+
+    def test_forward_pages_and_offset(self):
+        seen, after, has_next = [], None, []
+        while True:
+            names, page = self.page(first=2, after=after)
+            seen += names
+            has_next.append(page["pageInfo"]["hasNextPage"])
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+        self.assertEqual(seen, [f"Page {i}" for i in range(5)])
+        self.assertEqual(has_next, [True, True, False])
+
+        names, page = self.page(first=2, offset=2, after=self.page(first=1)[1]["pageInfo"]["endCursor"])
+        self.assertEqual(names, ["Page 3", "Page 4"])
+        self.assertEqual(self.page(first=0)[0], [])
+        self.assertEqual(self.page(first=2, offset=9)[0], [])
+
+    def test_total_count_is_only_counted_when_unknown(self):
+        for first, counted in ((10, False), (2, True)):
+            with self.subTest(first=first), capture_queries() as queries:
+                _, page = self.page(count=True, first=first)
+            self.assertEqual(page["totalCount"], 5)
+            self.assertEqual(any("COUNT(" in query["sql"] for query in queries), counted)
+
+    def test_backward_pages(self):
+        names, page = self.page(last=2)
+        self.assertEqual(names, ["Page 3", "Page 4"])
+        self.assertTrue(page["pageInfo"]["hasPreviousPage"])
+        before = page["edges"][0]["cursor"]
+        self.assertEqual(self.page(last=2, before=before)[0], ["Page 1", "Page 2"])
+
+    def test_negative_arguments_are_rejected(self):
+        for name in ("first", "last", "offset"):
+            with self.subTest(name=name):
+                variables = {"count": True, "first": 1, name: -1}
+                result = graphql(self.client, self.query, variables)
+                self.assertEqual(
+                    result["errors"][0]["message"], f"`{name}` on the `allCustomers` connection can't be negative."
+                )
+                self.assertIsNone(result["data"]["allCustomers"])
+
+
+# --- Rate limiting -----------------------------------------------------------
+
+class RateLimitTests(TestCase):
+    databases = "__all__"
+
+    def test_token_bucket_allows_a_burst_then_refills(self):
+        from crm.middleware import TokenBucket
+
+        bucket = TokenBucket(rate=10, burst=5)
+        with mock.patch("crm.middleware.time.time", return_value=1000.0):
+            self.assertEqual([bucket.consume("a") for _ in range(5)], [0] * 5)
+            self.assertAlmostEqual(bucket.consume("a"), 0.1)
+            self.assertEqual(bucket.consume("b", cost=5), 0)
+        with mock.patch("crm.middleware.time.time", return_value=1000.25):
+            self.assertEqual([bucket.consume("a") for _ in range(2)], [0, 0])
+            self.assertAlmostEqual(bucket.consume("a"), 0.05)
+
+    def test_cache_bucket_is_shared_by_processes(self):
+        from django.core.cache import caches
+
+        from crm.middleware import CacheTokenBucket
+
+        self.addCleanup(caches["shared"].clear)
+        # Two processes' buckets over the same cache
+        first, second = (CacheTokenBucket(caches["shared"], rate=10, burst=5) for _ in range(2))
+        with mock.patch("crm.middleware.time.time", return_value=1000.0):
+            self.assertEqual([bucket.consume("crm:test:shared") for bucket in (first, second) * 2], [0] * 4)
+            self.assertEqual(second.consume("crm:test:shared"), 0)
+            self.assertAlmostEqual(first.consume("crm:test:shared"), 0.1)
+        # Refills like a token bucket: no second burst at a window edge
+        with mock.patch("crm.middleware.time.time", return_value=1000.25):
+            self.assertEqual([second.consume("crm:test:shared") for _ in range(2)], [0, 0])
+            self.assertAlmostEqual(first.consume("crm:test:shared"), 0.05)
+
+    def test_cache_bucket_clamps_a_time_left_by_a_lower_rate(self):
+        from django.core.cache import caches
+
+        from crm.middleware import CacheTokenBucket
+
+        self.addCleanup(caches["shared"].clear)
+        with mock.patch("crm.middleware.time.time", return_value=1000.0):
+            CacheTokenBucket(caches["shared"], rate=0.001, burst=2).consume("crm:test:rate")
+            self.assertAlmostEqual(CacheTokenBucket(caches["shared"], rate=10, burst=5).consume("crm:test:rate"), 0.1)
+
+    def test_concurrent_requests_cannot_overdraw(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from django.core.cache import caches
+
+        from crm.middleware import CacheTokenBucket, TokenBucket
+
+        self.addCleanup(caches["shared"].clear)
+        shared = TokenBucket(rate=0.001, burst=50)
+        buckets = {
+            "TokenBucket": lambda: shared,
+            # A bucket per request, like separate processes: only the cache lock serializes them
+            "CacheTokenBucket": lambda: CacheTokenBucket(caches["shared"], rate=0.001, burst=50),
+        }
+        from django.core.cache.backends.locmem import LocMemCache
+
+        get = LocMemCache.get
+
+        def slow_get(cache, *args, **kwargs):
+            # Widens the window between reading and writing a bucket
+            value = get(cache, *args, **kwargs)
+            time.sleep(0.001)
+            return value
+
+        for name, bucket in buckets.items():
+            with self.subTest(bucket=name), ThreadPoolExecutor(max_workers=10) as pool, \
+                    mock.patch.object(LocMemCache, "get", slow_get):
+                waits = list(pool.map(lambda _: bucket().consume("crm:test:race"), range(200)))
+                self.assertEqual(waits.count(0), 50)
+
+    def test_mutations_cost_more_and_the_body_is_decoded_once(self):
+        from django.test import Client
+
+        from crm.views import operation_labels
+
+        from django.core.cache import caches
+
+        self.addCleanup(caches["shared"].clear)
+        query = "query RateLimited { hello }"
+        mutation = 'mutation { createCustomer(input: {name: "Rate", email: "rate@example.com"}) { success } }'
+        with override_settings(GRAPHQL_RATE_LIMIT={"RATE": 0.001, "BURST": 6, "MUTATION_COST": 5}):
+            client = Client()
+            misses = operation_labels.cache_info().misses
+            with mock.patch("json.loads", wraps=json.loads) as loads:
+                response = client.post("/graphql", json.dumps({"query": query}), content_type="application/json")
+            self.assertEqual(loads.call_count, 1)
+            self.assertEqual(response.json(), {"data": {"hello": "Hello, GraphQL!"}})
+            self.assertEqual(operation_labels.cache_info().misses, misses + 1)
+
+            self.assertEqual(graphql(client, mutation), {"data": {"createCustomer": {"success": True}}})
+            response = client.post("/graphql", json.dumps({"query": query}), content_type="application/json")
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response["Retry-After"]), 0)
+            # Another client has its own bucket
+            response = client.post(
+                "/graphql", json.dumps({"query": query}), content_type="application/json", HTTP_X_API_KEY="other"
+            )
+            self.assertEqual(response.status_code, 200)
+
+
+# --- Response encoding -------------------------------------------------------
+
+class EncoderTests(SimpleTestCase):
+    data = {"price": Decimal("1.10"), "at": timezone.datetime(2024, 1, 2, 3, 4, 5), "name": "Zoë"}
+
+    def test_stdlib_encoder_keeps_decimals_exact(self):
+        from crm.encoders import StdlibJSONEncoder
+
+        encoder = StdlibJSONEncoder()
+        self.assertEqual(encoder.encode(self.data), '{"price":"1.10","at":"2024-01-02T03:04:05","name":"Zoë"}')
+        self.assertEqual(json.loads(encoder.encode(self.data, pretty=True)), json.loads(encoder.encode(self.data)))
+        self.assertTrue(encoder.encode(self.data, pretty=True).startswith('{\n  "at"'))
+
+    @skipUnless(encoders.orjson, "orjson is not installed")
+    def test_orjson_encoder_matches_stdlib(self):
+        from crm.encoders import OrjsonEncoder, StdlibJSONEncoder
+
+        self.assertEqual(OrjsonEncoder().encode(self.data), StdlibJSONEncoder().encode(self.data))
+
+    @override_settings(GRAPHQL_JSON_ENCODER="crm.encoders.StdlibJSONEncoder")
+    def test_encoder_setting(self):
+        from crm.encoders import StdlibJSONEncoder, get_encoder
+
+        self.assertIs(type(get_encoder()), StdlibJSONEncoder)
+
+
+@override_settings(GRAPHQL_GZIP_MIN_BYTES=100)
+class GzipTests(TestCase):
+    databases = "__all__"
+
+    query = "{ allProducts(first: 20) { edges { node { name } } } }"
+
+    def setUp(self):
+        Product.objects.bulk_create(Product(name=f"Product {i}", price=1) for i in range(20))
+
+    def post(self, query, **headers):
+        return self.client.post(
+            "/graphql", json.dumps({"query": query}), content_type="application/json", **headers
+        )
+
+    def test_gzip_when_accepted(self):
+        response = self.post(self.query, HTTP_ACCEPT_ENCODING="deflate, gzip;q=0.5")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))["data"]["allProducts"]["edges"]), 20)
+
+    def test_plain_when_refused_or_small(self):
+        for accept_encoding in ("", "deflate", "gzip;q=0", "GZIP; q=0.0"):
+            response = self.post(self.query, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header("Content-Encoding"), accept_encoding)
+            self.assertIn("Accept-Encoding", response["Vary"])
+        response = self.post("{ __typename }", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.json(), {"data": {"__typename": "Query"}})
+
+
+# --- Metrics -----------------------------------------------------------------
+
+class MetricsTests(TestCase):
+    databases = "__all__"
+
+    def test_operation_names_past_the_limit_are_labelled_other(self):
+        import tempfile
+        from collections import defaultdict
+
+        from crm import metrics
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(METRICS_DIR=directory.name, METRICS_MAX_LABEL_VALUES=2), \
+                mock.patch.object(metrics, "_label_values", defaultdict(set)):
+            for i in (0, 1, 2, 3, 0):
+                graphql(self.client, f"query Unique{i} {{ hello }}")
+            response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('crm_graphql_requests_total{operation="Unique0",type="query"} 2', body)
+        self.assertIn('crm_graphql_requests_total{operation="Unique1",type="query"} 1', body)
+        self.assertIn('crm_graphql_requests_total{operation="other",type="query"} 2', body)
+        self.assertNotIn('operation="Unique2"', body)
+        self.assertIn('crm_graphql_request_duration_seconds_count{operation="other",type="query"} 2', body)
+
+    def test_values_render_exactly(self):
+        from crm import metrics
+
+        merged = {"counters": {("crm_graphql_requests_total", ()): 1234567.0,
+                               ("crm_graphql_sql_seconds_total", ()): 0.1},
+                  "histograms": {}}
+        body = metrics.render(merged)
+        self.assertIn("crm_graphql_requests_total 1234567\n", body)
+        self.assertIn("crm_graphql_sql_seconds_total 0.1\n", body)
+        merged["counters"][("crm_graphql_requests_total", ())] += 1
+        self.assertIn("crm_graphql_requests_total 1234568\n", metrics.render(merged))
+
+    def test_errors_are_labelled_by_schema_field(self):
+        import tempfile
+
+        from crm import metrics
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(METRICS_DIR=directory.name):
+            graphql(self.client, "query Aliased { %s }" % " ".join(
+                f"a{i}: allOrders(first: -1) {{ edges {{ cursor }} }}" for i in range(3)
+            ))
+            body = metrics.render(metrics.collect())
+        self.assertIn('crm_graphql_errors_total{field="allOrders",operation="Aliased"} 3', body)
+        self.assertNotIn('field="a0"', body)
+
+
+# --- Slow SQL log ------------------------------------------------------------
+
+@override_settings(SLOW_SQL_THRESHOLD_MS=0, SLOW_SQL_EXPLAIN=False)
+class SlowSQLTests(TestCase):
+    databases = "__all__"
+
+    def test_statements_carry_the_connection_path(self):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        for _ in range(3):
+            Order.objects.create(customer=customer)
+
+        query = "query Recent { allOrders(first: 2) { totalCount edges { node { numericId } } } }"
+        with self.assertLogs("crm.slow_sql", "WARNING") as logs:
+            result = graphql(self.client, query)
+        self.assertEqual(result["data"]["allOrders"]["totalCount"], 3)
+
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        orders = [entry for entry in entries if 'FROM "crm_order"' in entry["normalized"]]
+        # One of each per shard when sharded
+        shards = len(sharding.databases(Order))
+        self.assertEqual(
+            sorted((entry["path"], "COUNT(" in entry["normalized"]) for entry in orders),
+            [("allOrders", False)] * shards + [("allOrders.totalCount", True)] * shards,
+        )
+        self.assertEqual({entry["operation"] for entry in entries}, {"Recent"})
+
+    def test_field_path_middleware_is_opt_in(self):
+        from crm.sqllog import FieldPathMiddleware, current_path
+
+        self.assertNotIn("crm.sqllog.FieldPathMiddleware", settings.GRAPHENE["MIDDLEWARE"])
+        seen = []
+        FieldPathMiddleware().resolve(lambda root, info: seen.append(current_path.get()), None, mock.Mock(path="f"))
+        self.assertEqual(seen, ["f"])
+        self.assertIsNone(current_path.get())
+
+
+# --- Order archive -----------------------------------------------------------
+
+class ArchivedOrderPaginationTests(TestCase):
+    databases = "__all__"
+
+    query = """query($last: Int, $before: String, $first: Int, $after: String) {
+                   allOrders(includeArchived: true, orderBy: "order_date",
+                             last: $last, before: $before, first: $first, after: $after) {
+                       pageInfo { hasPreviousPage hasNextPage }
+                       edges { cursor node { numericId } } } }"""
+
+    def setUp(self):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        start = timezone.now() - timedelta(days=100)
+        # Live and archived orders interleave by date
+        self.orders = []
+        for day in range(12):
+            if day % 3:
+                order = Order.objects.create(customer=customer, order_date=start + timedelta(days=day))
+            else:
+                order = ArchivedOrder.objects.create(
+                    id=archived_order_id(customer), customer=customer, order_date=start + timedelta(days=day)
+                )
+            self.orders.append(order)
+        self.ids = [order.pk for order in self.orders]
+
+    def page(self, **variables):
+        return graphql(self.client, self.query, variables)["data"]["allOrders"]
+
+    def test_pages_backwards_in_merged_order(self):
+        with capture_queries() as queries:
+            last = self.page(last=3)
+        self.assertEqual([edge["node"]["numericId"] for edge in last["edges"]], self.ids[-3:])
+        self.assertEqual(last["pageInfo"], {"hasPreviousPage": True, "hasNextPage": False})
+        # Each table (of each shard) is read from its end, a page's worth of rows at most
+        rows = [query["sql"] for query in queries if "ORDER BY" in query["sql"]]
+        self.assertEqual(len(rows), 2 * len(sharding.databases(Order)))
+        self.assertTrue(all("DESC LIMIT 3" in sql for sql in rows), rows)
+
+        previous = self.page(last=4, before=last["edges"][0]["cursor"])
+        self.assertEqual([edge["node"]["numericId"] for edge in previous["edges"]], self.ids[-7:-3])
+        self.assertEqual(previous["pageInfo"]["hasPreviousPage"], True)
+
+    def test_cursors_match_forward_pages(self):
+        forward = self.page(first=5, after=self.page(first=4)["edges"][-1]["cursor"])
+        backward = self.page(last=5, before=self.page(first=10)["edges"][-1]["cursor"])
+        self.assertEqual(forward["edges"], backward["edges"])
+        self.assertEqual([edge["node"]["numericId"] for edge in forward["edges"]], self.ids[4:9])
+
+    def test_nulls_sort_where_the_database_puts_them(self):
+        Customer.objects.create(name="Bo", email="bo@example.com", phone="+1111111111")
+        Customer.objects.create(name="Cy", email="cy@example.com")
+        Customer.objects.create(name="Di", email="di@example.com", phone="+2222222222")
+        parts = [
+            half
+            for queryset in sharding.querysets(Customer.objects.exclude(name="Ada"))
+            for half in (queryset.filter(name__lt="C"), queryset.filter(name__gte="C"))
+        ]
+        # SQLite sorts NULL before any phone
+        for ordering, expected in ((["phone"], ["Cy", "Bo", "Di"]), (["-phone"], ["Di", "Bo", "Cy"])):
+            merged = MergedQuerySet(parts).map(lambda queryset: queryset.order_by(*ordering))
+            self.assertEqual([customer.name for customer in merged], expected, ordering)
+            self.assertEqual([customer.name for customer in merged[1:3]], expected[1:3], ordering)
+            # Past the end once the count is known
+            self.assertEqual(merged[3:5], [], ordering)
+
+    def test_orders_by_total_across_the_archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp = Product.objects.create(name="Lamp", price=5)
+            desk = Product.objects.create(name="Desk", price=9)
+        self.orders[1].products.add(lamp)
+        self.orders[3].products.add(lamp, desk)
+        data = graphql(self.client, """{ allOrders(includeArchived: true, orderBy: "total_amount_db,order_date", first: 4) {
+                                            edges { node { numericId } } } }""")
+        ids = [edge["node"]["numericId"] for edge in data["data"]["allOrders"]["edges"]]
+        # Orders without products have no total, which SQLite sorts first
+        self.assertEqual(ids, [self.ids[0], self.ids[2], self.ids[4], self.ids[5]])
+        data = graphql(self.client, """{ allOrders(includeArchived: true, orderBy: "-total_amount_db", first: 2) {
+                                            edges { node { numericId } } } }""")
+        self.assertEqual([edge["node"]["numericId"] for edge in data["data"]["allOrders"]["edges"]], [self.ids[3], self.ids[1]])
+
+
+# --- Upserts -----------------------------------------------------------------
+
+class UpsertTests(TestCase):
+    databases = "__all__"
+
+    def test_product_upsert_returns_the_stored_row(self):
+        mutation = """mutation($input: ProductInput!) { createProduct(input: $input, upsert: true) {
+                          success product { numericId price stock lowStockThreshold } } }"""
+        created = graphql(self.client, mutation, {"input": {"name": "Lamp", "price": 5, "stock": 20, "lowStockThreshold": 3}})
+        saved = graphql(self.client, mutation, {"input": {"name": "Lamp", "price": 7, "stock": 8}})
+        product = saved["data"]["createProduct"]["product"]
+        self.assertEqual(product["numericId"], created["data"]["createProduct"]["product"]["numericId"])
+        self.assertEqual((product["price"], product["stock"], product["lowStockThreshold"]), ("7.00", 8, 3))
+        self.assertEqual(Product.objects.get(name="Lamp").low_stock_threshold, 3)
+
+    def test_customer_upsert_returns_the_stored_row(self):
+        mutation = """mutation($input: CustomerInput!) { createCustomer(input: $input, upsert: true) {
+                          success customer { numericId name createdAt } } }"""
+        customer = Customer.objects.create(
+            name="Old name", email="upsert@example.com", created_at=timezone.now() - timedelta(days=30)
+        )
+        data = graphql(self.client, mutation, {"input": {"name": "New name", "email": "upsert@example.com"}})
+        saved = data["data"]["createCustomer"]["customer"]
+        self.assertEqual((saved["numericId"], saved["name"]), (customer.pk, "New name"))
+        self.assertEqual(saved["createdAt"], customer.created_at.isoformat())
+
+    def test_upsert_keeps_fields_not_given(self):
+        Product.objects.create(name="Lamp", price=5, stock=50)
+        Customer.objects.create(name="Ada", email="ada@example.com", phone="+1234567890")
+        product = graphql(self.client, """mutation { createProduct(input: {name: "Lamp", price: 6}, upsert: true) {
+                                              product { price stock } } }""")
+        self.assertEqual(product["data"]["createProduct"]["product"], {"price": "6.00", "stock": 50})
+        customer = graphql(self.client, """mutation { createCustomer(input: {name: "Ada L", email: "ada@example.com"},
+                                               upsert: true) { customer { name phone } } }""")
+        self.assertEqual(customer["data"]["createCustomer"]["customer"], {"name": "Ada L", "phone": "+1234567890"})
+        self.assertEqual(Product.objects.get(name="Lamp").stock, 50)
+        self.assertEqual(sharding.find_customer("ada@example.com").phone, "+1234567890")
+
+    def test_upsert_events_tell_inserts_from_updates(self):
+        from crm.models import ChangeEvent
+
+        mutation = """mutation { createProduct(input: {name: "Desk", price: 9}, upsert: true) { success } }"""
+        graphql(self.client, mutation)
+        graphql(self.client, mutation)
+        mutation = """mutation { createCustomer(input: {name: "Bo", email: "bo@example.com"}, upsert: true) { success } }"""
+        graphql(self.client, mutation)
+        graphql(self.client, mutation)
+        self.assertEqual(
+            list(ChangeEvent.objects.order_by("pk").values_list("entity", "action")),
+            [("product", ChangeEvent.CREATED), ("product", ChangeEvent.UPDATED),
+             ("customer", ChangeEvent.CREATED), ("customer", ChangeEvent.UPDATED)],
+        )
+
+
+# --- Entity cache ------------------------------------------------------------
+
+class EntityCacheTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        from crm.entity_cache import entity_cache
+
+        self.product = Product.objects.create(name="Cached", price=Decimal("3.00"), stock=5)
+        self.cache = entity_cache(Product)
+
+    def stock(self, cache=None):
+        found = (cache or self.cache).get_many([self.product.pk])
+        return found[self.product.pk].stock if found else None
+
+    def test_save_invalidates(self):
+        self.assertEqual(self.stock(), 5)
+        self.product.stock = 7
+        self.product.save()
+        self.assertEqual(self.stock(), 7)
+
+    def test_update_is_seen_after_invalidate(self):
+        from crm.entity_cache import invalidate
+
+        self.assertEqual(self.stock(), 5)
+        Product.objects.filter(pk=self.product.pk).update(stock=9)
+        self.assertEqual(self.stock(), 5)
+        invalidate(Product, [self.product.pk])
+        self.assertEqual(self.stock(), 9)
+
+    def test_delete_invalidates(self):
+        self.assertEqual(self.stock(), 5)
+        self.product.delete()
+        self.assertIsNone(self.stock())
+
+    def test_recent_lru_hits_skip_the_shared_cache_with_local_ttl(self):
+        from crm.entity_cache import EntityCache, entity_cache_settings
+
+        cache = EntityCache(Product, {**entity_cache_settings(), "LOCAL_TTL": 60})
+        self.assertEqual(self.stock(cache), 5)
+        with mock.patch.object(cache.shared, "get_many", wraps=cache.shared.get_many) as get_many:
+            self.assertEqual(self.stock(cache), 5)
+        get_many.assert_not_called()
+
+    def test_write_by_another_process_is_seen_at_once(self):
+        self.assertEqual(self.stock(), 5)
+        # Another process: a new row version in the shared cache, this LRU untouched
+        Product.objects.filter(pk=self.product.pk).update(stock=11)
+        self.cache.shared.incr(self.cache.version_key(self.product.pk))
+        self.assertEqual(self.stock(), 11)
+
+    def test_tests_do_not_share_the_dev_cache(self):
+        self.assertNotEqual(settings.CACHES["shared"]["BACKEND"], "django.core.cache.backends.filebased.FileBasedCache")
+
+
+# --- Order reminders ---------------------------------------------------------
+
+class OrderReminderTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        from crm.models import Watermark
+
+        # The migration starts the watermark at deploy time; start from the window instead
+        Watermark.objects.filter(name="order_reminders").update(order_created_at=None)
+        self.customer = Customer.objects.create(name="Reminded", email="reminded@example.com")
+
+    def order(self, days_ago=0, inserted_ago=timedelta(minutes=5)):
+        order = Order.objects.create(customer=self.customer, order_date=timezone.now() - timedelta(days=days_ago))
+        # As if inserted a while ago, past the settle ceiling
+        for queryset in sharding.querysets(Order.objects.filter(pk=order.pk)):
+            queryset.update(created_at=timezone.now() - inserted_ago)
+        return order.pk
+
+    def run_reminders(self, **kwargs):
+        from crm.reminders import send_order_reminders
+
+        sent = []
+        send_order_reminders(lambda order: sent.append(order.pk), **kwargs)
+        return sent
+
+    def test_back_dated_orders_are_reminded_once(self):
+        first = self.order()
+        self.assertEqual(self.run_reminders(), [first])
+        # orderDate sent by the client is earlier than everything already processed
+        back_dated = self.order(days_ago=3)
+        too_old = self.order(days_ago=10)
+        self.assertEqual(self.run_reminders(), [back_dated])
+        self.assertEqual(self.run_reminders(), [])
+        self.assertNotIn(too_old, self.run_reminders())
+
+    def test_orders_inside_the_settle_window_wait_for_the_next_run(self):
+        settled = self.order()
+        fresh = self.order(inserted_ago=timedelta(seconds=5))
+        self.assertEqual(self.run_reminders(), [settled])
+        with override_settings(REMINDER_SETTLE_SECONDS=1):
+            self.assertEqual(self.run_reminders(), [fresh])
+
+    def test_resume_after_a_crash(self):
+        from crm.models import OrderReminder
+        from crm.reminders import send_order_reminders
+
+        orders = [self.order(inserted_ago=timedelta(minutes=10 - i)) for i in range(5)]
+        sent = []
+
+        def send(order):
+            if len(sent) == 3:
+                raise ConnectionError("mail server went away")
+            sent.append(order.pk)
+
+        with self.assertRaises(ConnectionError):
+            send_order_reminders(send, batch_size=2)
+        # The first batch committed; the interrupted one is sent again, nothing else
+        self.assertEqual(set(OrderReminder.objects.values_list("order_id", flat=True)), set(orders[:2]))
+        self.assertEqual(self.run_reminders(batch_size=2), orders[2:])
+        self.assertEqual(self.run_reminders(), [])
+
+
+# --- Query budgets -----------------------------------------------------------
+#
+# Every operation in QUERY_CATALOG runs against fixtures of growing size and
+# must issue the same number of SQL statements at each size (no N+1), no
+# more than its budget in crm/query_budgets.json, and finish within its time
+# budget on the largest fixture. After an intentional change, regenerate the
+# budgets with:
+#
+#   UPDATE_QUERY_BUDGETS=1 python manage.py test crm.tests.QueryBudgetTests
+#
+# and review the SQL diff in the commit.
+
+QUERY_BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "query_budgets.json")
+FIXTURE_SIZES = (2, 8, 24)
+re_savepoints = re.compile(r'"s\d+_x\d+"')
+
+ORDER_FIELDS = "numericId orderDate totalAmount customer { name email } products { name price stock }"
+
+QUERY_CATALOG = {
+    "allOrders": (
+        "query { allOrders(first: 100) { edges { node { %s } } } }" % ORDER_FIELDS,
+        None,
+    ),
+    "allOrdersFiltered": (
+        """query { allOrders(first: 100, orderBy: "-order_date",
+                   filter: { totalAmountGte: 1, productName: "budget" }) {
+               totalCount edges { node { %s } } } }""" % ORDER_FIELDS,
+        None,
+    ),
+    "allOrdersIncludeArchived": (
+        "query { allOrders(first: 100, includeArchived: true) { edges { node { %s } } } }" % ORDER_FIELDS,
+        None,
+    ),
+    "allProducts": (
+        """query { allProducts(first: 100, orderBy: "name", filter: { stockLte: 1000 }) {
+               totalCount edges { node { numericId name price stock lowStockThreshold } } } }""",
+        None,
+    ),
+    "allCustomers": (
+        """query { allCustomers(first: 100, filter: { nameIcontains: "budget" }) {
+               totalCount edges { node { numericId name email phone } } } }""",
+        None,
+    ),
+    "createOrder": (
+        """mutation($input: OrderInput!) { createOrder(input: $input) {
+               success message order { %s } } }""" % ORDER_FIELDS,
+        lambda fixture: {"input": {
+            "customerId": str(fixture["customers"][0].pk),
+            "productIds": [str(product.pk) for product in fixture["products"][:3]],
+        }},
+    ),
+    "bulkCreateCustomers": (
+        """mutation($input: [CustomerInput!]!) { bulkCreateCustomers(input: $input) {
+               customers { numericId name } errors } }""",
+        lambda fixture: {"input": [
+            {"name": f"New {fixture['size']} {i}", "email": f"new-{fixture['size']}-{i}@example.com"}
+            for i in range(3)
+        ]},
+    ),
+    "nodes": (
+        """query($ids: [ID!]!) { nodes(ids: $ids) { id
+               ... on CustomerType { name email }
+               ... on ProductType { name price stock }
+               ... on OrderType { %s } } }""" % ORDER_FIELDS,
+        lambda fixture: {"ids": [
+            to_global_id(type_name, obj.pk)
+            for type_name, objects in (
+                ("CustomerType", fixture["customers"]),
+                ("ProductType", fixture["products"]),
+                ("OrderType", fixture["orders"]),
+            )
+            for obj in objects
+        ]},
+    ),
+    "bulkCreateCustomersAsync": (
+        """mutation($input: [CustomerInput!]!) { bulkCreateCustomersAsync(input: $input, chunkSize: 2) {
+               job { id status totalRows } } }""",
+        lambda fixture: {"input": [
+            {"name": f"Job {fixture['size']} {i}", "email": f"job-{fixture['size']}-{i}@example.com"}
+            for i in range(5)
+        ]},
+    ),
+    "bulkUpdateProducts": (
+        """mutation($input: [ProductUpdateInput!]!) { bulkUpdateProducts(input: $input) {
+               updatedCount errors products { numericId price stock } } }""",
+        lambda fixture: {"input": [
+            {"id": str(product.pk), "price": 19.99, "stockDelta": -1} if i % 2 else {"id": str(product.pk), "stock": 50}
+            for i, product in enumerate(fixture["products"][:4])
+        ]},
+    ),
+}
+
+
+def load_query_budgets():
+    with open(QUERY_BUDGETS_PATH) as file:
+        return json.load(file)
+
+
+def grow_fixture(fixture, size):
+    """Add rows until the fixture has `size` customers/products and 2 * size hot orders."""
+    now = timezone.now()
+    start = len(fixture["customers"])
+    fixture["customers"] += Customer.objects.bulk_create(
+        Customer(name=f"Budget customer {i}", email=f"budget{i}@example.com", created_at=now)
+        for i in range(start, size)
+    )
+    fixture["products"] += Product.objects.bulk_create(
+        Product(name=f"Budget product {i}", price=Decimal("9.99") + i, stock=100) for i in range(start, size)
+    )
+    orders = Order.objects.bulk_create(
+        Order(customer=fixture["customers"][i % size], order_date=now - timedelta(hours=i))
+        for i in range(2 * start, 2 * size)
+    )
+    fixture["orders"] += orders
+    archived = ArchivedOrder.objects.bulk_create(
+        ArchivedOrder(id=10_000_000 + i, customer=fixture["customers"][i % size], order_date=now - timedelta(days=400 + i))
+        for i in range(start, size)
+    )
+    products = fixture["products"]
+    Order.products.through.objects.bulk_create(
+        Order.products.through(order_id=order.pk, product_id=products[(order.pk + j) % size].pk)
+        for order in orders for j in range(min(3, size))
+    )
+    ArchivedOrder.products.through.objects.bulk_create(
+        ArchivedOrder.products.through(archivedorder_id=order.pk, product_id=products[(order.pk + j) % size].pk)
+        for order in archived for j in range(min(2, size))
+    )
+    fixture["size"] = size
+    return fixture
+
+
+# Measure the database path, not how warm the entity cache happens to be
+@override_settings(ENTITY_CACHE={"ENABLED": False})
+@skipIf(settings.CRM_SHARDS, "the budgets are recorded against a single database")
+class QueryBudgetTests(TestCase):
+
+    def execute(self, name, fixture):
+        from alx_backend_graphql_crm.schema import schema
+
+        query, variables = QUERY_CATALOG[name]
+        request = RequestFactory().post("/graphql")
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            result = schema.execute(
+                query, variable_values=variables(fixture) if variables else None, context_value=request
+            )
+            elapsed = time.perf_counter() - start
+        self.assertIsNone(result.errors, f"{name}: {result.errors}")
+        return [normalize_sql(query["sql"]) for query in captured.captured_queries], elapsed
+
+    def test_query_counts_are_constant_and_within_budget(self):
+        budgets = load_query_budgets()
+        fixture = {"customers": [], "products": [], "orders": [], "size": 0}
+        measured = {name: [] for name in QUERY_CATALOG}
+        for size in FIXTURE_SIZES:
+            grow_fixture(fixture, size)
+            for name in QUERY_CATALOG:
+                measured[name].append((size, *self.execute(name, fixture)))
+
+        if os.environ.get("UPDATE_QUERY_BUDGETS"):
+            with open(QUERY_BUDGETS_PATH, "w") as file:
+                json.dump({
+                    name: {
+                        "queries": len(runs[-1][1]),
+                        "max_ms": budgets.get(name, {}).get("max_ms", 500),
+                        "sql": runs[-1][1],
+                    }
+                    for name, runs in measured.items()
+                }, file, indent=2)
+                file.write("\n")
+            budgets = load_query_budgets()
+
+        for name, runs in measured.items():
+            with self.subTest(operation=name):
+                self.assertIn(name, budgets, f"No budget for {name} in {QUERY_BUDGETS_PATH}")
+                smallest_size, smallest_sql, _ = runs[0]
+                for size, sql, _ in runs[1:]:
+                    self.assertEqual(
+                        len(sql), len(smallest_sql),
+                        f"{name} issues {len(smallest_sql)} queries with {smallest_size} rows but "
+                        f"{len(sql)} with {size} rows:\n" + sql_diff(smallest_sql, sql, f"{smallest_size} rows", f"{size} rows"),
+                    )
+
+                size, sql, elapsed = runs[-1]
+                budget = budgets[name]
+                self.assertLessEqual(
+                    len(sql), budget["queries"],
+                    f"{name} issues {len(sql)} queries, budget is {budget['queries']}:\n"
+                    + sql_diff(budget.get("sql", []), sql),
+                )
+                self.assertLessEqual(
+                    elapsed * 1000, budget["max_ms"],
+                    f"{name} took {elapsed * 1000:.0f}ms with {size} rows, budget is {budget['max_ms']}ms",
+                )
+
+
+def normalize_sql(sql):
+    # Literals and IN lists as in the slow SQL log, plus the generated savepoint names
+    return re_savepoints.sub('"savepoint"', fingerprint(sql)[1])
+
+
+def sql_diff(expected, actual, expected_label="budget", actual_label="actual"):
+    return "\n".join(difflib.unified_diff(expected, actual, expected_label, actual_label, lineterm=""))
+
+
+# --- Load test ---------------------------------------------------------------
+
+class LoadTestTests(SimpleTestCase):
+    def test_stages_ramp_linearly(self):
+        from crm.loadtest import Profile, parse_stages
+
+        profile = Profile(parse_stages("10s:4,10:0"))
+        self.assertEqual((profile.duration, profile.max_workers), (20.0, 4))
+        self.assertEqual([profile.workers_at(t) for t in (0, 5, 10, 15, 20)], [0, 2, 4, 2, 0])
+
+    def test_operations_without_variables_are_dropped(self):
+        from crm import loadtest
+
+        def transport(body, headers):
+            # No customers or products, so no order can be built
+            return 200, b'{"data": {}}'
+
+        order_input = mock.Mock(wraps=loadtest._order_input)
+        mix = [
+            loadtest.Operation("createOrder", 100, loadtest.CREATE_ORDER, order_input),
+            loadtest.Operation("listOrders", 1, loadtest.LIST_ORDERS, {"first": 20}),
+        ]
+        results = loadtest.run(transport, mix, loadtest.Profile([(0.2, 2)]), seed=1)
+        self.assertEqual(results.skipped, {"createOrder"})
+        self.assertLessEqual(order_input.call_count, 2)
+        self.assertEqual(list(results.latencies), ["listOrders"])
+        self.assertIn("skipped (no fixture ids to build them from): createOrder", loadtest.report(results))
+
+
+# --- Bulk product updates ----------------------------------------------------
+
+class BulkUpdateProductsTests(TestCase):
+    databases = "__all__"
+
+    mutation = """mutation($input: [ProductUpdateInput!]!) { bulkUpdateProducts(input: $input) {
+                      updatedCount errors products { numericId price stock } } }"""
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f"Bulk {i}", price=Decimal("10.00"), stock=5, low_stock_threshold=2)
+            for i in range(4)
+        ]
+
+    def update(self, rows):
+        return graphql(self.client, self.mutation, {"input": rows})["data"]["bulkUpdateProducts"]
+
+    def test_deltas_apply_and_zero_is_a_no_op(self):
+        from crm.models import ChangeEvent
+
+        a, b, c, d = (str(product.pk) for product in self.products)
+        result = self.update([
+            {"id": a, "stockDelta": -5},
+            {"id": b, "stockDelta": 3},
+            {"id": c, "stockDelta": 0},
+            {"id": d, "price": 12.5, "stock": 1},
+        ])
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(result["updatedCount"], 4)
+        self.assertEqual(
+            [(p["stock"], p["price"]) for p in result["products"]],
+            [(0, "10.00"), (8, "10.00"), (5, "10.00"), (1, "12.50")],
+        )
+        # The untouched row is not announced as a change
+        self.assertEqual(
+            set(ChangeEvent.objects.values_list("entity_id", flat=True)), {int(a), int(b), int(d)}
+        )
+
+    def test_invalid_rows_are_reported_and_the_rest_written(self):
+        a, b, c, d = (str(product.pk) for product in self.products)
+        result = self.update([
+            {"id": a, "price": 19.999},
+            {"id": b, "price": 123456789.5},
+            {"id": c, "stock": 2, "stockDelta": 1},
+            {"id": d, "price": 0},
+            {"id": "x", "stock": 1},
+            {"id": "999999"},
+            {"id": "999999", "stock": 1},
+            {"id": d, "stockDelta": -1},
+            {"id": d, "stock": 1},
+            {"id": c, "stockDelta": -6},
+        ])
+        self.assertEqual(result["errors"], [
+            "Row 1: Price: Ensure that there are no more than 2 decimal places.",
+            "Row 2: Price: Ensure that there are no more than 8 digits before the decimal point.",
+            "Row 3: Give either stock or stockDelta, not both.",
+            "Row 4: Price should be greater than 0.",
+            "Row 5: ID must be a valid integer.",
+            "Row 6: Nothing to update, give price, stock or stockDelta.",
+            "Row 7: Product 999999 not found.",
+            f"Row 9: Product {d} is already updated by row 8.",
+            "Row 10: Stock delta -6 exceeds the 5 in stock.",
+        ])
+        self.assertEqual(result["updatedCount"], 1)
+        self.assertEqual(result["products"], [{"numericId": int(d), "price": "10.00", "stock": 4}])
+        self.assertEqual(Product.objects.get(pk=a).price, Decimal("10.00"))
+
+    def test_rows_only_write_the_fields_they_give(self):
+        from crm.models import ChangeEvent
+
+        a, b = self.products[:2]
+        with CaptureQueriesContext(connection) as queries:
+            result = self.update([{"id": str(a.pk), "price": 11}, {"id": str(b.pk), "stock": 9}])
+        self.assertEqual(result["errors"], [])
+        updates = [query["sql"] for query in queries.captured_queries if query["sql"].startswith('UPDATE "crm_product"')]
+        self.assertEqual(len(updates), 2)
+        # A price change doesn't write back a stock read before a concurrent order
+        price, stock = sorted(updates, key=lambda sql: '"stock"' in sql)
+        self.assertNotIn('"stock"', price)
+        self.assertNotIn('"price"', stock)
+        self.assertEqual(
+            sorted((event.entity_id, event.data["fields"]) for event in ChangeEvent.objects.all()),
+            sorted([(a.pk, ["price"]), (b.pk, ["stock"])]),
+        )
+
+
+# --- Admin -------------------------------------------------------------------
+
+@skipIf(settings.CRM_SHARDS, "the admin is not shard-aware")
+class AdminTests(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            customer = Customer.objects.create(name=f"Customer {i}", email=f"c{i}@example.com")
+            Order.objects.create(customer=customer)
+
+    def paginator(self, queryset):
+        from crm.admin import EstimatedCountPaginator
+
+        return EstimatedCountPaginator(queryset, 2)
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_count_stops_at_the_limit(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.paginator(Customer.objects.order_by("-id")).count, 3)
+        counts = [query["sql"] for query in queries.captured_queries if "COUNT(" in query["sql"]]
+        self.assertEqual(len(counts), 1)
+        self.assertIn("LIMIT 3", counts[0])
+        self.assertEqual(self.paginator(Customer.objects.order_by("-id")).num_pages, 2)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_MIN_ROWS=1000)
+    def test_big_unfiltered_tables_use_the_estimate(self):
+        with mock.patch("crm.connections.estimate_table_rows", return_value=250000) as estimate:
+            self.assertEqual(self.paginator(Customer.objects.all()).count, 250000)
+            # Filters make the table estimate meaningless
+            self.assertEqual(self.paginator(Customer.objects.filter(name="Customer 1")).count, 1)
+        self.assertEqual(estimate.call_count, 1)
+        with mock.patch("crm.connections.estimate_table_rows", return_value=999):
+            self.assertEqual(self.paginator(Customer.objects.all()).count, 5)
+
+    def test_changelist_search_and_query_count(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pw"))
+        response = self.client.get("/admin/crm/customer/", {"q": "c3@example.com"})
+        self.assertEqual([customer.email for customer in response.context["cl"].result_list], ["c3@example.com"])
+        # Substrings don't match: search lookups are exact or prefix only
+        response = self.client.get("/admin/crm/customer/", {"q": "example.com"})
+        self.assertEqual(len(response.context["cl"].result_list), 0)
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.get("/admin/crm/order/")
+        customer = Customer.objects.first()
+        for _ in range(10):
+            Order.objects.create(customer=customer)
+        with CaptureQueriesContext(connection) as more:
+            self.client.get("/admin/crm/order/")
+        self.assertEqual(len(more), len(few))
+
+
+# --- Change feed -------------------------------------------------------------
+
+class ChangeFeedTests(TestCase):
+    databases = "__all__"
+
+    def test_positions_are_assigned_after_commit(self):
+        from crm import outbox
+        from crm.models import ChangeEvent
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.record("customer", ChangeEvent.CREATED, [1, None, 2], source="test"), 2)
+            self.assertEqual(ChangeEvent.objects.filter(position__isnull=True).count(), 2)
+        events = list(ChangeEvent.objects.order_by("pk"))
+        self.assertEqual([event.position for event in events], [1, 2])
+        self.assertEqual([(event.entity_id, event.data) for event in events], [(1, {"source": "test"}), (2, {"source": "test"})])
+
+    def test_event_committed_late_is_not_skipped(self):
+        from crm import outbox
+        from crm.models import ChangeEvent
+
+        ChangeEvent.objects.bulk_create([
+            ChangeEvent(pk=5, entity="customer", entity_id=5, action=ChangeEvent.CREATED),
+            ChangeEvent(pk=6, entity="product", entity_id=6, action=ChangeEvent.CREATED),
+        ])
+        seen = outbox.events_after(0)
+        self.assertEqual([(event.pk, event.position) for event in seen], [(5, 1), (6, 2)])
+
+        # A long transaction commits its lower id after the consumer read past id 6
+        ChangeEvent.objects.create(pk=3, entity="customer", entity_id=3, action=ChangeEvent.UPDATED)
+        late = outbox.events_after(seen[-1].position)
+        self.assertEqual([(event.pk, event.position) for event in late], [(3, 3)])
+        self.assertEqual(outbox.events_after(late[-1].position), [])
+        self.assertEqual([event.pk for event in outbox.events_after(0, entities=["customer"])], [5, 3])
+        self.assertEqual([event.pk for event in outbox.iter_events(0, batch_size=2)], [5, 6, 3])
+
+    def test_prune_events(self):
+        from crm import outbox
+        from crm.models import ChangeEvent
+
+        outbox.record("customer", ChangeEvent.DELETED, [1, 2])
+        ChangeEvent.objects.filter(entity_id=1).update(created_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(outbox.prune_events(), 1)
+        self.assertEqual(list(ChangeEvent.objects.values_list("entity_id", flat=True)), [2])
+        self.assertEqual(outbox.prune_events(days=0), 1)
+
+    def test_changes_field_pages_through_the_feed(self):
+        from crm import outbox
+        from crm.models import ChangeEvent
+
+        outbox.record("customer", ChangeEvent.CREATED, [1, 2])
+        outbox.record("product", ChangeEvent.UPDATED, [3], fields=["stock"])
+        query = """query($after: String, $entities: [String]) { changes(after: $after, first: 2, entities: $entities) {
+                       cursor hasMore events { position entity entityId action data } } }"""
+        first = graphql(self.client, query)["data"]["changes"]
+        self.assertTrue(first["hasMore"])
+        self.assertEqual([event["entityId"] for event in first["events"]], [1, 2])
+        rest = graphql(self.client, query, {"after": first["cursor"]})["data"]["changes"]
+        self.assertFalse(rest["hasMore"])
+        self.assertEqual(len(rest["events"]), 1)
+        self.assertEqual(rest["events"][0]["action"], "updated")
+        self.assertEqual(json.loads(rest["events"][0]["data"]), {"fields": ["stock"]})
+        self.assertEqual(graphql(self.client, query, {"after": rest["cursor"]})["data"]["changes"]["events"], [])
+
+        products = graphql(self.client, query, {"entities": ["product"]})["data"]["changes"]
+        self.assertEqual([event["entity"] for event in products["events"]], ["product"])
+        self.assertIn("errors", graphql(self.client, query, {"after": "nope"}))
+
+    def test_cleanup_announces_the_cascaded_orders(self):
+        from crm import cron, outbox
+        from crm.models import ChangeEvent
+
+        old = timezone.now() - timedelta(days=400)
+        inactive = Customer.objects.create(name="Gone", email="gone@example.com")
+        live = Order.objects.create(customer=inactive, order_date=old)
+        archived = ArchivedOrder.objects.create(id=archived_order_id(inactive), customer=inactive, order_date=old)
+        Order.objects.create(customer=Customer.objects.create(name="Kept", email="kept@example.com"))
+
+        with mock.patch.object(cron, "cleanup_log_path", os.devnull), redirect_stdout(io.StringIO()):
+            cron.clean_inactive_customers()
+        events = {(event.entity, event.entity_id, event.action) for event in outbox.iter_events(0)}
+        self.assertEqual(events, {
+            ("customer", inactive.pk, ChangeEvent.DELETED),
+            ("order", live.pk, ChangeEvent.DELETED),
+            ("order", archived.pk, ChangeEvent.DELETED),
+        })
+        self.assertEqual(everywhere(Order.objects.filter(pk=live.pk)), [])
+
+
+# --- Background bulk jobs ----------------------------------------------------
+
+class BulkJobTests(TestCase):
+    databases = "__all__"
+
+    def test_job_reports_progress_and_row_errors(self):
+        from crm import bulk_jobs
+        from crm.models import BulkJob
+
+        Customer.objects.create(name="Taken", email="taken@example.com")
+        rows = [{"name": f"Row {i}", "email": f"row{i}@example.com"} for i in range(5)]
+        rows[1]["email"] = "taken@example.com"
+        rows[3]["phone"] = "12345"
+        job = bulk_jobs.submit(BulkJob.CREATE_CUSTOMERS, rows, chunk_size=2)
+        self.assertEqual(bulk_jobs.job_status(job)["status"], "pending")
+
+        self.assertEqual(bulk_jobs.drain(limit=1), 1)
+        status = bulk_jobs.job_status(job)
+        self.assertEqual((status["status"], status["processed_rows"]), ("running", 2))
+
+        self.assertEqual(bulk_jobs.drain(), 2)
+        status = bulk_jobs.job_status(job)
+        self.assertEqual(status["status"], "succeeded")
+        self.assertEqual((status["succeeded_rows"], status["failed_rows"]), (3, 2))
+        self.assertEqual([row for row, _ in bulk_jobs.job_errors(job)], [1, 3])
+        self.assertEqual(len(everywhere(Customer.objects.filter(email__startswith="row"))), 3)
+
+    def test_chunk_with_expired_lock_is_run_again(self):
+        from crm import bulk_jobs
+        from crm.models import BulkJob, BulkJobChunk
+
+        job = bulk_jobs.submit(BulkJob.CREATE_CUSTOMERS, [{"name": "Lost", "email": "lost@example.com"}])
+        chunk = bulk_jobs.claim_chunk("worker-that-died")
+        self.assertIsNone(bulk_jobs.claim_chunk("other"))
+
+        BulkJobChunk.objects.filter(pk=chunk.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(bulk_jobs.run_stalled_chunks(), 1)
+        self.assertEqual(bulk_jobs.job_status(job)["status"], "succeeded")
+        self.assertIsNotNone(sharding.find_customer("lost@example.com"))
+
+    def test_large_job_fits_in_one_request(self):
+        from crm.models import BulkJob, BulkJobChunk
+
+        rows = [{"name": f"Customer {i}", "email": f"customer-{i}@example.com", "phone": "+1234567890"}
+                for i in range(100000)]
+        body = json.dumps({
+            "query": "mutation($input: [CustomerInput!]!) { bulkCreateCustomersAsync(input: $input) { job { status } } }",
+            "variables": {"input": rows},
+        })
+        self.assertGreater(len(body), settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        # Chunks go to the run_bulk_jobs workers, not to threads of the web process
+        with mock.patch("crm.bulk_jobs.dispatch") as dispatch, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/graphql", body, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["bulkCreateCustomersAsync"]["job"]["status"], "pending")
+        self.assertEqual(BulkJob.objects.get().total_rows, 100000)
+        self.assertEqual(BulkJobChunk.objects.count(), 100)
+        dispatch.assert_not_called()
+
+        with override_settings(GRAPHQL_MAX_BODY_BYTES=1024):
+            response = self.client.post("/graphql", body, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_single_and_bulk_creates_share_the_phone_check(self):
+        from crm import bulk_jobs
+        from crm.validators import PHONE_MESSAGE
+
+        mutation = """mutation($input: CustomerInput!) { createCustomer(input: $input) { success message } }"""
+        data = graphql(self.client, mutation, {"input": {"name": "Ada", "email": "ada@example.com", "phone": "12345"}})
+        self.assertEqual(data["data"]["createCustomer"], {"success": False, "message": PHONE_MESSAGE})
+
+        rows = [{"name": "Ada", "email": "ada@example.com", "phone": phone} for phone in ("12345", "+12345678901")]
+        created, errors = bulk_jobs.create_customers(rows)
+        self.assertEqual((len(created), errors), (1, [(0, PHONE_MESSAGE)]))
+
+
+# --- Introspection -----------------------------------------------------------
+
+class IntrospectionTests(TestCase):
+    databases = "__all__"
+
+    def test_exported_schema_is_current(self):
+        from alx_backend_graphql_crm.schema import schema
+        from crm.introspection import export_sdl
+
+        with open(settings.GRAPHQL_SCHEMA_SDL_PATH) as file:
+            self.assertEqual(
+                file.read(), export_sdl(schema.graphql_schema),
+                "crm/schema.graphql is stale, run: python manage.py export_schema",
+            )
+
+    def test_introspection_is_served_from_cache_with_etag(self):
+        from graphql import get_introspection_query
+
+        from crm import introspection
+
+        introspection.clear()
+        body = json.dumps({"query": get_introspection_query()})
+        first = self.client.post("/graphql", body, content_type="application/json")
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header("ETag"))
+
+        with self.assertNumQueries(0):
+            again = self.client.post(
+                "/graphql", body, content_type="application/json", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+
+
+# --- Read coalescing ---------------------------------------------------------
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_identical_calls_share_one_execution(self):
+        import threading
+
+        from crm.coalesce import SingleFlight
+
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("key", slow, 5)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do("key", slow, 5))) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("result", False)] + [("result", True)] * 5)
+
+    def test_waiter_runs_itself_after_max_wait(self):
+        from crm.coalesce import Flight, SingleFlight
+
+        flight = SingleFlight()
+        flight._flights["key"] = Flight()  # in flight and never finishing
+        self.assertEqual(flight.do("key", lambda: "own", 0.01), ("own", False))
+
+    def test_only_query_operations_are_coalesced(self):
+        from crm.coalesce import normalized_read
+
+        self.assertEqual(normalized_read("{ hello }", None), normalized_read("query {\n  hello\n}", None))
+        self.assertIsNone(normalized_read("mutation { createOrder { success } }", None))
+        self.assertIsNone(normalized_read("{ broken", None))
+
+
+# --- Node lookups ------------------------------------------------------------
+
+class NodeTests(TestCase):
+    databases = "__all__"
+
+    def test_malformed_and_unknown_ids_resolve_to_null(self):
+        customer = Customer.objects.create(name="Node", email="node@example.com")
+        product = Product.objects.create(name="Node product", price=Decimal("2.50"), stock=5)
+        ids = [
+            to_global_id("CustomerType", customer.pk),
+            to_global_id("CustomerType", 99999999999999999999),  # past BIGINT
+            to_global_id("ProductType", product.pk),
+            to_global_id("OrderType", 0),
+            to_global_id("CustomerType", -1),
+            "not a global id",
+            to_global_id("CustomerType", "abc"),
+            to_global_id("UnknownType", 1),
+            to_global_id("ProductType", 2 ** 63 - 1),  # valid, just not there
+        ]
+        data = graphql(self.client, """query($ids: [ID!]!) { nodes(ids: $ids) {
+                           ... on CustomerType { name } ... on ProductType { name } } }""", {"ids": ids})
+        self.assertNotIn("errors", data)
+        self.assertEqual(
+            data["data"]["nodes"],
+            [{"name": "Node"}, None, {"name": "Node product"}, None, None, None, None, None, None],
+        )
+
+        data = graphql(self.client, "query($id: ID!) { node(id: $id) { id } }", {"id": ids[1]})
+        self.assertEqual(data, {"data": {"node": None}})
+
+
+# --- Profiling ---------------------------------------------------------------
+
+class ProfilingTests(TestCase):
+    databases = "__all__"
+
+    query = json.dumps({"query": "query ProfiledHello { hello }"})
+
+    def test_authorized_request_is_profiled(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(GRAPHQL_PROFILING={"TOKEN": "secret", "DIRECTORY": directory, "TOP": 5}):
+                response = self.client.post(
+                    "/graphql", self.query, content_type="application/json",
+                    HTTP_X_PROFILE="secret", HTTP_X_PROFILE_MEMORY="1",
+                )
+            profile = response.json()["extensions"]["profile"]
+            self.assertEqual(profile["operation"], "ProfiledHello")
+            self.assertLessEqual(len(profile["topFunctions"]), 5)
+            self.assertIn("topAllocations", profile)
+            self.assertTrue(os.path.exists(profile["pstats"]))
+            self.assertTrue(os.path.exists(profile["allocations"]))
+
+    def test_other_requests_are_not_profiled(self):
+        with override_settings(GRAPHQL_PROFILING={"TOKEN": "secret"}):
+            for headers in ({}, {"HTTP_X_PROFILE": "wrong"}):
+                response = self.client.post("/graphql", self.query, content_type="application/json", **headers)
+                self.assertEqual(response.json(), {"data": {"hello": "Hello, GraphQL!"}})
+
+
+# --- Sharding ----------------------------------------------------------------
+#
+# ShardingTests only run with shards configured; the last test runs the whole
+# suite in a subprocess with CRM_SHARDS=2, so the plain test run covers them
+# and the rest of the suite against shards too.
+
+
+@skipUnless(settings.CRM_SHARDS, "needs CRM_SHARDS")
+class ShardingTests(TestCase):
+    databases = {"default", *settings.CRM_SHARDS}
+
+    @classmethod
+    def setUpTestData(cls):
+        from crm import sharding
+
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.products = [
+                Product.objects.create(name=f"Shard product {i}", price=Decimal(10 * (i + 1)), stock=100)
+                for i in range(3)
+            ]
+        cls.customers = [
+            Customer.objects.create(name=f"Shard customer {i:02}", email=f"shard{i}@example.com")
+            for i in range(20)
+        ]
+        cls.orders = []
+        for i, customer in enumerate(cls.customers):
+            order = Order.objects.create(customer=customer, order_date=timezone.now() - timedelta(days=i))
+            order.products.set(cls.products[:i % 3 + 1])
+            cls.orders.append(order)
+        cls.shards = {sharding.db_for_pk(customer.pk) for customer in cls.customers}
+
+    def query(self, query, variables=None):
+        response = self.client.post(
+            "/graphql", json.dumps({"query": query, "variables": variables or {}}), content_type="application/json"
+        )
+        result = response.json()
+        self.assertNotIn("errors", result)
+        return result["data"]
+
+    def test_rows_are_stored_in_their_customers_shard(self):
+        from crm import sharding
+
+        self.assertEqual(self.shards, set(settings.CRM_SHARDS))
+        for customer, order in zip(self.customers, self.orders):
+            shard = sharding.db_for_pk(customer.pk)
+            self.assertEqual(sharding.db_for_pk(order.pk), shard)
+            self.assertTrue(Order.objects.using(shard).filter(pk=order.pk, customer_id=customer.pk).exists())
+            self.assertFalse(Customer.objects.using("default").filter(pk=customer.pk).exists())
+            self.assertEqual(order.products.count(), self.orders.index(order) % 3 + 1)
+        for shard in settings.CRM_SHARDS:
+            self.assertEqual(Product.objects.using(shard).count(), len(self.products))
+
+    def test_product_links_keep_their_constraint_outside_shards(self):
+        from django.db import connections
+
+        def product_constraints(alias):
+            with connections[alias].cursor() as cursor:
+                constraints = connections[alias].introspection.get_constraints(cursor, "crm_order_products")
+            return [c["foreign_key"] for c in constraints.values() if c["foreign_key"] and c["foreign_key"][0] == "crm_product"]
+
+        self.assertEqual(product_constraints("default"), [("crm_product", "id")])
+        for shard in settings.CRM_SHARDS:
+            self.assertEqual(product_constraints(shard), [])
+
+    def test_all_orders_merges_shards_in_order(self):
+        query = """query($after: String) { allOrders(first: 7, after: $after, orderBy: "-order_date") {
+                       totalCount pageInfo { endCursor hasNextPage } edges { node { numericId totalAmount } } } }"""
+        expected = sorted(self.orders, key=lambda order: order.order_date, reverse=True)
+        seen, after = [], None
+        while True:
+            page = self.query(query, {"after": after})["allOrders"]
+            self.assertEqual(page["totalCount"], len(self.orders))
+            seen.extend(edge["node"]["numericId"] for edge in page["edges"])
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+        self.assertEqual(seen, [order.pk for order in expected])
+
+        # Product filters join each shard's copy of the products
+        data = self.query('query { allOrders(first: 50, filter: { productName: "product 2" }) { totalCount } }')
+        self.assertEqual(data["allOrders"]["totalCount"], len(self.orders[2::3]))
+
+    def test_all_customers_and_nodes_read_across_shards(self):
+        data = self.query('query { allCustomers(first: 5, offset: 3, orderBy: "-name") { edges { node { name } } } }')
+        names = sorted((customer.name for customer in self.customers), reverse=True)[3:8]
+        self.assertEqual([edge["node"]["name"] for edge in data["allCustomers"]["edges"]], names)
+
+        ids = [to_global_id("OrderType", order.pk) for order in self.orders[:4]]
+        ids += [to_global_id("CustomerType", customer.pk) for customer in self.customers[:4]]
+        data = self.query(
+            """query($ids: [ID!]!) { nodes(ids: $ids) {
+                   ... on OrderType { numericId customer { numericId } products { numericId } }
+                   ... on CustomerType { numericId } } }""",
+            {"ids": ids},
+        )
+        nodes = data["nodes"]
+        self.assertEqual(
+            [node["numericId"] for node in nodes],
+            [order.pk for order in self.orders[:4]] + [customer.pk for customer in self.customers[:4]],
+        )
+        for node, order in zip(nodes[:4], self.orders):
+            self.assertEqual(node["customer"]["numericId"], order.customer_id)
+            self.assertEqual(len(node["products"]), order.products.count())
+
+    def test_customer_writes_keep_emails_unique_across_shards(self):
+        from crm import sharding
+
+        mutation = """mutation($input: CustomerInput!, $upsert: Boolean) {
+                          createCustomer(input: $input, upsert: $upsert) { success message customer { numericId name } } }"""
+        existing = self.customers[3]
+        result = self.query(mutation, {"input": {"name": "Dup", "email": existing.email}})["createCustomer"]
+        self.assertEqual(result["success"], False)
+
+        # A customer created before shards were added, outside its email's shard
+        other = next(alias for alias in settings.CRM_SHARDS if alias != sharding.db_for_email("legacy@example.com"))
+        legacy = Customer(name="Legacy", email="legacy@example.com")
+        legacy.pk = sharding.reserve_ids("customer", 1) << sharding.SHARD_BITS | settings.CRM_SHARDS.index(other)
+        legacy.save(force_insert=True)
+        for customer in (existing, legacy):
+            result = self.query(mutation, {"input": {"name": "Renamed", "email": customer.email}, "upsert": True})
+            self.assertEqual(result["createCustomer"]["customer"], {"numericId": customer.pk, "name": "Renamed"})
+            self.assertEqual(
+                sum(Customer.objects.using(alias).filter(email=customer.email).count() for alias in settings.CRM_SHARDS),
+                1,
+            )
+
+        result = self.query(mutation, {"input": {"name": "New", "email": "new@example.com"}, "upsert": True})
+        pk = result["createCustomer"]["customer"]["numericId"]
+        self.assertEqual(sharding.db_for_pk(pk), sharding.db_for_email("new@example.com"))
+
+    def test_order_write_rolls_back_in_the_shard(self):
+        from crm import sharding
+
+        customer = self.customers[0]
+        mutation = """mutation($input: OrderInput!) { createOrder(input: $input) { success } }"""
+        variables = {"input": {"customerId": customer.pk, "productIds": [self.products[0].pk]}}
+        with mock.patch("crm.schema.consume_stock", side_effect=RuntimeError("stock")):
+            result = graphql(self.client, mutation, variables)
+        self.assertEqual(result["errors"][0]["message"], "stock")
+        self.assertEqual(Order.objects.using(sharding.db_for(customer)).filter(customer=customer).count(), 1)
+
+    def test_jobs_run_in_every_shard(self):
+        from crm import cron, sharding
+        from crm.archive import archive_orders
+        from crm.models import Watermark
+        from crm.reminders import send_order_reminders
+
+        Watermark.objects.filter(name="order_reminders").update(order_created_at=None)
+        sent = []
+        with override_settings(REMINDER_SETTLE_SECONDS=0):
+            send_order_reminders(sent.append, batch_size=3)
+        self.assertEqual({order.pk for order in sent}, {order.pk for order in self.orders[:7]})
+
+        self.assertEqual(archive_orders(timezone.now() - timedelta(days=10, hours=12), batch_size=4), 9)
+        for alias in settings.CRM_SHARDS:
+            for archived in ArchivedOrder.objects.using(alias):
+                self.assertEqual(sharding.db_for_pk(archived.pk), alias)
+        self.assertEqual(sum(ArchivedOrder.objects.using(alias).count() for alias in settings.CRM_SHARDS), 9)
+
+        # Only customers 0-4 have no orders within the year
+        inactive = [customer.pk for customer in self.customers[:5]]
+        for alias in settings.CRM_SHARDS:
+            Order.objects.using(alias).filter(customer_id__in=inactive).update(
+                order_date=timezone.now() - timedelta(days=400)
+            )
+        with mock.patch.object(cron, "cleanup_log_path", os.devnull), redirect_stdout(io.StringIO()):
+            cron.clean_inactive_customers()
+        remaining = {
+            pk for alias in settings.CRM_SHARDS for pk in Customer.objects.using(alias).values_list("pk", flat=True)
+        }
+        self.assertEqual(remaining, {customer.pk for customer in self.customers[5:]})
+
+    def test_backfill_moves_rows_written_before_sharding(self):
+        from django.core.management import call_command
+
+        from crm import sharding
+        from crm.models import ChangeEvent, OrderReminder
+
+        # As written by an unsharded deployment: plain ids, all in the default database
+        placed = timezone.now() - timedelta(days=30)
+        Customer.objects.using("default").bulk_create([
+            Customer(id=1, name="Legacy", email="legacy@example.com", created_at=placed),
+        ])
+        Order.objects.using("default").bulk_create([Order(id=1, customer_id=1, order_date=placed)])
+        Order.objects.using("default").filter(pk=1).update(created_at=placed)
+        Order.products.through.objects.using("default").create(order_id=1, product_id=self.products[0].pk)
+        ArchivedOrder.objects.using("default").bulk_create([ArchivedOrder(id=2, customer_id=1, order_date=placed)])
+        ArchivedOrder.products.through.objects.using("default").create(
+            archivedorder_id=2, product_id=self.products[1].pk
+        )
+        OrderReminder.objects.create(order_id=1, email="legacy@example.com")
+
+        out = io.StringIO()
+        call_command("backfill_shards", batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Moved 1 customer(s) into 2 shard(s).")
+        for model in (Customer, Order, ArchivedOrder):
+            self.assertFalse(model.objects.using("default").exists())
+
+        customer = sharding.find_customer("legacy@example.com")
+        self.assertEqual(sharding.db_for(customer), sharding.db_for_email(customer.email))
+        self.assertEqual(customer.created_at, placed)
+        order, archived = customer.orders.get(), customer.archived_orders.get()
+        self.assertEqual(order.created_at, placed)
+        self.assertEqual(OrderReminder.objects.get().order_id, order.pk)
+        data = self.query(
+            """query { allOrders(includeArchived: true, filter: { customerName: "Legacy" }) {
+                           edges { node { numericId totalAmount } } } }"""
+        )
+        self.assertEqual(
+            sorted((edge["node"]["numericId"], edge["node"]["totalAmount"]) for edge in data["allOrders"]["edges"]),
+            sorted([(order.pk, 10.0), (archived.pk, 20.0)]),
+        )
+        events = {(event.entity, event.entity_id, event.action, tuple(event.data.items()))
+                  for event in ChangeEvent.objects.all()}
+        self.assertEqual(events, {
+            ("customer", 1, ChangeEvent.DELETED, (("moved_to", customer.pk),)),
+            ("customer", customer.pk, ChangeEvent.CREATED, (("moved_from", 1),)),
+            ("order", 1, ChangeEvent.DELETED, (("moved_to", order.pk),)),
+            ("order", order.pk, ChangeEvent.CREATED, (("moved_from", 1),)),
+            ("order", 2, ChangeEvent.DELETED, (("moved_to", archived.pk),)),
+            ("order", archived.pk, ChangeEvent.CREATED, (("moved_from", 2),)),
+        })
+
+
+class ShardedRunTests(SimpleTestCase):
+    def test_suite_passes_with_two_shards(self):
+        if settings.CRM_SHARDS:
+            self.skipTest("already running sharded")
+        result = subprocess.run(
+            [sys.executable, "-W", "ignore", "manage.py", "test", "crm", "-v", "2"],
+            cwd=settings.BASE_DIR, env={**os.environ, "CRM_SHARDS": "2"},
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn("needs CRM_SHARDS", result.stderr)
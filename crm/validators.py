@@ -0,0 +1,10 @@
+"""Input checks shared by createCustomer and the bulk customer paths."""
+import re
+
+PHONE_PATTERN = r"^(?:\+\d{10,15}|\d{3}-\d{3}-\d{4})$"
+PHONE_MESSAGE = "Invalid phone number format, Examples: +1234567890 or 123-456-7890"
+
+
+def valid_phone(phone):
+    """True for an empty phone (it's optional) or one matching PHONE_PATTERN."""
+    return not phone or re.match(PHONE_PATTERN, phone) is not None
@@ -1,3 +1,270 @@
-from django.shortcuts import render
+import gzip
+import io
+import json
+import re
+import time
+from functools import lru_cache
 
-# Create your views here.
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotModified
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from graphene_django.views import GraphQLView, HttpError
+from graphql import FieldNode, get_operation_ast, parse
+
+from crm import coalesce, introspection, metrics
+from crm.sqllog import current_operation
+from crm.encoders import get_encoder
+
+re_qvalue = re.compile(r"\bq\s*=\s*(\d+(?:\.\d*)?)")
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip; "gzip;q=0" refuses it."""
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() == "gzip":
+            qvalue = re_qvalue.search(params)
+            return qvalue is None or float(qvalue.group(1)) > 0
+    return False
+
+
+def graphql_body(request):
+    """
+    request.body, limited by GRAPHQL_MAX_BODY_BYTES instead of Django's
+    DATA_UPLOAD_MAX_MEMORY_SIZE: background bulk jobs take far bigger
+    bodies than forms do.
+    """
+    if not hasattr(request, "_body"):
+        limit = getattr(settings, "GRAPHQL_MAX_BODY_BYTES", settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if limit is not None and length > limit:
+            raise RequestDataTooBig(f"Request body exceeded GRAPHQL_MAX_BODY_BYTES ({limit}).")
+        # What HttpRequest.body does, minus its size check
+        request._body = request.read()
+        request._stream = io.BytesIO(request._body)
+    return request._body
+
+
+def json_body(request):
+    """The JSON request body, decoded once per request; raises ValueError if it isn't JSON."""
+    if not hasattr(request, "_crm_json_body"):
+        try:
+            request._crm_json_body = json.loads(graphql_body(request))
+        except ValueError as e:
+            request._crm_json_body = e
+    if isinstance(request._crm_json_body, ValueError):
+        raise request._crm_json_body
+    return request._crm_json_body
+
+
+@lru_cache(maxsize=256)
+def operation_labels(query, operation_name):
+    """(name, type) of the operation a request executes; see metrics.bounded_label() for the name."""
+    try:
+        operation = get_operation_ast(parse(query, no_location=True), operation_name)
+    except Exception:
+        return "invalid", "invalid"
+    if operation is None:
+        return "invalid", "invalid"
+    name = operation_name or (operation.name.value if operation.name else "anonymous")
+    return name, operation.operation.value
+
+
+@lru_cache(maxsize=256)
+def root_field_names(query, operation_name):
+    """{response key: schema field name} of the operation's top-level fields, aliases resolved."""
+    try:
+        operation = get_operation_ast(parse(query, no_location=True), operation_name)
+    except Exception:
+        return {}
+    if operation is None:
+        return {}
+    return {
+        (selection.alias or selection.name).value: selection.name.value
+        for selection in operation.selection_set.selections
+        if isinstance(selection, FieldNode)
+    }
+
+
+class SQLCounter:
+    """connection.execute_wrapper() hook counting statements and their time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQLView that also accepts a JSON array of operations in a single POST.
+
+    A plain JSON object is handled exactly like the stock view. An array is
+    executed as a batch: every operation runs against the same request, so
+    the per-request loaders (see crm.loaders) are shared across the batch,
+    and the response is an array of results in the same order.
+
+    Responses are encoded with crm.encoders (orjson when available) and
+    gzipped when the client accepts it and the body is at least
+    GRAPHQL_GZIP_MIN_BYTES long.
+
+    Introspection operations are answered from crm.introspection's cache
+    with an ETag; a matching If-None-Match gets a 304. Identical concurrent
+    read queries share one execution, see crm.coalesce.
+    """
+    max_batch_size = None
+    encoder = None
+    etag = None
+
+    def __init__(self, max_batch_size=None, encoder=None, **kwargs):
+        super().__init__(**kwargs)
+        if max_batch_size is None:
+            max_batch_size = getattr(settings, "GRAPHQL_MAX_BATCH_SIZE", 10)
+        self.max_batch_size = max_batch_size
+        self.encoder = encoder or self.encoder or get_encoder()
+
+    @classmethod
+    def can_display_graphiql(cls, request, data):
+        # A batch is always executed, whatever the Accept header prefers
+        return not isinstance(data, list) and super().can_display_graphiql(request, data)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if self.etag and response.status_code == 200:
+            if self.etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+                response = HttpResponseNotModified()
+            response["ETag"] = self.etag
+            response["Cache-Control"] = "no-cache"
+        if response.get("Content-Type") == "application/json":
+            self.compress(request, response)
+        return response
+
+    def json_encode(self, request, d, pretty=False):
+        pretty = self.pretty or pretty or bool(request.GET.get("pretty"))
+        return self.encoder.encode(d, pretty=pretty)
+
+    @staticmethod
+    def compress(request, response):
+        patch_vary_headers(response, ("Accept-Encoding",))
+        min_bytes = getattr(settings, "GRAPHQL_GZIP_MIN_BYTES", 1024)
+        if (
+            len(response.content) < min_bytes
+            or response.has_header("Content-Encoding")
+            or not accepts_gzip(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        ):
+            return
+        response.content = gzip.compress(
+            response.content, compresslevel=getattr(settings, "GRAPHQL_GZIP_LEVEL", 5)
+        )
+        response["Content-Encoding"] = "gzip"
+        response["Content-Length"] = str(len(response.content))
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+
+        def execute():
+            return super(CRMGraphQLView, self).get_response(request, data, show_graphiql)
+
+        if self.batch or not query or show_graphiql:
+            return execute()
+
+        if introspection.is_introspection(query, operation_name):
+            pretty = self.pretty or bool(request.GET.get("pretty"))
+            body, status_code, self.etag = introspection.cached_response(
+                self.schema.graphql_schema, query, variables, operation_name, pretty, execute,
+            )
+            return body, status_code
+        label = metrics.bounded_label("operation", operation_labels(query, operation_name)[0])
+        return coalesce.execute(request, query, variables, operation_name, execute, label=label)
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if not query:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+
+        name, operation_type = operation_labels(query, operation_name)
+        sql = SQLCounter()
+        operation_token = current_operation.set(name)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(sql):
+                result = super().execute_graphql_request(
+                    request, data, query, variables, operation_name, show_graphiql
+                )
+        finally:
+            labels = {"operation": metrics.bounded_label("operation", name), "type": operation_type}
+            metrics.observe("crm_graphql_request_duration_seconds", time.perf_counter() - start, **labels)
+            metrics.inc("crm_graphql_requests_total", **labels)
+            metrics.inc("crm_graphql_sql_queries_total", sql.queries, **labels)
+            metrics.inc("crm_graphql_sql_seconds_total", sql.seconds, **labels)
+            current_operation.reset(operation_token)
+
+        for error in (result.errors if result else None) or []:
+            path = getattr(error, "path", None)
+            # The schema field, not the alias the client picked
+            field = root_field_names(query, operation_name).get(path[0], "other") if path else ""
+            metrics.inc(
+                "crm_graphql_errors_total",
+                operation=labels["operation"], field=metrics.bounded_label("field", field),
+            )
+        return result
+
+    def parse_body(self, request):
+        if request.method == "POST":
+            # Read once here, so the stock view's request.body finds it
+            graphql_body(request)
+        # A new view instance is created per request, so toggling batch
+        # mode here does not leak into other requests.
+        self.batch = (
+            self.get_content_type(request) == "application/json"
+            and graphql_body(request).lstrip()[:1] == b"["
+        )
+        if self.get_content_type(request) == "application/json":
+            # Usually decoded already by GraphQLRateLimitMiddleware
+            try:
+                data = json_body(request)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+            if self.batch and not data:
+                raise HttpError(HttpResponseBadRequest("Received an empty list in the batch request."))
+            if not self.batch and not isinstance(data, dict):
+                raise HttpError(HttpResponseBadRequest("The received data is not a valid JSON query."))
+        else:
+            data = super().parse_body(request)
+
+        if self.batch and self.max_batch_size and len(data) > self.max_batch_size:
+            raise HttpError(
+                HttpResponseBadRequest(
+                    f"Batch contains {len(data)} operations, the maximum is {self.max_batch_size}."
+                )
+            )
+        if self.batch and not all(isinstance(entry, dict) for entry in data):
+            raise HttpError(
+                HttpResponseBadRequest("Every entry of a batch request must be a JSON object.")
+            )
+        return data
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint aggregating every worker process on this host."""
+    if not getattr(settings, "METRICS_ENABLED", True):
+        return HttpResponseNotFound()
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )